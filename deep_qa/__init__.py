@@ -1,2 +1,2 @@
-from .run import run_model, evaluate_model, load_model, score_dataset, score_dataset_with_ensemble
-from .run import compute_accuracy, run_model_from_file
+from .run import run_model, evaluate_model, load_model, predict, score_dataset, score_dataset_with_ensemble
+from .run import compute_accuracy, run_model_from_file, calibrate_adaptive_batch_sizes
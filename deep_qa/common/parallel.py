@@ -0,0 +1,251 @@
+"""
+Helpers for spreading data processing (reading, tokenizing, indexing, building batches) over a
+pool of worker processes or threads.
+
+We use ``fork`` to start worker processes, so the function being applied, and anything it refers
+to (like a ``DataIndexer``, or the full list of instances in a dataset), is inherited by the
+workers instead of being pickled and sent to them.  Only the items and the results are pickled,
+and :func:`prefetch_imap` can avoid even that for numpy arrays in the results.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List
+import multiprocessing
+
+import numpy
+
+# The function that the worker processes apply.  This is set right before we fork the workers, so
+# they inherit it.  This means you can't run two pools at the same time from the same process, but
+# we never do that.
+_worker_function = None  # pylint: disable=invalid-name
+
+
+def _apply_to_chunk(chunk: List[Any]) -> List[Any]:
+    return [_worker_function(item) for item in chunk]  # pylint: disable=not-callable
+
+
+def _group_into_chunks(items: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parallel_imap(function: Callable[[Any], Any],
+                  items: Iterable[Any],
+                  num_workers: int,
+                  chunk_size: int=1000,
+                  initializer: Callable[[], None]=None) -> Iterator[Any]:
+    """
+    Applies ``function`` to each of the ``items``, using ``num_workers`` forked processes, and
+    yields the results `in the same order as the items`, so the output is identical to
+    ``map(function, items)``.
+
+    ``items`` is consumed lazily, ``chunk_size`` items at a time, and we only keep a few chunks per
+    worker in flight, so this is fine to use on a generator over a large file, and you can stop
+    consuming the results early without the rest of ``items`` being read.
+
+    If you have a large list of objects already in memory, it's much cheaper to pass
+    ``range(len(objects))`` as ``items`` and have ``function`` look the objects up, as then only the
+    integers get pickled.
+
+    Parameters
+    ----------
+    function: Callable[[Any], Any]
+        The function to apply.  This does not need to be picklable, as it is inherited by the
+        workers; it can be a lambda or a closure.  Its return values do need to be picklable.
+    items: Iterable[Any]
+        The inputs to ``function``.  These must be picklable.
+    num_workers: int
+        How many processes to use.  If this is 1 or less, we don't start any processes, and just
+        apply ``function`` in the current process.
+    chunk_size: int, optional (default=1000)
+        How many items to send to a worker at once.
+    initializer: Callable[[], None], optional (default=None)
+        If given, this is called once in each worker when it starts, before it processes any
+        items.  It is `not` called in the serial case.
+    """
+    if num_workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+    global _worker_function  # pylint: disable=global-statement,invalid-name
+    _worker_function = function
+    context = multiprocessing.get_context('fork')
+    try:
+        with context.Pool(num_workers, initializer=initializer) as pool:
+            pending_results = deque()
+            for chunk in _group_into_chunks(items, chunk_size):
+                pending_results.append(pool.apply_async(_apply_to_chunk, (chunk,)))
+                if len(pending_results) >= 2 * num_workers:
+                    yield from pending_results.popleft().get()
+            while pending_results:
+                yield from pending_results.popleft().get()
+    finally:
+        _worker_function = None
+
+
+def parallel_map(function: Callable[[Any], Any],
+                 items: Iterable[Any],
+                 num_workers: int,
+                 chunk_size: int=1000,
+                 initializer: Callable[[], None]=None) -> List[Any]:
+    """
+    Like :func:`parallel_imap`, but returns a list instead of a generator.
+    """
+    return list(parallel_imap(function, items, num_workers, chunk_size, initializer))
+
+
+# Used by the worker processes of ``prefetch_imap``.  These are set in each worker by
+# ``_initialize_prefetch_worker`` when it starts, so different pools don't interfere with each
+# other.
+_prefetch_function = None  # pylint: disable=invalid-name
+_prefetch_slots = None  # pylint: disable=invalid-name
+
+# We start each array in a shared memory slot at a multiple of this many bytes.
+_SLOT_ALIGNMENT = 64
+
+
+class _SharedArray:
+    """
+    Stands in for a numpy array that a worker process wrote into a shared memory slot, in the
+    (small) result that gets pickled and sent back to the main process.
+    """
+    def __init__(self, offset: int, shape: tuple, dtype: str):
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+
+def _initialize_prefetch_worker(function: Callable[[Any], Any], slots: List[numpy.array]):
+    global _prefetch_function, _prefetch_slots  # pylint: disable=global-statement,invalid-name
+    _prefetch_function = function
+    _prefetch_slots = slots
+
+
+def _apply_into_slot(slot_and_item):
+    slot, item = slot_and_item
+    result = _prefetch_function(item)  # pylint: disable=not-callable
+    encoded = _write_arrays(result, _prefetch_slots[slot], [0])
+    if encoded is None:
+        # The arrays didn't fit into the slot, so we just let multiprocessing pickle the result.
+        return False, result
+    return True, encoded
+
+
+def _write_arrays(value: Any, buffer: numpy.array, position: List[int]) -> Any:
+    """
+    Copies the numpy arrays in ``value`` (which may be nested in tuples and lists) into
+    ``buffer``, starting at ``position[0]``, and returns ``value`` with the arrays replaced by
+    ``_SharedArrays``.  Returns ``None`` if they don't fit.
+    """
+    if isinstance(value, numpy.ndarray) and not value.dtype.hasobject:
+        start = -(-position[0] // _SLOT_ALIGNMENT) * _SLOT_ALIGNMENT
+        end = start + value.nbytes
+        if end > len(buffer):
+            return None
+        buffer[start:end] = numpy.ascontiguousarray(value).reshape(-1).view(numpy.uint8)
+        position[0] = end
+        return _SharedArray(start, value.shape, value.dtype.str)
+    if isinstance(value, (tuple, list)):
+        encoded = []
+        for item in value:
+            encoded_item = _write_arrays(item, buffer, position)
+            if encoded_item is None and item is not None:
+                return None
+            encoded.append(encoded_item)
+        return type(value)(encoded)
+    return value
+
+
+def _read_arrays(value: Any, buffer: numpy.array) -> Any:
+    """
+    The inverse of ``_write_arrays``.  We copy the arrays out of ``buffer``, so the slot can be
+    reused straight away.
+    """
+    if isinstance(value, _SharedArray):
+        dtype = numpy.dtype(value.dtype)
+        count = int(numpy.prod(value.shape))
+        return numpy.frombuffer(buffer, dtype=dtype, count=count,
+                                offset=value.offset).reshape(value.shape).copy()
+    if isinstance(value, (tuple, list)):
+        return type(value)(_read_arrays(item, buffer) for item in value)
+    return value
+
+
+def prefetch_imap(function: Callable[[Any], Any],
+                  items: Iterable[Any],
+                  num_workers: int,
+                  num_prefetched: int=None,
+                  use_processes: bool=False,
+                  slot_size_mb: float=32) -> Iterator[Any]:
+    """
+    Applies ``function`` to each of the ``items`` in the background, using ``num_workers`` threads
+    or forked processes, and yields the results in the same order as the items.  Unlike
+    :func:`parallel_imap`, which is built for throughput over large inputs, this is built for
+    producing results one at a time just ahead of a consumer (like batches of training data just
+    ahead of the model): we keep working on up to ``num_prefetched`` items ahead of the one the
+    consumer is waiting for.
+
+    Threads are cheap to start and share everything, but only help if ``function`` spends most of
+    its time outside the GIL (e.g., in numpy).  Processes are started with ``fork``, so, as in
+    :func:`parallel_imap`, ``function`` is inherited by the workers, not pickled.  Their results
+    come back through a ring of ``num_prefetched`` shared memory slots of ``slot_size_mb``
+    megabytes each: numpy arrays in the results (possibly nested in tuples and lists) are written
+    into a slot by the worker and copied out by this process, and only a small description of
+    them is pickled.  Results with arrays that don't fit in a slot are pickled as a whole.
+
+    If ``num_workers`` is less than 1, we just apply ``function`` in the current process, when
+    each result is asked for.
+    """
+    if num_workers < 1:
+        for item in items:
+            yield function(item)
+        return
+    if num_prefetched is None:
+        num_prefetched = 2 * num_workers
+    num_prefetched = max(num_prefetched, num_workers)
+    if not use_processes:
+        with ThreadPoolExecutor(num_workers) as executor:
+            pending_results = deque()
+            for item in items:
+                pending_results.append(executor.submit(function, item))
+                if len(pending_results) > num_prefetched:
+                    yield pending_results.popleft().result()
+            while pending_results:
+                yield pending_results.popleft().result()
+        return
+    context = multiprocessing.get_context('fork')
+    slot_size = int(slot_size_mb * 1024 * 1024)
+    slots = [numpy.frombuffer(context.RawArray('b', slot_size), dtype=numpy.uint8)
+             for _ in range(num_prefetched)]
+    with context.Pool(num_workers, initializer=_initialize_prefetch_worker,
+                      initargs=(function, slots)) as pool:
+        pending_results = deque()
+        for index, item in enumerate(items):
+            if len(pending_results) == num_prefetched:
+                # The oldest pending result is in the slot we're about to reuse, so we read it
+                # before handing out the next item.
+                result = _read_slot_result(pending_results.popleft(), slots)
+                pending_results.append(_submit_to_slot(pool, item, index % num_prefetched))
+                yield result
+            else:
+                pending_results.append(_submit_to_slot(pool, item, index % num_prefetched))
+        while pending_results:
+            yield _read_slot_result(pending_results.popleft(), slots)
+
+
+def _submit_to_slot(pool, item: Any, slot: int):
+    return slot, pool.apply_async(_apply_into_slot, ((slot, item),))
+
+
+def _read_slot_result(pending_result, slots: List[numpy.array]) -> Any:
+    slot, async_result = pending_result
+    in_slot, result = async_result.get()
+    if in_slot:
+        return _read_arrays(result, slots[slot])
+    return result
@@ -1,6 +1,10 @@
 from itertools import zip_longest
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
+import os
 import random
+import resource
+
+import numpy
 
 
 def group_by_count(iterable: List[Any], count: int, default_value: Any) -> List[List[Any]]:
@@ -64,3 +68,199 @@ def clean_layer_name(input_name: str,
         input_name = '_'.join(input_name.split('_')[:-1])
 
     return input_name
+
+
+def get_memory_usage_bytes() -> int:
+    """
+    Returns the resident set size of the current process, in bytes.  We read this from
+    ``/proc/self/statm`` where it's available (i.e., on Linux), as that gives the `current` usage.
+    Elsewhere we fall back to ``resource.getrusage``, which only gives the `peak` usage, in
+    kilobytes on Linux and in bytes on OSX.
+    """
+    try:
+        with open('/proc/self/statm') as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if os.uname().sysname == 'Darwin':
+            return max_rss
+        return max_rss * 1024
+
+
+def reset_peak_memory_usage() -> bool:
+    """
+    Resets the peak resident set size of the current process, so that
+    :func:`get_peak_memory_usage_bytes` measures the peak from now on.  This only works on Linux
+    (by writing to ``/proc/self/clear_refs``); we return whether it worked.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs_file:
+            clear_refs_file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_memory_usage_bytes() -> int:
+    """
+    Returns the peak resident set size of the current process, in bytes, since it started or
+    since the last call to :func:`reset_peak_memory_usage`.  We read this from ``/proc/self/status``
+    where it's available, and fall back to ``resource.getrusage`` elsewhere.
+    """
+    try:
+        with open('/proc/self/status') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if os.uname().sysname == 'Darwin':
+        return max_rss
+    return max_rss * 1024
+
+
+def get_available_memory_bytes() -> int:
+    """
+    Returns how much more memory processes on this machine can use without swapping, in bytes.  We
+    read ``MemAvailable`` from ``/proc/meminfo`` where it's available, and otherwise just return
+    the total physical memory.
+    """
+    try:
+        with open('/proc/meminfo') as meminfo_file:
+            for line in meminfo_file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def format_bytes(num_bytes: float) -> str:
+    """
+    Formats a number of bytes as a human-readable string, like "1.5 GB".
+    """
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(num_bytes) < 1024.0:
+            return "%.1f %s" % (num_bytes, unit)
+        num_bytes /= 1024.0
+    return "%.1f TB" % num_bytes
+
+
+def flatten_ragged(sequences: List[Any], depth: int) -> Tuple[numpy.array, List[numpy.array]]:
+    """
+    Converts a list of (possibly nested) lists of integers, like ``[[1, 2], [3]]`` or ``[[[1, 2],
+    [3]], [[4]]]``, into a single flat ``int32`` array of values, plus one array of offsets for
+    each level of nesting, like the row pointers in a CSR sparse matrix.  The items in
+    ``sequences`` are described by ``offsets[0]``: item ``i`` contains the entries
+    ``offsets[0][i]:offsets[0][i + 1]`` of the next level down, and so on, until the last level,
+    whose offsets index into ``values``.
+
+    ``depth`` is the number of levels of lists `inside` ``sequences`` (so 1 for a list of lists of
+    ints).  This is the inverse of :func:`unflatten_ragged`.  We raise a ``ValueError`` if the
+    leaves aren't all integers.
+    """
+    current = sequences
+    offsets = []
+    for _ in range(depth):
+        lengths = numpy.fromiter((len(item) for item in current), dtype=numpy.int64, count=len(current))
+        level_offsets = numpy.zeros(len(current) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=level_offsets[1:])
+        offsets.append(level_offsets)
+        current = [value for item in current for value in item]
+    if not all(isinstance(value, (int, numpy.integer)) and not isinstance(value, bool) for value in current):
+        raise ValueError("Found non-integer values in a ragged sequence")
+    return numpy.asarray(current, dtype=numpy.int32), offsets
+
+
+def unflatten_ragged(values: numpy.array, offsets: List[numpy.array]) -> List[Any]:
+    """
+    The inverse of :func:`flatten_ragged`, giving back nested lists of python ``ints``.
+    """
+    current = values.tolist()
+    for level_offsets in reversed(offsets):
+        bounds = level_offsets.tolist()
+        current = [current[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    return current
+
+
+def get_ragged_item(values: numpy.array, offsets: List[numpy.array], index: int) -> List[Any]:
+    """
+    Returns item ``index`` of the ragged sequences described by ``values`` and ``offsets`` (see
+    :func:`flatten_ragged`) as nested lists of python ``ints``, without unflattening everything
+    else.  This is the same as ``unflatten_ragged(values, offsets)[index]``.
+    """
+    start, end = index, index + 1
+    level_bounds = []
+    for level_offsets in offsets:
+        bounds = level_offsets[start:end + 1].tolist()
+        level_bounds.append(bounds)
+        start, end = bounds[0], bounds[-1]
+    current = values[start:end].tolist()
+    # The first level of bounds just covers the item itself, so we don't split on it.
+    for bounds in reversed(level_bounds[1:]):
+        base = bounds[0]
+        current = [current[begin - base:finish - base] for begin, finish in zip(bounds[:-1], bounds[1:])]
+    return current
+
+
+def pad_ragged(sequences: List[Any],
+               padded_shape: Tuple[int, ...],
+               truncate_from_right: Tuple[bool, ...]) -> numpy.array:
+    """
+    Pads (or truncates) a list of (possibly nested) lists of integers into one zero-padded
+    ``int32`` array of shape ``(len(sequences),) + padded_shape``.  Instead of padding each list in
+    python, we allocate the output once and copy the integers into it, working out where each of
+    them goes with vectorized numpy operations when the lists are nested.
+
+    ``truncate_from_right`` has one entry per level of nesting (so, like ``padded_shape``, one for
+    a list of lists of ints).  At levels where it's ``True``, lists that are too long keep their
+    `last` items and short lists are padded at the front; where it's ``False``, we keep the first
+    items and pad at the end.  This matches
+    :func:`~deep_qa.data.instances.instance.IndexedInstance.pad_sequence_to_length`.
+    """
+    padded = numpy.zeros((len(sequences),) + tuple(padded_shape), dtype=numpy.int32)
+    if len(padded_shape) == 1:
+        # With just one level, copying each list into its row with a slice assignment is faster,
+        # and allocates less, than working out positions for every integer.
+        length = padded_shape[0]
+        for row, sequence in zip(padded, sequences):
+            if truncate_from_right[0]:
+                sequence = sequence[-length:] if length > 0 else []
+                row[length - len(sequence):] = sequence
+            else:
+                sequence = sequence[:length]
+                row[:len(sequence)] = sequence
+        return padded
+    values, offsets = flatten_ragged(sequences, len(padded_shape))
+    return pad_flattened_ragged(values, offsets, padded_shape, truncate_from_right)
+
+
+def pad_flattened_ragged(values: numpy.array,
+                         offsets: List[numpy.array],
+                         padded_shape: Tuple[int, ...],
+                         truncate_from_right: Tuple[bool, ...]) -> numpy.array:
+    """
+    The same as :func:`pad_ragged`, for sequences that are already flattened into ``values`` and
+    ``offsets`` (see :func:`flatten_ragged`), so there's one array of offsets for each entry in
+    ``padded_shape``.  This never builds python lists, so if you already have the sequences in
+    this form, it's a good deal faster than unflattening them and calling ``pad_ragged``.
+    """
+    num_sequences = len(offsets[0]) - 1
+    padded = numpy.zeros((num_sequences,) + tuple(padded_shape), dtype=numpy.int32)
+    # The position of each item at the current level in the flattened ``padded`` array (counting
+    # in units of the remaining dimensions), or -1 if the item was truncated.
+    positions = numpy.arange(num_sequences, dtype=numpy.int64)
+    for level_offsets, length, from_right in zip(offsets, padded_shape, truncate_from_right):
+        level_offsets = numpy.asarray(level_offsets, dtype=numpy.int64)
+        lengths = numpy.diff(level_offsets)
+        parents = numpy.repeat(numpy.arange(len(lengths)), lengths)
+        index_in_parent = numpy.arange(level_offsets[-1]) - level_offsets[:-1][parents]
+        if from_right:
+            index_in_parent += (length - lengths)[parents]
+        kept = (index_in_parent >= 0) & (index_in_parent < length) & (positions[parents] >= 0)
+        positions = numpy.where(kept, positions[parents] * length + index_in_parent, -1)
+    kept = positions >= 0
+    padded.reshape(-1)[positions[kept]] = values[kept]
+    return padded
@@ -1,12 +1,19 @@
-from typing import List
+from collections import Counter
+from typing import Any, Dict, List
+import json
 import logging
+import os
 import random
-from copy import deepcopy
+import threading
+import time
 
+import numpy
+
+from ..common.checks import ConfigurationError
 from ..common.params import Params
+from ..common.parallel import prefetch_imap
 from ..common.util import group_by_count
 from . import IndexedDataset
-from .instances import IndexedInstance
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -76,19 +83,56 @@ class DataGenerator:
         without running out of memory.  Then (2) turn on ``adaptive_batch_sizes``, and set this
         parameter so that you get the right batch size for your biggest instances.  If you set the
         log level to ``DEBUG`` in ``scripts/run_model.py``, you can see the batch sizes that are
-        computed.
+        computed.  If you're training on the CPU, ``scripts/calibrate_adaptive_batch_sizes.py``
+        will measure this for you instead (see
+        :func:`~deep_qa.training.memory_calibration.calibrate_adaptive_memory_usage_constant`).
     maximum_batch_size: int, optional (default=1000000)
         If we're using adaptive batch sizes, you can use this to be sure you do not create batches
         larger than this, even if you have enough memory to handle it on your GPU.  You might
         choose to do this to keep smaller batches because you like the noisier gradient estimates
         that come from smaller batches, for instance.
+    adaptive_batch_planner: str, optional (default='greedy')
+        Only relevant if ``adaptive_batch_sizes`` is ``True``.  How we split the sorted instances
+        into batches.  ``'greedy'`` puts as many instances into each batch as will fit.
+        ``'optimal'`` makes the same (smallest possible) number of batches, but picks where each
+        batch starts and ends so that the least memory is spent on padding, with dynamic
+        programming.  Either way, we log the padding efficiency of the batches we made, and you
+        can read it from ``last_padding_efficiency``.  The ``'optimal'`` planner calls
+        :func:`~deep_qa.training.TextTrainer.get_padding_memory_scaling` with numpy arrays of
+        padding lengths if it can, so it's much faster if that method is plain arithmetic.
     biggest_batch_first: bool, optional (default=False)
         This is largely for testing, to see how large of a batch you can safely use with your GPU.
         It's only meaningful if you're using dynamic padding - this will let you try out the
         largest batch that you have in the data `first`, so that if you're going to run out of
         memory, you know it early, instead of waiting through the whole batch to find out at the
         end that you're going to crash.
+    num_workers: int, optional (default=0)
+        If greater than 0, we build batches (i.e., pad them and convert them into arrays) in the
+        background, using this many workers, while the model trains on earlier batches.  With the
+        default of 0, each batch is built on the training thread when Keras asks for it.  The
+        batches come out in the same order either way.
+    worker_type: str, optional (default='thread')
+        Either ``'thread'`` or ``'process'``.  Threads have no start up cost, but only run in
+        parallel with the model while they're in numpy code, because of python's GIL.  Processes
+        are forked at the start of each epoch, and send the batch arrays back through shared
+        memory.  See :func:`~deep_qa.common.parallel.prefetch_imap`.
+    prefetch_batches: int, optional (default=None)
+        How many batches the workers can get ahead of the model.  Defaults to twice
+        ``num_workers``.
+    shared_memory_mb_per_batch: float, optional (default=32)
+        With process workers, how much shared memory to allocate for each prefetched batch.
+        Batches that are bigger than this still work, they're just slower to send back.
+    log_batch_statistics: bool, optional (default=True)
+        If ``True``, at the end of each epoch we log how much of the padded batches was real
+        data, for each padding key, along with the most common batch shapes and how many instances
+        per second we got through (see :func:`get_batch_statistics`).  If the ``TextTrainer`` has
+        a ``tensorboard_log``, we also write these as scalars and histograms under
+        ``tensorboard_log/data``.
     """
+    # The optimal batch planner looks at every pair of possible start and end positions for each
+    # batch; we fall back to greedy planning when that would be more pairs than this.
+    _max_planning_window = 2000000
+
     def __init__(self, text_trainer, params: Params):
         self.text_trainer = text_trainer
         self.dynamic_padding = params.pop('dynamic_padding', False)
@@ -97,45 +141,280 @@ class DataGenerator:
         self.adaptive_batch_sizes = params.pop('adaptive_batch_sizes', False)
         self.adaptive_memory_usage_constant = params.pop('adaptive_memory_usage_constant', False)
         self.maximum_batch_size = params.pop('maximum_batch_size', 1000000)
+        self.adaptive_batch_planner = params.pop_choice('adaptive_batch_planner', ['greedy', 'optimal'],
+                                                        default_to_first_choice=True)
         self.biggest_batch_first = params.pop('biggest_batch_first', False)
+        self.num_workers = params.pop('num_workers', 0)
+        self.worker_type = params.pop_choice('worker_type', ['thread', 'process'], default_to_first_choice=True)
+        self.prefetch_batches = params.pop('prefetch_batches', None)
+        self.shared_memory_mb_per_batch = params.pop('shared_memory_mb_per_batch', 32)
+        self.log_batch_statistics = params.pop('log_batch_statistics', True)
+        self._summary_writer = None
 
         #: This field can be read after calling ``create_generator`` to get the number of steps you
         #: should take per epoch in ``model.fit_generator`` or ``model.evaluate_generator`` for
         #: this data.
         self.last_num_batches = None
 
-    def create_generator(self, dataset: IndexedDataset, batch_size: int=None):
+        #: When using adaptive batch sizes, this is the fraction of the memory in the last set of
+        #: batches we made that went to instances instead of padding, as measured by
+        #: :func:`~deep_qa.training.TextTrainer.get_padding_memory_scaling`.
+        self.last_padding_efficiency = None
+
+        #: The statistics from :func:`get_batch_statistics` for the last epoch that finished.
+        self.last_batch_statistics = None
+
+    def create_generator(self,
+                         dataset: IndexedDataset,
+                         batch_size: int=None,
+                         name: str='data') -> 'BatchGenerator':
         """
         Main external API call: converts an ``IndexedDataset`` into a data generator suitable for
-        use with Keras' ``fit_generator`` and related methods.
+        use with Keras' ``fit_generator`` and related methods.  See :class:`BatchGenerator` for
+        what you get back.  The ``name`` is used to label the batch statistics that we log.
         """
         if batch_size is None:
             batch_size = self.text_trainer.batch_size
+        batch_generator = BatchGenerator(self, dataset, batch_size, name)
+        self.last_num_batches = len(batch_generator)
+        return batch_generator
+
+    def build_batch(self, batch: IndexedDataset, padding_lengths: Dict[str, int]=None):
+        """
+        Pads a batch of instances and converts it into the ``(inputs, labels)`` arrays that we
+        give to the model.  By default we use the padding lengths from the ``TextTrainer``.
+        """
+        if padding_lengths is None:
+            padding_lengths = self.text_trainer.get_padding_lengths()
+        return batch.as_padded_training_data(padding_lengths, verbose=False)
+
+    def map_batches(self,
+                    dataset: IndexedDataset,
+                    batches: List[List[int]],
+                    padding_lengths: Dict[str, int]=None):
+        """
+        For each of the ``batches`` (given as lists of positions in ``dataset.instances``), in
+        order, yields the arrays from ``build_batch``, using the workers and prefetching set by
+        ``num_workers``, ``worker_type`` and ``prefetch_batches``.
+        """
+        def build_batch(batch_index: int):
+            return self.build_batch(dataset.select(batches[batch_index]), padding_lengths)
+        return prefetch_imap(build_batch,
+                             range(len(batches)),
+                             self.num_workers,
+                             num_prefetched=self.prefetch_batches,
+                             use_processes=self.worker_type == 'process',
+                             slot_size_mb=self.shared_memory_mb_per_batch)
 
-        grouped_instances = self.__create_batches(dataset, batch_size)
-        self.last_num_batches = len(grouped_instances)
-        def generator():
-            while True:
-                if self.sort_every_epoch:
-                    unpadded_dataset = deepcopy(dataset)
-                    groups = self.__create_batches(unpadded_dataset, batch_size)
-                else:
-                    groups = grouped_instances
-                for group in groups:
-                    batch = IndexedDataset(group)
-                    batch.pad_instances(self.text_trainer.get_padding_lengths(), verbose=False)
-                    yield batch.as_training_data()
-        return generator()
-
-    def __create_batches(self, dataset: IndexedDataset, batch_size: int) -> List[List[IndexedInstance]]:
+    def score_dataset(self, model, dataset: IndexedDataset, batch_size: int=None):
+        """
+        Runs ``model.predict_on_batch`` over every instance in ``dataset``, and returns the
+        predictions and the labels, both in the order of ``dataset.instances``, like
+        :func:`~deep_qa.training.Trainer.score_dataset`.
+
+        If we're using ``dynamic_padding``, we score the instances in batches sorted by padding
+        length (with no noise), each padded only as much as it needs, and with adaptive batch sizes
+        if you've turned those on, so a few long instances don't make scoring everything slow.
+        Otherwise, the batches are padded to the same lengths, as if we'd padded the whole dataset
+        at once.  Either way, we build the batches with our workers.
+
+        The outputs (and labels) that have the same shape in every batch come back as one array,
+        with a row for each instance, just like from ``model.predict``.  Outputs whose shape
+        depends on the batch padding (e.g., span probabilities over the passage words) come back as
+        a numpy object array, with one array per instance, padded to the length of its batch.
+        """
+        batches, padding_lengths = self.__get_scoring_batches(dataset, batch_size)
+        predictions = []
+        labels = []
+        for inputs, batch_labels in self.map_batches(dataset, batches, padding_lengths):
+            predictions.append(model.predict_on_batch(inputs))
+            labels.append(batch_labels)
+        order = [index for batch in batches for index in batch]
+        return self._restore_order(predictions, order), self._restore_order(labels, order)
+
+    def evaluate_dataset(self, model, dataset: IndexedDataset, batch_size: int=None) -> List[float]:
+        """
+        Runs ``model.test_on_batch`` over every instance in ``dataset``, in the same batches as
+        :func:`score_dataset`, and returns the loss and metrics (one for each of
+        ``model.metrics_names``), averaged over the instances, like ``model.evaluate``.  With
+        ``dynamic_padding``, this means the batches are sorted by padding length and padded only as
+        much as they need, instead of being the noisy, shuffled batches we train on.
+        """
+        batches, padding_lengths = self.__get_scoring_batches(dataset, batch_size)
+        if not batches:
+            raise ConfigurationError("Can't evaluate a model on an empty dataset")
+        scores = []
+        for batch, (inputs, labels) in zip(batches, self.map_batches(dataset, batches, padding_lengths)):
+            scores.append(numpy.asarray(model.test_on_batch(inputs, labels), dtype='float64').reshape(-1))
+        return numpy.average(scores, axis=0, weights=[len(batch) for batch in batches]).tolist()
+
+    def __get_scoring_batches(self, dataset: IndexedDataset, batch_size: int):
+        """
+        Returns the batches (lists of positions in ``dataset.instances``) that we score and
+        evaluate ``dataset`` in, and the padding lengths to give ``build_batch`` for them (which
+        are ``None`` with ``dynamic_padding``, so each batch gets its own).
+        """
+        if batch_size is None:
+            batch_size = self.text_trainer.batch_size
+        if not dataset.instances:
+            return [], None
         if self.dynamic_padding:
-            dataset.sort_by_padding(self.text_trainer.get_instance_sorting_keys(), self.padding_noise)
-        instances = dataset.instances
-        if self.adaptive_batch_sizes:
-            grouped_instances = self.__adaptive_grouping(instances)
-        else:
-            grouped_instances = group_by_count(instances, batch_size, None)
-            grouped_instances[-1] = [instance for instance in grouped_instances[-1] if instance is not None]
+            return self.create_scoring_batches(dataset, batch_size), None
+        # pylint: disable=protected-access
+        padding_lengths = dataset._get_lengths_to_use(self.text_trainer.get_padding_lengths(), verbose=False)
+        batches = [list(range(start, min(start + batch_size, len(dataset.instances))))
+                   for start in range(0, len(dataset.instances), batch_size)]
+        return batches, padding_lengths
+
+    @classmethod
+    def _restore_order(cls, batch_outputs: List, order: List[int]):
+        """
+        Puts the rows of ``batch_outputs`` (one array, or a list of arrays, per batch), which are
+        for the instances at positions ``order``, back in the order of the dataset.  With no
+        batches (for an empty dataset), we can't tell what the outputs would have looked like, so
+        we just return an empty array.
+        """
+        if not batch_outputs:
+            return numpy.zeros((0,))
+        if isinstance(batch_outputs[0], (list, tuple)):
+            return [cls._restore_order(list(outputs), order) for outputs in zip(*batch_outputs)]
+        batch_outputs = [numpy.asarray(output) for output in batch_outputs]
+        if len(set(output.shape[1:] for output in batch_outputs)) == 1:
+            in_batch_order = numpy.concatenate(batch_outputs)
+            restored = numpy.empty_like(in_batch_order)
+            restored[order] = in_batch_order
+            return restored
+        restored = numpy.empty(len(order), dtype=object)
+        rows = (row for output in batch_outputs for row in output)
+        for index, row in zip(order, rows):
+            restored[index] = row
+        return restored
+
+    def get_batch_statistics(self, dataset: IndexedDataset, batches: List[List[int]]) -> Dict[str, Any]:
+        """
+        Measures how much of ``batches`` (lists of positions in ``dataset.instances``) is padding.
+        For each padding key, ``real_cells/[key]`` is the sum of the instances' own padding
+        lengths, and ``padded_cells/[key]`` is the sum of the padding lengths the instances get
+        padded to in their batches (so for ``num_sentence_words``, these count words and word
+        slots).  ``padding_efficiency/[key]`` is the ratio of the two.  ``batch_shapes`` lists
+        the ten most common ``[batch size, padding lengths]`` and how many batches had them.
+        """
+        keys, batch_sizes, instance_lengths, batch_lengths = self.__get_batch_lengths(dataset, batches)
+        padded_lengths = numpy.repeat(batch_lengths, batch_sizes, axis=0)
+        real_cells = numpy.minimum(instance_lengths, padded_lengths).sum(axis=0).tolist()
+        padded_cells = padded_lengths.sum(axis=0).tolist()
+        statistics = {
+                'num_batches': len(batches),
+                'num_instances': len(instance_lengths),
+                'mean_batch_size': len(instance_lengths) / len(batches),
+                }
+        for key, real, padded in zip(keys, real_cells, padded_cells):
+            statistics['real_cells/' + key] = real
+            statistics['padded_cells/' + key] = padded
+            statistics['padding_efficiency/' + key] = real / padded if padded else 1.0
+        shapes = Counter((size,) + tuple(lengths) for size, lengths in zip(batch_sizes.tolist(),
+                                                                           batch_lengths.tolist()))
+        statistics['batch_shapes'] = [[shape[0], dict(zip(keys, shape[1:])), count]
+                                      for shape, count in shapes.most_common(10)]
+        return statistics
+
+    def report_batch_statistics(self,
+                                dataset: IndexedDataset,
+                                batches: List[List[int]],
+                                name: str,
+                                epoch: int,
+                                elapsed_seconds: float=None):
+        """
+        Computes :func:`get_batch_statistics` for one epoch's ``batches``, logs them, and writes
+        them to tensorboard if we're supposed to.  If we know how long the epoch took, we also
+        give ``instances_per_second``.
+        """
+        if not self.log_batch_statistics or not batches:
+            return
+        statistics = self.get_batch_statistics(dataset, batches)
+        if elapsed_seconds:
+            statistics['instances_per_second'] = statistics['num_instances'] / elapsed_seconds
+        self.last_batch_statistics = statistics
+        logger.info("Batch statistics for %s, epoch %d: %s", name, epoch, json.dumps(statistics, sort_keys=True))
+        tensorboard_log = getattr(self.text_trainer, 'tensorboard_log', None)
+        if tensorboard_log is not None:
+            self.__write_summaries(tensorboard_log, dataset, batches, statistics, name, epoch)
+
+    def __get_batch_lengths(self, dataset: IndexedDataset, batches: List[List[int]]):
+        """
+        Returns the padding keys, the size of each batch, the padding lengths of each instance
+        (in batch order), and the padding lengths that each batch gets padded to.
+        """
+        keys, table = dataset.get_padding_length_table()
+        batch_sizes = numpy.asarray([len(batch) for batch in batches])
+        instance_lengths = table[[index for batch in batches for index in batch]]
+        batch_lengths = numpy.maximum.reduceat(instance_lengths, numpy.cumsum(batch_sizes) - batch_sizes)
+        fixed_lengths = self.text_trainer.get_padding_lengths()
+        for i, key in enumerate(keys):
+            if fixed_lengths.get(key) is not None:
+                batch_lengths[:, i] = fixed_lengths[key]
+        return keys, batch_sizes, instance_lengths, batch_lengths
+
+    def __write_summaries(self,
+                          tensorboard_log: str,
+                          dataset: IndexedDataset,
+                          batches: List[List[int]],
+                          statistics: Dict[str, Any],
+                          name: str,
+                          epoch: int):
+        import tensorflow
+        if self._summary_writer is None:
+            self._summary_writer = tensorflow.summary.FileWriter(os.path.join(tensorboard_log, "data"))
+        values = [tensorflow.Summary.Value(tag=name + '/' + key, simple_value=value)
+                  for key, value in statistics.items() if isinstance(value, (int, float))]
+        keys, batch_sizes, _, batch_lengths = self.__get_batch_lengths(dataset, batches)
+        histograms = {'batch_size': batch_sizes}
+        for i, key in enumerate(keys):
+            histograms['padded_length/' + key] = batch_lengths[:, i]
+        for key, histogram_values in histograms.items():
+            values.append(tensorflow.Summary.Value(tag=name + '/' + key,
+                                                   histo=self.__histogram(tensorflow, histogram_values)))
+        self._summary_writer.add_summary(tensorflow.Summary(value=values), epoch)
+        self._summary_writer.flush()
+
+    @staticmethod
+    def __histogram(tensorflow, values: List[int]):
+        values = numpy.asarray(values, dtype='float64')
+        counts, edges = numpy.histogram(values, bins=min(30, len(numpy.unique(values))))
+        return tensorflow.HistogramProto(min=float(values.min()),
+                                         max=float(values.max()),
+                                         num=len(values),
+                                         sum=float(values.sum()),
+                                         sum_squares=float((values ** 2).sum()),
+                                         bucket_limit=edges[1:].tolist(),
+                                         bucket=counts.tolist())
+
+    def padding_memory_scaling(self, keys: List[str], lengths: numpy.ndarray) -> numpy.ndarray:
+        """
+        Evaluates ``get_padding_memory_scaling`` on each row of ``lengths`` (the last axis
+        matches ``keys``).  Most models compute this with plain arithmetic, which works on whole
+        numpy arrays at once, so we try that first, and only call the method once per row if it
+        doesn't give us the right shape back.
+        """
+        columns = {key: lengths[..., i] for i, key in enumerate(keys)}
+        try:
+            scaling = numpy.asarray(self.text_trainer.get_padding_memory_scaling(columns), dtype='float64')
+            if scaling.shape == lengths.shape[:-1]:
+                return scaling
+        except (TypeError, ValueError):
+            pass
+        rows = lengths.reshape(-1, len(keys))
+        scaling = [self.text_trainer.get_padding_memory_scaling(dict(zip(keys, row.tolist()))) for row in rows]
+        return numpy.asarray(scaling, dtype='float64').reshape(lengths.shape[:-1])
+
+    def create_batches(self, dataset: IndexedDataset, batch_size: int) -> List[List[int]]:
+        """
+        Groups the instances in ``dataset`` into one epoch's worth of batches, in the order they
+        should be given to the model.  Each batch is a list of positions in ``dataset.instances``;
+        we don't modify (or reorder) the dataset, so making a new set of batches for each epoch
+        only costs a sort over the instance positions.
+        """
+        grouped_instances = self.__group_instances(dataset, batch_size, self.padding_noise)
         if self.biggest_batch_first:
             # We'll actually pop the last _two_ batches, because the last one might not
             # be full.
@@ -148,28 +427,195 @@ class DataGenerator:
             random.shuffle(grouped_instances)
         return grouped_instances
 
-    def __adaptive_grouping(self, instances: List[IndexedInstance]):
-        batches = []
-        current_batch = []
-        current_lengths = {}
-        logger.debug("Creating adatpive groups")
-        for instance in instances:
-            current_batch.append(instance)
-            instance_lengths = instance.get_padding_lengths()
-            for key in instance_lengths:
-                current_lengths[key] = max(instance_lengths[key], current_lengths.get(key, -1))
-            big_o_memory_constant = self.text_trainer.get_padding_memory_scaling(current_lengths)
-            if (len(current_batch) * big_o_memory_constant > self.adaptive_memory_usage_constant
-                        or len(current_batch) > self.maximum_batch_size):
-                current_batch.pop()
-                if logger.getEffectiveLevel() <= logging.DEBUG:
-                    padding_lengths = IndexedDataset(current_batch).padding_lengths()
-                    logger.debug("Batch size: %d; padding: %s", len(current_batch), padding_lengths)
-                batches.append(current_batch)
-                current_batch = [instance]
-                current_lengths = instance_lengths
+    def create_scoring_batches(self, dataset: IndexedDataset, batch_size: int) -> List[List[int]]:
+        """
+        Like :func:`create_batches`, but for running a model over the data once, instead of
+        training: we sort without noise, and we don't shuffle the batches, so that similar
+        instances are batched together, and the batches are the same every time.
+        """
+        return self.__group_instances(dataset, batch_size, 0.0)
+
+    def __group_instances(self, dataset: IndexedDataset, batch_size: int, padding_noise: float):
+        if self.dynamic_padding:
+            order = dataset.get_padding_sorted_indices(self.text_trainer.get_instance_sorting_keys(),
+                                                       padding_noise)
+        else:
+            order = list(range(len(dataset.instances)))
+        if self.adaptive_batch_sizes:
+            return self.__adaptive_grouping(dataset, order)
+        grouped_instances = group_by_count(order, batch_size, None)
+        grouped_instances[-1] = [index for index in grouped_instances[-1] if index is not None]
+        return grouped_instances
+
+    def __adaptive_grouping(self, dataset: IndexedDataset, order: List[int]):
+        keys, table = dataset.get_padding_length_table()
+        lengths = table[order].astype('int64')
+        if self.adaptive_batch_planner == 'optimal':
+            boundaries = self.__optimal_boundaries(keys, lengths)
+        else:
+            boundaries = self.__greedy_boundaries(keys, lengths)
+        batches = [order[start:end] for start, end in zip(boundaries[:-1], boundaries[1:])]
+        self.last_padding_efficiency = self.__padding_efficiency(keys, lengths, boundaries)
+        logger.info("Made %d adaptive batches, with padding efficiency %.3f",
+                    len(batches), self.last_padding_efficiency)
         if logger.getEffectiveLevel() <= logging.DEBUG:
-            padding_lengths = IndexedDataset(current_batch).padding_lengths()
-            logger.debug("Batch size: %d; padding: %s", len(current_batch), padding_lengths)
-        batches.append(current_batch)
+            for start, end in zip(boundaries[:-1], boundaries[1:]):
+                padding_lengths = dict(zip(keys, lengths[start:end].max(axis=0).tolist()))
+                logger.debug("Batch size: %d; padding: %s", end - start, padding_lengths)
         return batches
+
+    def __fitting_batch_size(self, keys: List[str], lengths: numpy.ndarray, start: int) -> int:
+        """
+        The size of the largest batch ``lengths[start:start + size]`` that fits in
+        ``adaptive_memory_usage_constant`` and ``maximum_batch_size``.  A single instance always
+        gets a batch, even if it's too big.  This assumes that the memory scaling doesn't go down
+        when padding lengths go up, so once a batch doesn't fit, no bigger batch does either.
+        """
+        window = 64
+        while True:
+            stop = min(len(lengths), start + window, start + self.maximum_batch_size)
+            batch_lengths = numpy.maximum.accumulate(lengths[start:stop], axis=0)
+            batch_sizes = numpy.arange(1, stop - start + 1)
+            batch_memory = batch_sizes * self.padding_memory_scaling(keys, batch_lengths)
+            fits = batch_memory <= self.adaptive_memory_usage_constant
+            fits[0] = True
+            if not fits.all():
+                return int(numpy.argmin(fits))
+            if stop == len(lengths) or stop - start == self.maximum_batch_size:
+                return stop - start
+            window *= 4
+
+    def __greedy_boundaries(self, keys: List[str], lengths: numpy.ndarray) -> List[int]:
+        """
+        Fills each batch in turn with as many instances as will fit.  This gives the fewest
+        possible batches, but the last instances that fit into a batch can be a lot longer than
+        the first ones, so we can waste a lot on padding.  Returns the positions in ``lengths``
+        where batches start, with ``len(lengths)`` at the end.
+        """
+        boundaries = [0]
+        while boundaries[-1] < len(lengths):
+            boundaries.append(boundaries[-1] + self.__fitting_batch_size(keys, lengths, boundaries[-1]))
+        return boundaries
+
+    def __optimal_boundaries(self, keys: List[str], lengths: numpy.ndarray) -> List[int]:
+        """
+        Finds the batch boundaries that waste the least memory on padding (measured as ``batch
+        size * get_padding_memory_scaling(batch padding lengths)``, summed over all batches)
+        while still using the fewest possible batches, with dynamic programming.
+
+        Filling batches greedily from the front of the data gives the latest place each batch
+        could possibly end, and filling them greedily from the back gives the earliest; the
+        optimal boundaries are somewhere in between, so we only have to search those windows.
+        """
+        num_instances = len(lengths)
+        latest = self.__greedy_boundaries(keys, lengths)
+        earliest = [num_instances - boundary
+                    for boundary in reversed(self.__greedy_boundaries(keys, lengths[::-1]))]
+        largest_window = max((latest[i] - earliest[i] + 1) * (latest[i + 1] - earliest[i + 1] + 1)
+                             for i in range(len(latest) - 1))
+        if largest_window > self._max_planning_window:
+            logger.warning("Adaptive batches are too large to plan optimally; filling them greedily")
+            return latest
+        # best_cost[i] is the least padded memory that gets us to a boundary at starts[i], and
+        # back_pointers[batch][i] is where the batch that ends at ends[i] starts.
+        starts = numpy.arange(1)
+        best_cost = numpy.zeros(1)
+        back_pointers = []
+        for batch in range(1, len(latest)):
+            ends = numpy.arange(earliest[batch], latest[batch] + 1)
+            batch_lengths = numpy.zeros((len(starts), len(ends), len(keys)), dtype='int64')
+            for i, start in enumerate(starts):
+                running_max = numpy.maximum.accumulate(lengths[start:ends[-1]], axis=0)
+                batch_lengths[i] = running_max[numpy.clip(ends - start - 1, 0, None)]
+            batch_sizes = ends[numpy.newaxis, :] - starts[:, numpy.newaxis]
+            padded_memory = batch_sizes * self.padding_memory_scaling(keys, batch_lengths)
+            fits = (batch_sizes == 1) | ((padded_memory <= self.adaptive_memory_usage_constant) &
+                                         (batch_sizes <= self.maximum_batch_size))
+            fits &= batch_sizes >= 1
+            total_cost = numpy.where(fits, best_cost[:, numpy.newaxis] + padded_memory, numpy.inf)
+            best_starts = numpy.argmin(total_cost, axis=0)
+            best_cost = total_cost[best_starts, numpy.arange(len(ends))]
+            back_pointers.append((ends[0], starts[best_starts]))
+            starts = ends
+        boundaries = [num_instances]
+        for first_end, batch_starts in reversed(back_pointers):
+            boundaries.append(int(batch_starts[boundaries[-1] - first_end]))
+        return boundaries[::-1]
+
+    def __padding_efficiency(self, keys: List[str], lengths: numpy.ndarray, boundaries: List[int]) -> float:
+        """
+        The fraction of the batches' memory (by ``get_padding_memory_scaling``) that goes to
+        actual instances, instead of to padding.
+        """
+        batch_lengths = numpy.asarray([lengths[start:end].max(axis=0)
+                                       for start, end in zip(boundaries[:-1], boundaries[1:])])
+        batch_sizes = numpy.diff(boundaries)
+        padded_memory = numpy.sum(batch_sizes * self.padding_memory_scaling(keys, batch_lengths))
+        if padded_memory == 0:
+            return 1.0
+        return float(numpy.sum(self.padding_memory_scaling(keys, lengths)) / padded_memory)
+
+
+class BatchGenerator:
+    """
+    The generator of batches that :func:`DataGenerator.create_generator` returns.  Iterating over
+    it gives ``(inputs, labels)`` batches forever, one epoch after another, built (and prefetched)
+    as configured in the ``DataGenerator``.  Unlike a plain python generator, it is safe to call
+    ``next()`` on this from several threads, as Keras does in ``fit_generator`` with ``workers >
+    1``.
+
+    The current epoch's batches can also be built directly by index, with ``len()`` and
+    ``batch_generator[index]``, and :func:`on_epoch_end` moves on to the next epoch's batches,
+    like a ``keras.utils.Sequence`` in later versions of Keras.  Don't mix the two ways of getting
+    batches out of the same ``BatchGenerator``.
+    """
+    def __init__(self,
+                 data_generator: DataGenerator,
+                 dataset: IndexedDataset,
+                 batch_size: int,
+                 name: str='data'):
+        self.data_generator = data_generator
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.name = name
+        self.batches = data_generator.create_batches(dataset, batch_size)
+        self.epoch = 0
+        self._epoch_start_time = None
+        self._lock = threading.Lock()
+        self._iterator = self._iterate_over_epochs()
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, index: int):
+        if self._epoch_start_time is None:
+            self._epoch_start_time = time.time()
+        return self.data_generator.build_batch(self.dataset.select(self.batches[index]))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            return next(self._iterator)
+
+    def on_epoch_end(self):
+        """
+        Reports the statistics for the epoch that just finished, then re-sorts and re-groups the
+        data into new batches, if the ``DataGenerator`` has ``sort_every_epoch`` set.
+        """
+        elapsed_seconds = None
+        if self._epoch_start_time is not None:
+            elapsed_seconds = time.time() - self._epoch_start_time
+        self.data_generator.report_batch_statistics(self.dataset, self.batches, self.name,
+                                                    self.epoch, elapsed_seconds)
+        self.epoch += 1
+        self._epoch_start_time = None
+        if self.data_generator.sort_every_epoch:
+            self.batches = self.data_generator.create_batches(self.dataset, self.batch_size)
+
+    def _iterate_over_epochs(self):
+        while True:
+            self._epoch_start_time = time.time()
+            yield from self.data_generator.map_batches(self.dataset, self.batches)
+            self.on_epoch_end()
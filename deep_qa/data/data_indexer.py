@@ -1,12 +1,143 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterator, List, Union
 import codecs
+import hashlib
+import heapq
+import json
 import logging
+import mmap
+import struct
 
+import numpy
 import tqdm
 
+from ..common.parallel import parallel_imap
+
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
+def _stable_word_hash(word: str) -> int:
+    """
+    A 64-bit hash of ``word`` that, unlike python's ``hash()``, is the same in every process, so we
+    can store it in a file.
+    """
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class NewWordError(RuntimeError):
+    """
+    Raised when something tries to add a word to a ``DataIndexer`` that was finalized with
+    ``raise_on_new_words=True``.  See :func:`DataIndexer.finalize`.
+    """
+    pass
+
+
+class _Namespace:
+    """
+    The vocabulary for a single namespace in a ``DataIndexer``: a list from index to word, and a
+    dict from word to index.
+    """
+    __slots__ = ['index_to_word', 'word_to_index']
+
+    def __init__(self, words: Iterator[str]):
+        self.index_to_word = list(words)
+        self.word_to_index = {}
+        for index, word in enumerate(self.index_to_word):
+            self.word_to_index[word] = index
+
+    def get_index(self, word: str) -> int:
+        return self.word_to_index.get(word)
+
+    def get_word(self, index: int) -> str:
+        return self.index_to_word[index]
+
+    def add(self, word: str) -> int:
+        index = len(self.index_to_word)
+        self.index_to_word.append(word)
+        self.word_to_index[word] = index
+        return index
+
+    def words(self):
+        return self.word_to_index.keys()
+
+    def __len__(self):
+        return len(self.word_to_index)
+
+    def __getstate__(self):
+        return self.index_to_word
+
+    def __setstate__(self, state: List[str]):
+        self.__init__(state)
+
+
+class _MappedNamespace:
+    """
+    A read-only vocabulary for a single namespace, backed by a (typically memory-mapped) file
+    written by :func:`DataIndexer.save`, so that loading it doesn't require reading the whole
+    vocabulary, and processes that load the same file share the memory.
+
+    Index-to-word lookups use a string table: all of the words, encoded as utf-8, one after the
+    other, with an array of offsets into it.  Word-to-index lookups use a hash table stored as a
+    sorted array of (stable) word hashes, which we binary search, along with the index of the word
+    for each hash.  We keep a dict of the words we've already looked up, so repeated lookups are as
+    fast as with a normal ``_Namespace``.
+    """
+    def __init__(self,
+                 buffer,
+                 offsets: numpy.array,
+                 strings_start: int,
+                 hashes: numpy.array,
+                 hash_order: numpy.array):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.strings_start = strings_start
+        self.hashes = hashes
+        self.hash_order = hash_order
+        self.index_cache = {}
+
+    def get_index(self, word: str) -> int:
+        index = self.index_cache.get(word)
+        if index is not None:
+            return index
+        word_hash = _stable_word_hash(word)
+        position = int(numpy.searchsorted(self.hashes, numpy.uint64(word_hash)))
+        while position < len(self.hashes) and int(self.hashes[position]) == word_hash:
+            candidate = int(self.hash_order[position])
+            if self.get_word(candidate) == word:
+                self.index_cache[word] = candidate
+                return candidate
+            position += 1
+        return None
+
+    def get_word(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise KeyError(index)
+        start = self.strings_start + int(self.offsets[index])
+        end = self.strings_start + int(self.offsets[index + 1])
+        return self.buffer[start:end].decode('utf-8')
+
+    def words(self) -> '_MappedNamespace':
+        return self
+
+    def __contains__(self, word: str) -> bool:
+        return self.get_index(word) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        # Like a dict, we only give each word once, even if it was in the vocabulary file twice.
+        for index in range(len(self)):
+            word = self.get_word(index)
+            if self.get_index(word) == index:
+                yield word
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def to_namespace(self) -> _Namespace:
+        return _Namespace(self.get_word(index) for index in range(len(self)))
+
+
 class DataIndexer:
     """
     A DataIndexer maps strings to integers, allowing for strings to be mapped to an
@@ -19,32 +150,63 @@ class DataIndexer:
     for 'a' as a word, and 'a' as a character, for instance.  Most of the methods on this class
     allow you to pass in a namespace; by default we use the 'words' namespace, and you can omit the
     namespace argument everywhere and just use the default.
+
+    You can save a DataIndexer with :func:`save` and get it back with :func:`load`.  This uses a
+    versioned binary format (not pickle) that can be memory-mapped, so loading even a very large
+    vocabulary is nearly instantaneous, and several processes can share one copy of it.
     """
+    _file_magic = b'DQVOCAB\0'
+    _file_version = 1
+
     def __init__(self):
         # Typically all input words to this code are lower-cased, so we could simply use "PADDING"
         # for this.  But doing it this way, with special characters, future-proofs the code in case
         # it is used later in a setting where not all input is lowercase.
         self._padding_token = "@@PADDING@@"
         self._oov_token = "@@UNKOWN@@"
-        self.word_indices = defaultdict(lambda: {self._padding_token: 0, self._oov_token: 1})
-        self.reverse_word_indices = defaultdict(lambda: {0: self._padding_token, 1: self._oov_token})
+        self._namespaces = {}
         self._finalized = False
+        self._raise_on_new_words = False
+
+    def _get_namespace(self, namespace: str):
+        """
+        Returns the vocabulary for ``namespace``, creating it (with just the padding and OOV
+        tokens) if it doesn't exist yet.
+        """
+        vocabulary = self._namespaces.get(namespace)
+        if vocabulary is None:
+            vocabulary = _Namespace([self._padding_token, self._oov_token])
+            self._namespaces[namespace] = vocabulary
+        return vocabulary
 
     def set_from_file(self, filename: str, oov_token: str="@@UNKNOWN@@", namespace: str="words"):
         self._oov_token = oov_token
-        self.word_indices[namespace] = {self._padding_token: 0}
-        self.reverse_word_indices[namespace] = {0: self._padding_token}
         with codecs.open(filename, 'r', 'utf-8') as input_file:
-            for i, line in enumerate(input_file.readlines()):
-                token = line[:-1]  # remove the newline
-                self.word_indices[namespace][token] = i + 1
-                self.reverse_word_indices[namespace][i + 1] = token
+            # We remove the newline from each line.
+            tokens = [line[:-1] for line in input_file.readlines()]
+        self._namespaces[namespace] = _Namespace([self._padding_token] + tokens)
 
-    def finalize(self):
+    def finalize(self, raise_on_new_words: bool=False):
+        """
+        Stops the vocabulary from changing.  After this, :func:`fit_word_dictionary` does nothing,
+        and :func:`add_word_to_index` logs a warning and returns -1 for words that aren't already
+        in the vocabulary.
+
+        If ``raise_on_new_words`` is ``True``, and this ``DataIndexer`` wasn't already finalized,
+        ``add_word_to_index`` raises a :class:`NewWordError` for new words instead.  We use this
+        for the copies that worker processes index with, where a word that would have been added
+        to the vocabulary in the parent process must not silently be dropped.
+        """
         logger.info("Finalizing data indexer")
+        if raise_on_new_words and not self._finalized:
+            self._raise_on_new_words = True
         self._finalized = True
 
-    def fit_word_dictionary(self, dataset, min_count: int=1):
+    def fit_word_dictionary(self,
+                            dataset,
+                            min_count: Union[int, Dict[str, int]]=1,
+                            max_vocab_size: Union[int, Dict[str, int]]=None,
+                            num_workers: int=1):
         """
         Given a ``Dataset``, this method decides which words are given an index, and which ones are
         mapped to an OOV token (in this case "UNK").  This method must be called before any dataset
@@ -52,62 +214,257 @@ class DataIndexer:
         basically map every token onto "UNK".
 
         We call ``instance.words()`` for each instance in the dataset, and then keep all words that
-        appear at least ``min_count`` times.
+        appear at least ``min_count`` times.  If ``max_vocab_size`` is given, we additionally keep
+        only that many of the most frequent words, so you know how big the vocabulary (and thus the
+        embedding matrix) will be before you build a model.
 
         Parameters
         ----------
         dataset: ``TextDataset``
             The dataset to index.
 
-        min_count: int, optional (default=1)
+        min_count: int or Dict[str, int], optional (default=1)
             The minimum number of occurences a word must have in the dataset
-            in order to be assigned an index.
+            in order to be assigned an index.  If this is a dictionary, it gives a minimum count
+            per namespace, and namespaces that aren't in it use a minimum count of 1.
+
+        max_vocab_size: int or Dict[str, int], optional (default=None)
+            The maximum number of words from the dataset to keep in each namespace (this doesn't
+            count the padding and OOV tokens).  We keep the most frequent words, breaking ties by
+            which word was seen first.  If this is a dictionary, it gives a maximum size per
+            namespace, and namespaces that aren't in it are not limited.  ``None`` means no limit.
+
+        num_workers: int, optional (default=1)
+            How many processes to use to count words.  Each process counts the words in a part of
+            the dataset, and we add the counts together, so the result doesn't depend on this
+            number.
         """
-        logger.info("Fitting word dictionary with min count of %d, finalized is %s",
-                    min_count, self._finalized)
+        logger.info("Fitting word dictionary with min count of %s, max vocab size of %s, "
+                    "finalized is %s", min_count, max_vocab_size, self._finalized)
         if self._finalized:
             logger.warning("Trying to fit a finalized DataIndexer.  This is a no-op.  Did you "
                            "really want to do this?")
             return
-        namespace_word_counts = defaultdict(lambda: defaultdict(int))
-        for instance in tqdm.tqdm(dataset.instances):
-            namespace_dict = instance.words()
-            for namespace in namespace_dict:
-                for word in namespace_dict[namespace]:
-                    namespace_word_counts[namespace][word] += 1
+        instances = dataset.instances
+        chunk_size = 1000
+        chunks = [range(start, min(start + chunk_size, len(instances)))
+                  for start in range(0, len(instances), chunk_size)]
+
+        def count_words(chunk: range) -> Dict[str, Counter]:
+            chunk_counts = defaultdict(Counter)
+            for index in chunk:
+                namespace_dict = instances[index].words()
+                for namespace in namespace_dict:
+                    chunk_counts[namespace].update(namespace_dict[namespace])
+            return dict(chunk_counts)
+
+        # Counters remember the order in which words were first added, and we merge the chunks in
+        # order, so words end up in the order they first appear in the dataset, just as if we'd
+        # counted them all in one process.
+        namespace_word_counts = defaultdict(Counter)
+        for chunk_counts in tqdm.tqdm(parallel_imap(count_words, chunks, num_workers, chunk_size=1),
+                                      total=len(chunks)):
+            for namespace, word_counts in chunk_counts.items():
+                namespace_word_counts[namespace].update(word_counts)
+
         for namespace in tqdm.tqdm(namespace_word_counts):
-            for word, count in namespace_word_counts[namespace].items():
-                if count >= min_count:
-                    self.add_word_to_index(word, namespace)
+            namespace_min_count = self._get_namespace_setting(min_count, namespace, 1)
+            namespace_max_size = self._get_namespace_setting(max_vocab_size, namespace, None)
+            words_to_keep = [(word, count) for word, count in namespace_word_counts[namespace].items()
+                             if count >= namespace_min_count]
+            if namespace_max_size is not None and len(words_to_keep) > namespace_max_size:
+                logger.info("Keeping the %d most frequent of %d words in namespace %s",
+                            namespace_max_size, len(words_to_keep), namespace)
+                # heapq.nlargest is stable, so ties keep the order in which we first saw the words.
+                words_to_keep = heapq.nlargest(namespace_max_size, words_to_keep, key=lambda item: item[1])
+            for word, _ in words_to_keep:
+                self.add_word_to_index(word, namespace)
+
+    @staticmethod
+    def _get_namespace_setting(setting: Union[Any, Dict[str, Any]], namespace: str, default: Any):
+        if isinstance(setting, dict):
+            return setting.get(namespace, default)
+        return setting
 
     def add_word_to_index(self, word: str, namespace: str='words') -> int:
         """
         Adds `word` to the index, if it is not already present.  Either way, we return the index of
         the word.
         """
+        vocabulary = self._get_namespace(namespace)
+        index = vocabulary.get_index(word)
+        if index is not None:
+            return index
+        if self._raise_on_new_words:
+            raise NewWordError("Tried to add %s to namespace %s of a finalized DataIndexer" % (word, namespace))
         if self._finalized:
             logger.warning("Trying to add a word to a finalized DataIndexer.  This is a no-op.  "
                            "Did you really want to do this?")
-            return self.word_indices[namespace].get(word, -1)
-        if word not in self.word_indices[namespace]:
-            index = len(self.word_indices[namespace])
-            self.word_indices[namespace][word] = index
-            self.reverse_word_indices[namespace][index] = word
-            return index
-        else:
-            return self.word_indices[namespace][word]
+            return -1
+        if isinstance(vocabulary, _MappedNamespace):
+            # Memory-mapped vocabularies are read-only, so we need a copy in memory to add to.
+            vocabulary = vocabulary.to_namespace()
+            self._namespaces[namespace] = vocabulary
+        return vocabulary.add(word)
 
     def words_in_index(self, namespace: str='words'):
-        return self.word_indices[namespace].keys()
+        return self._get_namespace(namespace).words()
 
     def get_word_index(self, word: str, namespace: str='words'):
-        if word in self.word_indices[namespace]:
-            return self.word_indices[namespace][word]
+        vocabulary = self._get_namespace(namespace)
+        index = vocabulary.get_index(word)
+        if index is not None:
+            return index
         else:
-            return self.word_indices[namespace][self._oov_token]
+            return vocabulary.get_index(self._oov_token)
 
     def get_word_from_index(self, index: int, namespace: str='words'):
-        return self.reverse_word_indices[namespace][index]
+        return self._get_namespace(namespace).get_word(index)
 
     def get_vocab_size(self, namespace: str='words'):
-        return len(self.word_indices[namespace])
+        return len(self._get_namespace(namespace))
+
+    def fingerprint(self) -> str:
+        """
+        Returns a hash of the contents of this ``DataIndexer`` (every word in every namespace, with
+        its index).  Two ``DataIndexers`` with the same fingerprint will index any dataset
+        identically, so this is useful for deciding if cached indexed data is still valid.
+        """
+        hasher = hashlib.sha1()
+        hasher.update(self._oov_token.encode('utf-8'))
+        for namespace in sorted(self._namespaces):
+            vocabulary = self._namespaces[namespace]
+            # Namespaces get created with just padding and OOV tokens whenever they're accessed,
+            # but those behave exactly like namespaces that were never created.
+            if (len(vocabulary) == 2 and vocabulary.get_index(self._padding_token) == 0 and
+                        vocabulary.get_index(self._oov_token) == 1):
+                continue
+            hasher.update(b'\0\0' + namespace.encode('utf-8'))
+            for index in range(len(vocabulary)):
+                hasher.update(b'\0' + vocabulary.get_word(index).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def save(self, filename: str):
+        """
+        Saves this ``DataIndexer`` to ``filename``, so it can be read back with :func:`load`.
+
+        The file starts with a magic string, a format version and the length of a JSON header,
+        which gives the special tokens and the location of each namespace's data.  Then, for each
+        namespace, come four arrays, each aligned to 8 bytes: ``int64`` offsets into the string
+        table, the string table itself (every word, in index order, encoded as utf-8), the sorted
+        ``uint64`` hashes of the words, and the ``int64`` index of the word with each hash.
+        """
+        sections = []
+        namespace_headers = []
+        position = 0
+
+        def add_section(data: bytes) -> int:
+            nonlocal position
+            start = position
+            padded_data = data + b'\0' * ((-len(data)) % 8)
+            sections.append(padded_data)
+            position += len(padded_data)
+            return start
+
+        for namespace in sorted(self._namespaces):
+            vocabulary = self._namespaces[namespace]
+            words = [vocabulary.get_word(index) for index in range(len(vocabulary))]
+            encoded_words = [word.encode('utf-8') for word in words]
+            offsets = numpy.zeros(len(words) + 1, dtype='<i8')
+            numpy.cumsum([len(word) for word in encoded_words], out=offsets[1:])
+            hashes = numpy.asarray([_stable_word_hash(word) for word in words], dtype='<u8')
+            hash_order = numpy.argsort(hashes, kind='mergesort').astype('<i8')
+            namespace_headers.append({
+                    'name': namespace,
+                    'size': len(words),
+                    'offsets': add_section(offsets.tobytes()),
+                    'strings': add_section(b''.join(encoded_words)),
+                    'hashes': add_section(hashes[hash_order].tobytes()),
+                    'hash_order': add_section(hash_order.tobytes()),
+                    })
+        header = json.dumps({
+                'padding_token': self._padding_token,
+                'oov_token': self._oov_token,
+                'finalized': self._finalized,
+                'namespaces': namespace_headers,
+                }).encode('utf-8')
+        # The magic string and the two integers before the header take 16 bytes; we pad the header
+        # so that the data sections start 8-byte aligned.
+        header += b' ' * ((-len(header)) % 8)
+        with open(filename, 'wb') as output_file:
+            output_file.write(self._file_magic)
+            output_file.write(struct.pack('<II', self._file_version, len(header)))
+            output_file.write(header)
+            for section in sections:
+                output_file.write(section)
+
+    @classmethod
+    def load(cls, filename: str, memory_map: bool=False) -> 'DataIndexer':
+        """
+        Loads a ``DataIndexer`` that was saved with :func:`save`.
+
+        Parameters
+        ----------
+        filename: str
+            The file to load.
+        memory_map: bool, optional (default=False)
+            If ``True``, we memory-map the file instead of reading it in.  Loading then takes a few
+            milliseconds regardless of the size of the vocabulary, and processes that load the same
+            file share one copy of it.  Looking up a word is a bit slower the first time it's seen.
+            If you add a word to a memory-mapped namespace, we copy that namespace into memory
+            first.
+        """
+        with open(filename, 'rb') as input_file:
+            if memory_map:
+                buffer = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buffer = input_file.read()
+        if buffer[:len(cls._file_magic)] != cls._file_magic:
+            raise ValueError("%s is not a saved DataIndexer" % filename)
+        version, header_length = struct.unpack('<II', buffer[8:16])
+        if version > cls._file_version:
+            raise ValueError("%s was saved in DataIndexer format %d, but we only know formats up to "
+                             "%d" % (filename, version, cls._file_version))
+        header = json.loads(buffer[16:16 + header_length].decode('utf-8'))
+        data_start = 16 + header_length
+
+        data_indexer = cls()
+        data_indexer._padding_token = header['padding_token']  # pylint: disable=protected-access
+        data_indexer._oov_token = header['oov_token']  # pylint: disable=protected-access
+        data_indexer._finalized = header['finalized']  # pylint: disable=protected-access
+        for namespace_header in header['namespaces']:
+            size = namespace_header['size']
+            offsets = numpy.frombuffer(buffer, dtype='<i8', count=size + 1,
+                                       offset=data_start + namespace_header['offsets'])
+            hashes = numpy.frombuffer(buffer, dtype='<u8', count=size,
+                                      offset=data_start + namespace_header['hashes'])
+            hash_order = numpy.frombuffer(buffer, dtype='<i8', count=size,
+                                          offset=data_start + namespace_header['hash_order'])
+            vocabulary = _MappedNamespace(buffer,
+                                          offsets,
+                                          data_start + namespace_header['strings'],
+                                          hashes,
+                                          hash_order)
+            if not memory_map:
+                vocabulary = vocabulary.to_namespace()
+            data_indexer._namespaces[namespace_header['name']] = vocabulary  # pylint: disable=protected-access
+        return data_indexer
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # Memory-mapped namespaces can't be pickled, so we pickle in-memory copies instead.
+        state['_namespaces'] = {name: (vocabulary.to_namespace()
+                                       if isinstance(vocabulary, _MappedNamespace) else vocabulary)
+                                for name, vocabulary in self._namespaces.items()}
+        return state
+
+    def __setstate__(self, state: Dict):
+        if 'word_indices' in state:
+            # This DataIndexer was pickled by an older version of this code, which stored each
+            # namespace as a pair of dicts.
+            state.pop('word_indices')
+            reverse_word_indices = state.pop('reverse_word_indices')
+            state['_namespaces'] = {namespace: _Namespace(reverse[index] for index in range(len(reverse)))
+                                    for namespace, reverse in reverse_word_indices.items()}
+        state.setdefault('_raise_on_new_words', False)
+        self.__dict__.update(state)
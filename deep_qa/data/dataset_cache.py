@@ -0,0 +1,200 @@
+import hashlib
+import importlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+from typing import Any, List
+
+import numpy
+
+from ..common.params import Params
+from ..common.util import flatten_ragged, unflatten_ragged
+from .datasets.dataset import IndexedDataset
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class IndexedDatasetCache:
+    """
+    A persistent, on-disk cache of :class:`~deep_qa.data.datasets.dataset.IndexedDataset` objects,
+    so that we don't have to re-read, re-tokenize and re-index the same data files every time we
+    run a model.
+
+    Each cached dataset is stored in a single ``.npz`` file.  Every field of the instances that
+    is a (possibly nested) list of word indices is stored as one flat ``int32`` array plus offset
+    arrays (see :func:`~deep_qa.common.util.flatten_ragged`); anything else (labels, instance
+    indices, etc.) is pickled.
+
+    Entries are looked up by a key computed with :func:`compute_key`, which hashes the `contents`
+    of the data files along with anything else that affects the indexed data (the tokenizer
+    configuration, the instance type, a fingerprint of the ``DataIndexer``, ...).  Changing any of
+    these gives a new key, so stale entries are never used; they just age out of the cache.  When
+    the cache grows past ``max_size_mb``, we delete the least recently used entries.
+
+    Parameters
+    ----------
+    directory: str
+        The directory to store cached datasets in.  It will be created if it doesn't exist.
+    max_size_mb: float, optional (default=None)
+        The maximum total size of the files in the cache directory, in megabytes.  If ``None``,
+        the cache grows without bound.
+    """
+    format_version = 1
+
+    def __init__(self, params: Params):
+        self.directory = params.pop('directory')
+        self.max_size_mb = params.pop('max_size_mb', None)
+        params.assert_empty("IndexedDatasetCache")
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def compute_key(data_files: List[str], **key_data) -> str:
+        """
+        Computes a cache key from the contents of ``data_files`` and whatever else is passed as
+        keyword arguments.  The keyword arguments must be serializable as JSON (or at least have a
+        stable ``str()``).  With no ``data_files``, this is just a fingerprint of the keyword
+        arguments.
+        """
+        hasher = hashlib.sha1()
+        for data_file in data_files:
+            with open(data_file, 'rb') as input_file:
+                for block in iter(lambda: input_file.read(1 << 20), b''):  # pylint: disable=cell-var-from-loop
+                    hasher.update(block)
+            hasher.update(b'\0')
+        key_data['format_version'] = IndexedDatasetCache.format_version
+        hasher.update(json.dumps(key_data, sort_keys=True, default=str).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def load(self, key: str, state_fingerprint: str=None) -> IndexedDataset:
+        """
+        Returns the ``IndexedDataset`` stored under ``key``, or ``None`` if there isn't one.
+
+        Indexing some instances modifies the state used for indexing (e.g., a stop token gets added
+        to the ``DataIndexer``), so when we save a dataset we also record a fingerprint of that
+        state `after` indexing.  If you pass a ``state_fingerprint`` that doesn't match it, we
+        treat this as a cache miss, because you need to actually index the data to get your state
+        right.
+        """
+        filename = self._get_filename(key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with numpy.load(filename) as data:
+                metadata = json.loads(str(data['metadata']))
+                if state_fingerprint is not None and metadata['state_fingerprint'] != state_fingerprint:
+                    logger.info("Cached dataset %s changed the indexing state; ignoring it", key)
+                    return None
+                fields = pickle.loads(data['pickled_fields'].tobytes())
+                for field, depth in metadata['ragged_fields'].items():
+                    values = data[field + '/values']
+                    offsets = [data[field + '/offsets_%d' % level] for level in range(depth + 1)]
+                    fields[field] = unflatten_ragged(values, offsets)
+        except (OSError, KeyError, ValueError, pickle.UnpicklingError) as error:
+            logger.warning("Could not read cached dataset %s (%s); ignoring it", filename, str(error))
+            return None
+        module_name, class_name = metadata['instance_class']
+        instance_class = getattr(importlib.import_module(module_name), class_name)
+        instances = []
+        field_names = list(fields.keys())
+        for field_values in zip(*[fields[name] for name in field_names]):
+            instance = instance_class.__new__(instance_class)
+            for name, value in zip(field_names, field_values):
+                setattr(instance, name, value)
+            instances.append(instance)
+        # Touching the file marks it as recently used, for LRU eviction.
+        os.utime(filename)
+        logger.info("Loaded %d instances from dataset cache %s", len(instances), filename)
+        return IndexedDataset(instances)
+
+    def save(self, key: str, dataset: IndexedDataset, state_fingerprint: str=None):
+        """
+        Stores ``dataset`` under ``key``, then evicts old entries if the cache is too big.  See
+        :func:`load` for a description of ``state_fingerprint``.
+        """
+        instances = dataset.instances
+        if not instances:
+            return
+        instance_class = instances[0].__class__
+        if any(instance.__class__ is not instance_class for instance in instances):
+            logger.warning("Not caching a dataset with mixed instance types")
+            return
+        field_names = list(instances[0].get_fields().keys())
+        arrays = {}
+        ragged_fields = {}
+        pickled_fields = {}
+        for name in field_names:
+            field_values = [getattr(instance, name) for instance in instances]
+            depth = self._get_ragged_depth(field_values)
+            if depth is not None:
+                try:
+                    values, offsets = flatten_ragged(field_values, depth + 1)
+                    arrays[name + '/values'] = values
+                    for level, level_offsets in enumerate(offsets):
+                        arrays[name + '/offsets_%d' % level] = level_offsets
+                    ragged_fields[name] = depth
+                    continue
+                except (TypeError, ValueError):
+                    pass
+            pickled_fields[name] = field_values
+        metadata = {
+                'instance_class': [instance_class.__module__, instance_class.__name__],
+                'ragged_fields': ragged_fields,
+                'state_fingerprint': state_fingerprint,
+                }
+        arrays['metadata'] = numpy.array(json.dumps(metadata))
+        arrays['pickled_fields'] = numpy.frombuffer(pickle.dumps(pickled_fields, protocol=4),
+                                                    dtype=numpy.uint8)
+        # We write to a temporary file and move it into place, so a crash (or another process
+        # reading the cache) never sees a partially written file.
+        file_descriptor, temp_filename = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as output_file:
+                numpy.savez(output_file, **arrays)
+            os.replace(temp_filename, self._get_filename(key))
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+        logger.info("Saved %d instances to dataset cache %s", len(instances), self._get_filename(key))
+        self._evict_old_entries()
+
+    def _get_filename(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.npz')
+
+    def _evict_old_entries(self):
+        if self.max_size_mb is None:
+            return
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.npz'):
+                stat = os.stat(os.path.join(self.directory, filename))
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        max_size = self.max_size_mb * 1024 * 1024
+        # We never delete the most recent entry, even if it's bigger than the cap on its own.
+        for _, size, filename in entries[:-1]:
+            if total_size <= max_size:
+                break
+            logger.info("Evicting %s from the dataset cache", filename)
+            os.remove(os.path.join(self.directory, filename))
+            total_size -= size
+
+    @staticmethod
+    def _get_ragged_depth(field_values: List[Any]) -> int:
+        """
+        If every value in ``field_values`` is a list, returns how many levels of lists there are
+        `inside` these lists (so 0 for lists of ints, 1 for lists of lists of ints), looking down
+        the first non-empty list at each level.  Otherwise returns ``None``.
+        """
+        depth = 0
+        for value in field_values:
+            if not isinstance(value, list):
+                return None
+            value_depth = 0
+            while value and isinstance(value[0], list):
+                value = value[0]
+                value_depth += 1
+            depth = max(depth, value_depth)
+        return depth
@@ -1,15 +1,19 @@
 import codecs
 import itertools
 import logging
-from typing import Dict, List
+import random
+from copy import deepcopy
+from typing import Any, Dict, Iterable, List, Tuple, Union
 
 import numpy
 import tqdm
 
-from ...common.util import add_noise_to_dict_values
+from ...common.parallel import parallel_imap
+from ...common.util import pad_flattened_ragged, pad_ragged
 from ...common.params import Params
-from ..data_indexer import DataIndexer
-from ..instances.instance import Instance, TextInstance, IndexedInstance
+from ..data_indexer import DataIndexer, NewWordError
+from ..instances.instance import Instance, TextInstance, IndexedInstance, IndexingContext, IndicesField
+from ..instances.instance import RaggedIndices
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
@@ -71,28 +75,152 @@ class TextDataset(Dataset):
     TextInstances aren't useful for much with Keras until they've been indexed.  So this class just
     has methods to read in data from a file and convert it into other kinds of Datasets.
     """
+    # How many instances we index at a time in ``to_indexed_dataset``.
+    indexing_batch_size = 1000
+
     def __init__(self, instances: List[TextInstance], params: Params=None):
 
         if params is not None:
             params.assert_empty("TextDataset")
         super(TextDataset, self).__init__(instances)
+        self._share_duplicate_texts()
+
+    def _share_duplicate_texts(self):
+        """
+        Makes all instances that have the same text in one of their ``shared_text_fields`` (e.g.,
+        all of the questions about one passage) use the same string object, so we only keep one
+        copy of it in memory.
+        """
+        shared_texts = {}
+        for instance in self.instances:
+            for field in instance.shared_text_fields:
+                text = getattr(instance, field)
+                if isinstance(text, str):
+                    setattr(instance, field, shared_texts.setdefault(text, text))
 
-    def to_indexed_dataset(self, data_indexer: DataIndexer) -> 'IndexedDataset':
+    def to_indexed_dataset(self, data_indexer: DataIndexer, num_workers: int=1) -> 'IndexedDataset':
         '''
         Converts the Dataset into an IndexedDataset, given a DataIndexer.
+
+        We index the instances in batches: for each batch, we first index all of the text in the
+        batch at once (see :func:`IndexingContext.precompute_text_indices
+        <deep_qa.data.instances.instance.IndexingContext.precompute_text_indices>`), which is much
+        faster than indexing each text separately, then convert the instances.  Instances that
+        have the same text in one of their ``shared_text_fields`` share its indexed form, too, in
+        the whole dataset; padding makes copies, so each instance only gets its own copy once it
+        is padded for a particular batch of training data.
+
+        If ``num_workers`` is greater than 1, we index the batches in that many worker processes.
+        Each worker gets its own finalized copy of the ``DataIndexer``, and the instances come back
+        in their original order, and we make them share the same indexed texts as the instances
+        indexed in this process, so the result is identical to indexing them serially.  Some
+        instances add a word to the ``DataIndexer`` while being indexed (e.g., the stop token in
+        ``CharacterSpanInstance``).  A worker can't add words to the ``DataIndexer`` in this
+        process, so its copy raises a :class:`~deep_qa.data.data_indexer.NewWordError` instead,
+        and we index that batch, and all of the ones after it, in this process.  To make that
+        rare, we index the first instance in this process before starting the workers, so words
+        that every instance adds are already in the ``DataIndexer`` that the workers copy.
         '''
-        indexed_instances = [instance.to_indexed_instance(data_indexer) for instance in tqdm.tqdm(self.instances)]
+        instances = self.instances
+        if not instances:
+            TextInstance.tokenizer.clear_token_cache()
+            return IndexedDataset([])
+        # In the workers, this is a copy, which only shares values between the batches that worker
+        # indexes; we share them between workers with ``context.share_values`` below.
+        context = IndexingContext()
+        indexed_instances = [instances[0].to_indexed_instance(data_indexer, context)]
+        batches = [range(start, min(start + self.indexing_batch_size, len(instances)))
+                   for start in range(1, len(instances), self.indexing_batch_size)]
+
+        def index_batch(batch: range) -> Tuple[List[IndexedInstance], Dict[Any, Any]]:
+            batch_instances = [instances[i] for i in batch]
+            context.precompute_text_indices(batch_instances, data_indexer)
+            indexed_batch = [instance.to_indexed_instance(data_indexer, context) for instance in batch_instances]
+            return indexed_batch, context.pop_used_shared_values()
+
+        def finalize_worker_data_indexer():
+            data_indexer.finalize(raise_on_new_words=True)
+
+        initializer = finalize_worker_data_indexer if num_workers > 1 else None
+        with tqdm.tqdm(total=len(instances)) as progress_bar:
+            progress_bar.update(1)
+            num_indexed_batches = 0
+            try:
+                for indexed_batch, shared_values in parallel_imap(index_batch, batches, num_workers,
+                                                                  chunk_size=1, initializer=initializer):
+                    context.share_values(indexed_batch, shared_values)
+                    indexed_instances.extend(indexed_batch)
+                    progress_bar.update(len(indexed_batch))
+                    num_indexed_batches += 1
+            except NewWordError as error:
+                # Indexing this batch adds a word to the vocabulary, which changes how the later
+                # batches get indexed, too, so we index the rest of them here.
+                logger.info("%s while indexing in a worker; indexing the rest of the data in this "
+                            "process", error)
+                for batch in batches[num_indexed_batches:]:
+                    indexed_batch, _ = index_batch(batch)
+                    indexed_instances.extend(indexed_batch)
+                    progress_bar.update(len(indexed_batch))
+        # Indexing is the last thing that needs the tokens saved by `pretokenize`.
+        TextInstance.tokenizer.clear_token_cache()
         return IndexedDataset(indexed_instances)
 
+    def pretokenize(self, num_workers: int=1):
+        """
+        Tokenizes the text of all of the instances in this dataset once, using ``num_workers``
+        processes, and saves the tokens in the tokenizer, so that fitting a vocabulary on this
+        dataset, indexing it, and converting its labels don't each tokenize the text again.  The
+        saved tokens are thrown away at the end of :func:`to_indexed_dataset`.
+        """
+        # pylint: disable=protected-access
+        texts = (text for instance in self.instances for text in instance._texts_to_index())
+        TextInstance.tokenizer.pretokenize(texts, num_workers)
+
     @staticmethod
-    def read_from_file(filename: str, instance_class, params: Params=None):
+    def read_from_file(filename: str,
+                       instance_class,
+                       params: Params=None,
+                       max_instances: int=None,
+                       num_workers: int=1):
+        """
+        Reads a ``TextDataset`` from ``filename``, with one instance per line.  The file is read
+        lazily, one line at a time, so we never hold more than the instances we've kept in memory.
+
+        Parameters
+        ----------
+        filename: str
+            The file to read.
+        instance_class: class
+            The ``TextInstance`` subclass to construct from each line, using its
+            ``read_from_line`` method.
+        params: Params, optional (default=None)
+            Passed to the ``TextDataset`` constructor.
+        max_instances: int, optional (default=None)
+            If given, we stop reading the file once we have this many instances, so the rest of
+            the file is never read or parsed.
+        num_workers: int, optional (default=1)
+            If greater than 1, we parse the lines in this many worker processes.  See
+            :func:`read_from_lines`.
+        """
         with codecs.open(filename, 'r', 'utf-8') as input_file:
-            lines = [x.strip() for x in tqdm.tqdm(input_file.readlines())]
-            return TextDataset.read_from_lines(lines, instance_class, params)
+            lines = (line.strip() for line in tqdm.tqdm(input_file))
+            return TextDataset.read_from_lines(lines, instance_class, params, max_instances, num_workers)
 
     @staticmethod
-    def read_from_lines(lines: List[str], instance_class, params: Params=None):
-        instances = [instance_class.read_from_line(x) for x in lines]
+    def read_from_lines(lines: Iterable[str],
+                        instance_class,
+                        params: Params=None,
+                        max_instances: int=None,
+                        num_workers: int=1):
+        """
+        Constructs a ``TextDataset`` from an iterable of lines.  ``lines`` can be a generator; we
+        only consume as many lines as we need to get ``max_instances`` instances.  If
+        ``num_workers`` is greater than 1, the lines are sent in chunks to that many worker
+        processes to be parsed, and the instances are returned in the order of the lines.
+        """
+        if max_instances is not None:
+            lines = itertools.islice(lines, max_instances)
+        instances = list(parallel_imap(instance_class.read_from_line, lines, num_workers))
         log_label_counts(instances)
         return TextDataset(instances, params)
 
@@ -103,34 +231,138 @@ class IndexedDataset(Dataset):
 
     IndexedInstances have text sequences replaced with lists of word indices, and are thus able to
     be padded to consistent lengths and converted to training inputs.
+
+    The padding lengths of all of the instances are computed once, the first time we need them,
+    and kept in a table (see :func:`get_padding_length_table`), so sorting the data and working
+    out batch shapes are cheap numpy operations, even for very large datasets.
     """
     def __init__(self, instances: List[IndexedInstance]):
         super(IndexedDataset, self).__init__(instances)
+        # The cached result of ``get_padding_length_table``, along with the list of instances it
+        # was computed for, so we can tell if ``self.instances`` has been replaced since.
+        self._padding_length_table = None
+        self._padding_length_table_instances = None
+
+    def get_padding_length_table(self) -> Tuple[List[str], numpy.array]:
+        """
+        Returns a list of all of the padding keys that the instances have, and an ``int32`` array
+        of shape ``(num_instances, num_keys)`` with the padding lengths of each instance (as given
+        by ``get_padding_lengths``) for each key, or 0 if the instance doesn't have that key.
+
+        We compute this once and cache it.  If you pad instances with :func:`pad_instances` or
+        reorder them with :func:`sort_by_padding`, we keep the cache up to date, and if you assign
+        a new list to ``self.instances``, we recompute it, but if you modify the instances some
+        other way, you need to call :func:`clear_padding_length_table`.
+        """
+        if (self._padding_length_table is None or
+                    self._padding_length_table_instances is not self.instances or
+                    len(self._padding_length_table[1]) != len(self.instances)):
+            lengths = [instance.get_padding_lengths() for instance in self.instances]
+            keys = []  # type: List[str]
+            for instance_lengths in lengths:
+                keys.extend(key for key in instance_lengths if key not in keys)
+            table = numpy.zeros((len(lengths), len(keys)), dtype=numpy.int32)
+            for column, key in enumerate(keys):
+                table[:, column] = [instance_lengths.get(key, 0) for instance_lengths in lengths]
+            self._padding_length_table = (keys, table)
+            self._padding_length_table_instances = self.instances
+        return self._padding_length_table
+
+    def clear_padding_length_table(self):
+        self._padding_length_table = None
+        self._padding_length_table_instances = None
+
+    def select(self, indices: List[int]) -> 'IndexedDataset':
+        """
+        Returns a new ``IndexedDataset`` with the instances at the given positions in this one (e.g.,
+        a batch).  If we've already computed the padding length table, the new dataset gets the
+        corresponding rows of it, so it doesn't have to ask its instances for their lengths again.
+        """
+        dataset = self.__class__([self.instances[index] for index in indices])
+        if self._padding_length_table is not None and self._padding_length_table_instances is self.instances:
+            keys, table = self._padding_length_table
+            dataset._padding_length_table = (keys, table[indices])  # pylint: disable=protected-access
+            dataset._padding_length_table_instances = dataset.instances  # pylint: disable=protected-access
+        return dataset
 
     def sort_by_padding(self, sorting_keys: List[str], padding_noise: float=0.0):
         """
         Sorts the ``Instances`` in this ``Dataset`` by their padding lengths, using the keys in
         ``sorting_keys`` (in the order in which they are provided).
         """
-        instances_with_lengths = []
-        for instance in self.instances:
-            padding_lengths = instance.get_padding_lengths()
-            if padding_noise > 0.0:
-                padding_lengths = add_noise_to_dict_values(padding_lengths, padding_noise)
-            instance_with_lengths = [padding_lengths[key] for key in sorting_keys] + [instance]
-            instances_with_lengths.append(instance_with_lengths)
-        instances_with_lengths.sort(key=lambda x: x[:-1])
-        self.instances = [instance_with_lengths[-1] for instance_with_lengths in instances_with_lengths]
-
-    def padding_lengths(self):
+        order = self.get_padding_sorted_indices(sorting_keys, padding_noise)
+        keys, table = self.get_padding_length_table()
+        self.instances = [self.instances[index] for index in order]
+        self._padding_length_table = (keys, table[order])
+        self._padding_length_table_instances = self.instances
+
+    def get_padding_sorted_indices(self, sorting_keys: List[str], padding_noise: float=0.0) -> List[int]:
+        """
+        Returns the positions of the ``Instances`` in this ``Dataset`` in the order that
+        :func:`sort_by_padding` would put them in, without reordering (or copying) anything.
+
+        If ``padding_noise`` is greater than zero, we first add noise to each length, uniformly
+        distributed within ``padding_noise`` times the length, like
+        :func:`~deep_qa.common.util.add_noise_to_dict_values`.  The noise comes from a numpy random
+        generator seeded from python's ``random`` module, so seeding ``random`` is enough to make
+        this reproducible.
+        """
+        keys, table = self.get_padding_length_table()
+        sort_columns = [table[:, keys.index(key)] for key in sorting_keys]
+        if padding_noise > 0.0:
+            random_state = numpy.random.RandomState(random.getrandbits(32))
+            sort_columns = [column + column * random_state.uniform(-padding_noise, padding_noise, len(column))
+                            for column in sort_columns]
+        # ``lexsort`` sorts by the _last_ key first, and is stable, like sorting by a tuple of keys.
+        return numpy.lexsort(sort_columns[::-1]).tolist()
+
+    def padding_lengths(self, percentile: Union[float, Dict[str, float]]=None):
+        """
+        Returns the maximum padding length over all of the instances, for each of the padding keys
+        of the first instance.
+
+        If you give a ``percentile`` (either one number for all keys, or a dictionary with numbers
+        for some keys), we instead return the smallest length that at least that fraction of the
+        instances fit in, so that padding to it only truncates the longest instances.  E.g., with
+        ``percentile=0.99``, 1% of the instances (or fewer) are longer than the length we return.
+        """
         padding_lengths = {}
-        lengths = [instance.get_padding_lengths() for instance in self.instances]
-        if not lengths:
+        if not self.instances:
             return padding_lengths
-        for key in lengths[0]:
-            padding_lengths[key] = max(x[key] if key in x else 0 for x in lengths)
+        keys, table = self.get_padding_length_table()
+        maximum_lengths = table.max(axis=0).tolist()
+        for key in self.instances[0].get_padding_lengths():
+            key_percentile = percentile.get(key) if isinstance(percentile, dict) else percentile
+            if key_percentile is None or key_percentile >= 1:
+                padding_lengths[key] = maximum_lengths[keys.index(key)]
+            else:
+                sorted_lengths = numpy.sort(table[:, keys.index(key)])
+                rank = int(numpy.ceil(key_percentile * len(sorted_lengths))) - 1
+                padding_lengths[key] = int(sorted_lengths[max(rank, 0)])
         return padding_lengths
 
+    def truncation_statistics(self, padding_lengths: Dict[str, int]) -> Dict[str, int]:
+        """
+        Counts what padding the instances to ``padding_lengths`` would cut off.  For each padding
+        key, ``truncated_instances/[key]`` is how many instances are longer than that, and
+        ``truncated_cells/[key]`` is how much longer they are, in total.  ``truncated_labels`` is
+        how many instances would lose (part of) their label, like a span answer that's in a
+        truncated part of a passage (see :func:`IndexedInstance.is_label_truncated`).  Keys that are
+        ``None`` in ``padding_lengths`` aren't truncated.
+        """
+        statistics = {}
+        if not self.instances:
+            return statistics
+        keys, table = self.get_padding_length_table()
+        lengths_to_use = self._get_lengths_to_use(padding_lengths, verbose=False)
+        for key, length in lengths_to_use.items():
+            excess = numpy.maximum(table[:, keys.index(key)] - length, 0)
+            statistics['truncated_instances/' + key] = int(numpy.count_nonzero(excess))
+            statistics['truncated_cells/' + key] = int(excess.sum())
+        statistics['truncated_labels'] = sum(instance.is_label_truncated(lengths_to_use)
+                                             for instance in self.instances)
+        return statistics
+
     def pad_instances(self, padding_lengths: Dict[str, int]=None, verbose: bool=True):
         """
         Makes all of the ``IndexedInstances`` in the dataset have the same length by padding them.
@@ -163,6 +395,85 @@ class IndexedDataset(Dataset):
             But if you're doing this inside of a data generator, having all of this output per
             batch is a bit obnoxious.
         """
+        lengths_to_use = self._get_lengths_to_use(padding_lengths, verbose)
+        if verbose:
+            logger.info("Now actually padding instances to length: %s", str(lengths_to_use))
+            for instance in tqdm.tqdm(self.instances):
+                instance.pad(lengths_to_use)
+        else:
+            for instance in self.instances:
+                instance.pad(lengths_to_use)
+        self.clear_padding_length_table()
+
+    def as_padded_training_data(self, padding_lengths: Dict[str, int]=None, verbose: bool=True):
+        """
+        Gives the same result as calling :func:`pad_instances` and then :func:`as_training_data`,
+        but much faster, and without modifying the instances, if the instances describe their
+        inputs with ``IndexedInstance.padded_input_fields``.  In that case, we work out the shape
+        of each input once, allocate a zeroed ``int32`` array for the whole dataset, and copy the
+        word indices of all of the instances straight into it, from the ``RaggedIndices`` that
+        store them (see :func:`~deep_qa.common.util.pad_flattened_ragged`), instead of padding
+        python lists instance by instance and then converting them to arrays.
+
+        If the instances don't describe their inputs (or there are several kinds of instances in
+        this dataset), we fall back to ``pad_instances`` and ``as_training_data``, on copies of the
+        instances, so this method never modifies the instances, and you can call it again on the
+        same data (e.g., every epoch) with different padding lengths.  The parameters are the same
+        as for :func:`pad_instances`.
+        """
+        instance_class = self.instances[0].__class__
+        if (getattr(instance_class, 'padded_input_fields', None) is None or
+                    any(instance.__class__ is not instance_class for instance in self.instances)):
+            padded_dataset = IndexedDataset(deepcopy(self.instances))
+            padded_dataset.pad_instances(padding_lengths, verbose)
+            return padded_dataset.as_training_data()
+        lengths_to_use = self._get_lengths_to_use(padding_lengths, verbose)
+        inputs = []
+        for attribute, padding_keys, truncate_from_right in instance_class.padded_input_fields:
+            padding_keys = list(padding_keys)
+            truncate_from_right = list(truncate_from_right)
+            if 'num_word_characters' in lengths_to_use:
+                # Words are padded and truncated at the end, like in
+                # ``IndexedInstance.pad_word_sequence``.
+                padding_keys.append('num_word_characters')
+                truncate_from_right.append(False)
+            padded_shape = tuple(lengths_to_use[key] for key in padding_keys)
+            inputs.append(self._pad_field(instance_class, attribute, padded_shape, truncate_from_right))
+        if len(inputs) == 1:
+            inputs = inputs[0]
+        labels = [instance.get_padded_label(lengths_to_use) for instance in self.instances]
+        if isinstance(labels[0], tuple):
+            labels = [numpy.asarray(x) for x in zip(*labels)]
+        else:
+            labels = numpy.asarray(labels)
+        return inputs, labels
+
+    def _pad_field(self,
+                   instance_class,
+                   attribute: str,
+                   padded_shape: Tuple[int, ...],
+                   truncate_from_right: List[bool]) -> numpy.array:
+        """
+        Pads ``attribute`` of every instance into one array, for ``as_padded_training_data``.  If
+        the attribute is an :class:`~deep_qa.data.instances.instance.IndicesField`, we pad straight
+        from the arrays of the stored ``RaggedIndices``, instead of reading the field (which builds
+        python lists) and flattening the lists again in ``pad_ragged``.
+        """
+        field = getattr(instance_class, attribute, None)
+        if isinstance(field, IndicesField):
+            stored_indices = [getattr(instance, field.slot_name) for instance in self.instances]
+            try:
+                stacked = RaggedIndices.stack(stored_indices, len(padded_shape) - 1)
+            except ValueError:
+                # Some of the values aren't stored as ``RaggedIndices`` (or are nested
+                # differently), so we pad the python lists instead.
+                pass
+            else:
+                return pad_flattened_ragged(stacked.values, stacked.offsets, padded_shape, truncate_from_right)
+        sequences = [getattr(instance, attribute) for instance in self.instances]
+        return pad_ragged(sequences, padded_shape, truncate_from_right)
+
+    def _get_lengths_to_use(self, padding_lengths: Dict[str, int], verbose: bool) -> Dict[str, int]:
         # First we need to decide _how much_ to pad.  To do that, we find the max length for all
         # relevant padding decisions from the instances themselves.  Then we check whether we were
         # given a max length for a particular dimension.  If we were, we use that instead of the
@@ -179,13 +490,7 @@ class IndexedDataset(Dataset):
                 lengths_to_use[key] = padding_lengths[key]
             else:
                 lengths_to_use[key] = instance_padding_lengths[key]
-        if verbose:
-            logger.info("Now actually padding instances to length: %s", str(lengths_to_use))
-            for instance in tqdm.tqdm(self.instances):
-                instance.pad(lengths_to_use)
-        else:
-            for instance in self.instances:
-                instance.pad(lengths_to_use)
+        return lengths_to_use
 
     def as_training_data(self):
         """
@@ -1,4 +1,5 @@
-from typing import List
+from typing import Iterable, List
+import itertools
 import json
 
 from overrides import overrides
@@ -6,6 +7,7 @@ from overrides import overrides
 from ..dataset import TextDataset, log_label_counts
 from ...instances import TextInstance
 from ....common.params import Params
+from ....common.parallel import parallel_imap
 
 
 class SnliDataset(TextDataset):
@@ -15,21 +17,40 @@ class SnliDataset(TextDataset):
 
     @staticmethod
     @overrides
-    def read_from_file(filename: str, instance_class, params: Params=None):
-
-        instances = []
-        for line in open(filename, 'r'):
-            example = json.loads(line)
-
-            # TODO(mark) why does this not match snli? Fix.
-            label = example["gold_label"]
-            if label == "entailment":
-                label = "entails"
-            elif label == "contradiction":
-                label = "contradicts"
-
-            text = example["sentence1"]
-            hypothesis = example["sentence2"]
-            instances.append(instance_class(text, hypothesis, label))
+    def read_from_file(filename: str,
+                       instance_class,
+                       params: Params=None,
+                       max_instances: int=None,
+                       num_workers: int=1):
+
+        with open(filename, 'r') as snli_file:
+            return SnliDataset.read_from_lines(snli_file, instance_class, params, max_instances, num_workers)
+
+    @staticmethod
+    @overrides
+    def read_from_lines(lines: Iterable[str],
+                        instance_class,
+                        params: Params=None,
+                        max_instances: int=None,
+                        num_workers: int=1):
+        lines = itertools.islice(lines, max_instances)
+        instances = list(parallel_imap(lambda line: SnliDataset._read_instance(line, instance_class),
+                                       lines,
+                                       num_workers))
         log_label_counts(instances)
         return SnliDataset(instances, params)
+
+    @staticmethod
+    def _read_instance(line: str, instance_class) -> TextInstance:
+        example = json.loads(line)
+
+        # TODO(mark) why does this not match snli? Fix.
+        label = example["gold_label"]
+        if label == "entailment":
+            label = "entails"
+        elif label == "contradiction":
+            label = "contradicts"
+
+        text = example["sentence1"]
+        hypothesis = example["sentence2"]
+        return instance_class(text, hypothesis, label)
@@ -19,17 +19,32 @@ class LanguageModelingDataset(TextDataset):
 
     @staticmethod
     @overrides
-    def read_from_file(filename: str, instance_class, params: Params=None):
+    def read_from_file(filename: str,
+                       instance_class,
+                       params: Params=None,
+                       max_instances: int=None,
+                       num_workers: int=1):  # pylint: disable=unused-argument
+        # Splitting the file into sequences is just cheap string manipulation, so we ignore
+        # `num_workers` here.
 
         sequence_length = params.get("sequence_length", 20)
-        with open(filename, "r") as text_file:
-            text = text_file.readlines()
-            text = " ".join([x.replace("\n", " ").strip() for x in text]).split(" ")
-
         instances = []
-        for index in range(0, len(text) - sequence_length, sequence_length):
-            word_sequence = " ".join(text[index: index + sequence_length])
-            instances.append(SentenceInstance(word_sequence))
+        # We stream over the file, keeping only the words we haven't yet put into an instance.  As
+        # in the original implementation, we split on single spaces after joining lines with a
+        # space, and any words left over at the end of the file that don't fill a complete
+        # sequence are dropped.
+        buffered_words = []
+        with open(filename, "r") as text_file:
+            for line in text_file:
+                if max_instances is not None and len(instances) >= max_instances:
+                    break
+                buffered_words.extend(line.replace("\n", " ").strip().split(" "))
+                while len(buffered_words) > sequence_length:
+                    if max_instances is not None and len(instances) >= max_instances:
+                        break
+                    word_sequence = " ".join(buffered_words[:sequence_length])
+                    instances.append(SentenceInstance(word_sequence))
+                    del buffered_words[:sequence_length]
 
         log_label_counts(instances)
         return LanguageModelingDataset(instances, params)
@@ -1,9 +1,16 @@
+from typing import List, Set
 import codecs
 import gzip
+import itertools
 import logging
+import os
+import shutil
 
 import numpy
 from keras.layers import Embedding
+
+from ..common.checks import ConfigurationError
+from ..common.parallel import parallel_imap
 from .data_indexer import DataIndexer
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
@@ -22,7 +29,8 @@ class PretrainedEmbeddings:
                             data_indexer: DataIndexer,
                             trainable=False,
                             log_misses=False,
-                            name="pretrained_embedding"):
+                            name="pretrained_embedding",
+                            num_workers: int=1):
         """
         Reads a pre-trained embedding file and generates a Keras Embedding layer that has weights
         initialized to the pre-trained embeddings.  The Embedding layer can either be trainable or
@@ -31,65 +39,41 @@ class PretrainedEmbeddings:
         We use the DataIndexer to map from the word strings in the embeddings file to the indices
         that we need, and to know which words from the embeddings file we can safely ignore.  If we
         come across a word in DataIndexer that does not show up with the embeddings file, we give
-        it a zero vector.
+        it a random vector.
+
+        The embeddings file is assumed to be gzipped, formatted as [word] [dim 1] [dim 2] ...,
+        unless the filename ends in ``.npy``, in which case we assume it's the binary format
+        written by :func:`convert_to_binary`.  That format is much faster to load, as we just
+        memory-map the matrix and pull out the rows we need, without parsing anything.
 
-        The embeddings file is assumed to be gzipped, formatted as [word] [dim 1] [dim 2] ...
+        If ``num_workers`` is greater than 1, we parse the text format in that many processes.
+        This doesn't change the result.
         """
-        words_to_keep = set(data_indexer.words_in_index())
         vocab_size = data_indexer.get_vocab_size()
-        embeddings = {}
-        embedding_dim = None
 
         # TODO(matt): make this a parameter
         embedding_misses_filename = 'embedding_misses.txt'
 
-        # First we read the embeddings from the file, only keeping vectors for the words we need.
+        # We read the embeddings from the file, only keeping vectors for the words we need.  The
+        # readers start with a randomly initialized weight matrix for the embedding layer, then
+        # fill in the word vectors they find, so that words without a pre-trained vector just have
+        # a random initialization.  `found` tells us which rows got filled in.
         logger.info("Reading embeddings from file")
-        with gzip.open(embeddings_filename, 'rb') as embeddings_file:
-            for line in embeddings_file:
-                fields = line.decode('utf-8').strip().split(' ')
-                if embedding_dim is None:
-                    embedding_dim = len(fields) - 1
-                    assert embedding_dim > 1, "Found embedding size of 1; do you have a header?"
-                else:
-                    if len(fields) - 1 != embedding_dim:
-                        # Sometimes there are funny unicode parsing problems that lead to different
-                        # fields lengths (e.g., a word with a unicode space character that splits
-                        # into more than one column).  We skip those lines.  Note that if you have
-                        # some kind of long header, this could result in all of your lines getting
-                        # skipped.  It's hard to check for that here; you just have to look in the
-                        # embedding_misses_file and at the model summary to make sure things look
-                        # like they are supposed to.
-                        continue
-                word = fields[0]
-                if word in words_to_keep:
-                    vector = numpy.asarray(fields[1:], dtype='float32')
-                    embeddings[word] = vector
+        if embeddings_filename.endswith('.npy'):
+            embedding_matrix, found = PretrainedEmbeddings._read_binary_embeddings(embeddings_filename,
+                                                                                   data_indexer)
+        else:
+            embedding_matrix, found = PretrainedEmbeddings._read_text_embeddings(embeddings_filename,
+                                                                                 data_indexer,
+                                                                                 num_workers)
+        embedding_dim = embedding_matrix.shape[1]
 
-
-        # Now we initialize the weight matrix for an embedding layer, starting with random vectors,
-        # then filling in the word vectors we just read.
-        logger.info("Initializing pre-trained embedding layer")
         if log_misses:
             logger.info("Logging embedding misses to %s", embedding_misses_filename)
-            embedding_misses_file = codecs.open(embedding_misses_filename, 'w', 'utf-8')
-        embedding_matrix = PretrainedEmbeddings.initialize_random_matrix((vocab_size, embedding_dim))
-
-        # The 2 here is because we know too much about the DataIndexer.  Index 0 is the padding
-        # index, and the vector for that dimension is going to be 0.  Index 1 is the OOV token, and
-        # we can't really set a vector for the OOV token.
-        for i in range(2, vocab_size):
-            word = data_indexer.get_word_from_index(i)
-
-            # If we don't have a pre-trained vector for this word, we'll just leave this row alone,
-            # so the word has a random initialization.
-            if word in embeddings:
-                embedding_matrix[i] = embeddings[word]
-            elif log_misses:
-                print(word, file=embedding_misses_file)
-
-        if log_misses:
-            embedding_misses_file.close()
+            with codecs.open(embedding_misses_filename, 'w', 'utf-8') as embedding_misses_file:
+                for i in range(2, vocab_size):
+                    if not found[i]:
+                        print(data_indexer.get_word_from_index(i), file=embedding_misses_file)
 
         # The weight matrix is initialized, so we construct and return the actual Embedding layer.
         return Embedding(input_dim=vocab_size,
@@ -98,3 +82,186 @@ class PretrainedEmbeddings:
                          weights=[embedding_matrix],
                          trainable=trainable,
                          name=name)
+
+    @staticmethod
+    def convert_to_binary(embeddings_filename: str, output_prefix: str):
+        """
+        Converts a gzipped, glove-formatted embedding file into a binary format that is much faster
+        to load: a vocabulary file, ``[output_prefix].vocab``, with one word per line, and a
+        ``float32`` matrix saved with ``numpy.save`` as ``[output_prefix].npy``, where row ``i`` is
+        the vector for the word on line ``i`` of the vocabulary file.  Pass the ``.npy`` file to
+        :func:`get_embedding_layer` (or as a ``pretrained_file`` in your model parameters) to use
+        it.
+
+        Lines that have a different number of fields than the first line are skipped, just as when
+        we read the text file directly.  This only needs to be done once per embedding file, and
+        we read the input in a single pass, so it doesn't need much memory.
+        """
+        vocab_filename = output_prefix + '.vocab'
+        matrix_filename = output_prefix + '.npy'
+        embedding_dim = None
+        num_rows = 0
+        logger.info("Converting %s to %s and %s", embeddings_filename, vocab_filename, matrix_filename)
+        # We don't know how many rows there are until we've read the whole file, and we need that
+        # for the .npy header, so we write the raw vectors to a temporary file first.
+        raw_filename = matrix_filename + '.tmp'
+        with gzip.open(embeddings_filename, 'rb') as embeddings_file, \
+                open(vocab_filename, 'w', encoding='utf-8', newline='\n') as vocab_file, \
+                open(raw_filename, 'wb') as raw_file:
+            for line in embeddings_file:
+                fields = line.decode('utf-8').strip().split(' ')
+                if embedding_dim is None:
+                    embedding_dim = len(fields) - 1
+                    if embedding_dim <= 1:
+                        break
+                elif len(fields) - 1 != embedding_dim:
+                    continue
+                vocab_file.write(fields[0] + '\n')
+                raw_file.write(numpy.asarray(fields[1:], dtype='float32').tobytes())
+                num_rows += 1
+        if embedding_dim is None or embedding_dim <= 1:
+            os.remove(vocab_filename)
+            os.remove(raw_filename)
+            if embedding_dim is None:
+                raise ConfigurationError("Found no embedding vectors in %s" % embeddings_filename)
+            raise ConfigurationError("Found embedding size of %d in %s; does it have a header?" %
+                                     (embedding_dim, embeddings_filename))
+        header = {'descr': numpy.lib.format.dtype_to_descr(numpy.dtype('float32')),
+                  'fortran_order': False,
+                  'shape': (num_rows, embedding_dim)}
+        with open(matrix_filename, 'wb') as matrix_file, open(raw_filename, 'rb') as raw_file:
+            numpy.lib.format.write_array_header_1_0(matrix_file, header)
+            shutil.copyfileobj(raw_file, matrix_file)
+        os.remove(raw_filename)
+        logger.info("Wrote %d vectors of dimension %d", num_rows, embedding_dim)
+
+    @staticmethod
+    def _fill_embedding_matrix(embedding_matrix: numpy.array,
+                               found: numpy.array,
+                               word_indices: numpy.array,
+                               vectors: numpy.array):
+        """
+        Copies ``vectors`` into the rows ``word_indices`` of ``embedding_matrix``, marking them in
+        ``found``.
+
+        The 2 here is because we know too much about the DataIndexer.  Index 0 is the padding
+        index, and the vector for that dimension is going to be 0.  Index 1 is the OOV token, and
+        we can't really set a vector for the OOV token.
+        """
+        to_keep = word_indices >= 2
+        embedding_matrix[word_indices[to_keep]] = vectors[to_keep]
+        found[word_indices[to_keep]] = True
+
+    @staticmethod
+    def _read_binary_embeddings(matrix_filename: str, data_indexer: DataIndexer):
+        """
+        Reads embeddings in the format written by :func:`convert_to_binary`.  The matrix is
+        memory-mapped, so we only read the rows that we need from disk (and processes that load
+        the same file share the OS page cache instead of each having their own copy).
+        """
+        vocab_filename = matrix_filename[:-len('.npy')] + '.vocab'
+        words_to_keep = set(data_indexer.words_in_index())
+        rows = {}
+        with open(vocab_filename, 'r', encoding='utf-8', newline='\n') as vocab_file:
+            for row, line in enumerate(vocab_file):
+                word = line[:-1]
+                if word in words_to_keep:
+                    # As when reading the text format, if a word appears twice, the last one wins.
+                    rows[word] = row
+        matrix = numpy.load(matrix_filename, mmap_mode='r')
+        vocab_size = data_indexer.get_vocab_size()
+        embedding_matrix = PretrainedEmbeddings.initialize_random_matrix((vocab_size, matrix.shape[1]))
+        found = numpy.zeros(vocab_size, dtype='bool')
+        words = list(rows.keys())
+        word_indices = numpy.asarray([data_indexer.get_word_index(word) for word in words], dtype='int64')
+        matrix_rows = numpy.asarray([rows[word] for word in words], dtype='int64')
+        # Reading the rows in order is friendlier to the disk.
+        order = numpy.argsort(matrix_rows)
+        vectors = numpy.asarray(matrix[matrix_rows[order]])
+        PretrainedEmbeddings._fill_embedding_matrix(embedding_matrix, found, word_indices[order], vectors)
+        return embedding_matrix, found
+
+    @staticmethod
+    def _read_text_embeddings(embeddings_filename: str, data_indexer: DataIndexer, num_workers: int=1):
+        """
+        Reads a gzipped, glove-formatted embedding file, keeping only the vectors for words in
+        ``data_indexer``.
+
+        We read the decompressed file in large blocks of complete lines, which get parsed by
+        :func:`_parse_embedding_lines`, in ``num_workers`` processes if that's more than one.  The
+        parsed vectors are copied straight into the embedding matrix, in file order, so if a word
+        shows up twice, the last vector wins.
+        """
+        words_to_keep = set(data_indexer.words_in_index())
+        vocab_size = data_indexer.get_vocab_size()
+        with gzip.open(embeddings_filename, 'rb') as embeddings_file:
+            # The first line determines the embedding dimension.
+            first_line = embeddings_file.readline().decode('utf-8')
+            embedding_dim = len(first_line.strip().split(' ')) - 1
+            assert embedding_dim > 1, "Found embedding size of 1; do you have a header?"
+            embedding_matrix = PretrainedEmbeddings.initialize_random_matrix((vocab_size, embedding_dim))
+            found = numpy.zeros(vocab_size, dtype='bool')
+
+            def parse_block(block: bytes):
+                return PretrainedEmbeddings._parse_embedding_lines(block.decode('utf-8').split('\n'),
+                                                                   embedding_dim,
+                                                                   words_to_keep)
+            blocks = itertools.chain([first_line.encode('utf-8')],
+                                     PretrainedEmbeddings._read_line_blocks(embeddings_file))
+            for words, vectors in parallel_imap(parse_block, blocks, num_workers, chunk_size=1):
+                word_indices = numpy.asarray([data_indexer.get_word_index(word) for word in words],
+                                             dtype='int64')
+                PretrainedEmbeddings._fill_embedding_matrix(embedding_matrix, found, word_indices, vectors)
+        return embedding_matrix, found
+
+    @staticmethod
+    def _read_line_blocks(input_file, block_size: int=1 << 23):
+        """
+        Reads ``input_file`` in blocks of roughly ``block_size`` bytes, each ending at a line
+        boundary.
+        """
+        remainder = b''
+        while True:
+            block = input_file.read(block_size)
+            if not block:
+                break
+            block = remainder + block
+            last_newline = block.rfind(b'\n')
+            if last_newline == -1:
+                remainder = block
+                continue
+            remainder = block[last_newline + 1:]
+            yield block[:last_newline]
+        if remainder:
+            yield remainder
+
+    @staticmethod
+    def _parse_embedding_lines(lines: List[str], embedding_dim: int, words_to_keep: Set[str]):
+        """
+        Parses lines from a glove-formatted embedding file, returning the words we want to keep,
+        and a ``float32`` matrix with their vectors.  We only split and convert the lines for words
+        we're keeping, and the numbers for all of those lines are converted in a single numpy call.
+        If a word appears more than once, we only return the last vector for it.
+        """
+        kept_fields = {}
+        for line in lines:
+            line = line.strip()
+            word = line.partition(' ')[0]
+            if word not in words_to_keep:
+                continue
+            fields = line.split(' ')
+            if len(fields) - 1 != embedding_dim:
+                # Sometimes there are funny unicode parsing problems that lead to different
+                # fields lengths (e.g., a word with a unicode space character that splits
+                # into more than one column).  We skip those lines.  Note that if you have
+                # some kind of long header, this could result in all of your lines getting
+                # skipped.  It's hard to check for that here; you just have to look in the
+                # embedding_misses_file and at the model summary to make sure things look
+                # like they are supposed to.
+                continue
+            kept_fields.pop(word, None)
+            kept_fields[word] = fields
+        words = list(kept_fields.keys())
+        values = [value for word in words for value in kept_fields[word][1:]]
+        vectors = numpy.asarray(values, dtype='float32').reshape((len(words), embedding_dim))
+        return words, vectors
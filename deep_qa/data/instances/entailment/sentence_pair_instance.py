@@ -3,7 +3,7 @@ from typing import Dict, List
 import numpy
 from overrides import overrides
 
-from ..instance import TextInstance, IndexedInstance
+from ..instance import TextInstance, IndexedInstance, IndexingContext, IndicesField
 from ...data_indexer import DataIndexer
 
 
@@ -27,9 +27,13 @@ class SentencePairInstance(TextInstance):
         return words
 
     @overrides
-    def to_indexed_instance(self, data_indexer: DataIndexer):
-        first_sentence = self._index_text(self.first_sentence, data_indexer)
-        second_sentence = self._index_text(self.second_sentence, data_indexer)
+    def _texts_to_index(self) -> List[str]:
+        return [self.first_sentence, self.second_sentence]
+
+    @overrides
+    def to_indexed_instance(self, data_indexer: DataIndexer, context: IndexingContext=None):
+        first_sentence = self._index_text(self.first_sentence, data_indexer, context)
+        second_sentence = self._index_text(self.second_sentence, data_indexer, context)
         return IndexedSentencePairInstance(first_sentence, second_sentence, self.label, self.index)
 
     @classmethod
@@ -50,6 +54,12 @@ class IndexedSentencePairInstance(IndexedInstance):
     SnliInstances where we have a labeled pair of text and hypothesis, and a sentence2vec instance where the
     objective is to train an encoder to predict whether the sentences are in context or not.
     """
+    padded_input_fields = [('first_sentence_indices', ['num_sentence_words'], [True]),
+                           ('second_sentence_indices', ['num_sentence_words'], [True])]
+    __slots__ = ['_first_sentence_indices', '_second_sentence_indices']
+    first_sentence_indices = IndicesField('first_sentence_indices')
+    second_sentence_indices = IndicesField('second_sentence_indices')
+
     def __init__(self, first_sentence_indices: List[int], second_sentence_indices: List[int], label: List[int],
                  index: int=None):
         super(IndexedSentencePairInstance, self).__init__(label, index)
@@ -63,8 +73,8 @@ class IndexedSentencePairInstance(IndexedInstance):
 
     @overrides
     def get_padding_lengths(self) -> Dict[str, int]:
-        first_sentence_lengths = self._get_word_sequence_lengths(self.first_sentence_indices)
-        second_sentence_lengths = self._get_word_sequence_lengths(self.second_sentence_indices)
+        first_sentence_lengths = self._get_word_sequence_lengths(self._first_sentence_indices)
+        second_sentence_lengths = self._get_word_sequence_lengths(self._second_sentence_indices)
         lengths = {}
         for key in first_sentence_lengths:
             lengths[key] = max(first_sentence_lengths[key], second_sentence_lengths[key])
@@ -80,3 +90,7 @@ class IndexedSentencePairInstance(IndexedInstance):
         first_sentence_array = numpy.asarray(self.first_sentence_indices, dtype='int32')
         second_sentence_array = numpy.asarray(self.second_sentence_indices, dtype='int32')
         return (first_sentence_array, second_sentence_array), numpy.asarray(self.label)
+
+    @overrides
+    def get_padded_label(self, padding_lengths: Dict[str, int]):
+        return numpy.asarray(self.label)
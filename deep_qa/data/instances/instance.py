@@ -16,11 +16,19 @@ As this codebase is dealing mostly with textual question answering, pretty much
 all of the concrete ``Instance`` types will have both a ``TextInstance`` and a
 corresponding ``IndexedInstance``, which you can see in the individual files
 for each ``Instance`` type.
+
+To keep large indexed datasets small in memory, ``IndexedInstances`` use ``__slots__`` instead of a
+per-object ``__dict__``, and store their word indices compactly, as :class:`RaggedIndices`, behind
+:class:`IndicesField` attributes that you can set to plain python lists.  Reading them gives a new,
+read-only copy of the lists (a :class:`ReadOnlyList`), so editing them in place raises an error.
 """
 import itertools
-from typing import Any, Callable, Dict, List
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
+
+import numpy
 
 from ...common.params import Params
+from ...common.util import flatten_ragged, get_ragged_item, unflatten_ragged
 from ..tokenizers import tokenizers
 from ..data_indexer import DataIndexer
 
@@ -38,10 +46,202 @@ class Instance:
         Used for matching instances with other data, such as background
         sentences.
     """
+    __slots__ = ['label', 'index']
+
     def __init__(self, label, index: int=None):
         self.label = label
         self.index = index
 
+    def get_fields(self) -> Dict[str, Any]:
+        """
+        Returns all of the data in this instance as a dictionary from attribute names to values,
+        like ``vars(instance)`` would if instances didn't use ``__slots__``.  Fields stored with an
+        :class:`IndicesField` are given by their public name, with their values as lists.
+        """
+        instance_class = type(self)
+        fields = {}
+        for cls in reversed(instance_class.__mro__):
+            for name in cls.__dict__.get('__slots__', []):
+                if name.startswith('_') and isinstance(getattr(instance_class, name[1:], None), IndicesField):
+                    name = name[1:]
+                if hasattr(self, name):
+                    fields[name] = getattr(self, name)
+        fields.update(getattr(self, '__dict__', {}))
+        return fields
+
+
+class RaggedIndices:
+    """
+    A compact, immutable representation of a (possibly nested) list of word indices, like ``[1, 2,
+    3]`` or ``[[1, 2], [3]]`` for words made of characters.  Instead of python lists of python
+    ``ints``, which take about 36 bytes per index, we keep a flat ``int32`` array of ``values``,
+    plus one array of ``offsets`` for each level of nesting, like the row pointers of a CSR sparse
+    matrix (see :func:`~deep_qa.common.util.flatten_ragged`).  A flat list of ints has no
+    offsets.
+
+    Don't modify the arrays; several instances can share one ``RaggedIndices`` object.
+    """
+    __slots__ = ['values', 'offsets']
+
+    def __init__(self, values: numpy.array, offsets: Sequence[numpy.array]=()):
+        self.values = values
+        self.offsets = tuple(offsets)
+
+    @classmethod
+    def from_list(cls, sequence: List[Any]) -> 'RaggedIndices':
+        """
+        Builds a ``RaggedIndices`` from nested lists of integers.  Raises a ``ValueError`` or
+        ``TypeError`` if ``sequence`` contains anything other than lists and integers.
+        """
+        values, offsets = flatten_ragged(sequence, cls._get_nesting_depth(sequence))
+        return cls(values, [level_offsets.astype(numpy.int32) for level_offsets in offsets])
+
+    def to_list(self) -> List[Any]:
+        """
+        Returns the indices as (possibly nested) lists of python ``ints``.
+        """
+        return unflatten_ragged(self.values, self.offsets)
+
+    def to_read_only_list(self) -> 'ReadOnlyList':
+        """
+        Like :func:`to_list`, but giving :class:`ReadOnlyLists <ReadOnlyList>` at every level.
+        """
+        current = ReadOnlyList(self.values.tolist())
+        for level_offsets in reversed(self.offsets):
+            bounds = level_offsets.tolist()
+            current = ReadOnlyList([ReadOnlyList(current[start:end])
+                                    for start, end in zip(bounds[:-1], bounds[1:])])
+        return current
+
+    @classmethod
+    def stack(cls, indices: List['RaggedIndices'], depth: int) -> 'RaggedIndices':
+        """
+        Combines ``RaggedIndices`` with ``depth`` levels of nesting each (0 for lists of ints) into
+        one ``RaggedIndices`` with one more level, whose ``to_list()`` is the list of their
+        ``to_list()`` results.  We just concatenate their arrays, without building any python
+        lists.  Empty sequences can have any depth.  Raises a ``ValueError`` if anything in
+        ``indices`` isn't a ``RaggedIndices`` with ``depth`` levels.
+        """
+        for item in indices:
+            if not isinstance(item, RaggedIndices) or (len(item.offsets) != depth and len(item) > 0):
+                raise ValueError("Can only stack RaggedIndices with %d levels of nesting" % depth)
+        lengths = numpy.fromiter((len(item) for item in indices), dtype=numpy.int64, count=len(indices))
+        offsets = [numpy.concatenate([[0], numpy.cumsum(lengths)]).astype(numpy.int32)]
+        empty_offsets = numpy.zeros(1, dtype=numpy.int32)
+        for level in range(depth):
+            level_offsets = [item.offsets[level] if len(item) > 0 else empty_offsets for item in indices]
+            # Each item's offsets start from 0, so we shift them by the number of entries (at the
+            # next level down) in the items before it.
+            ends = numpy.fromiter((item_offsets[-1] for item_offsets in level_offsets),
+                                  dtype=numpy.int64,
+                                  count=len(indices))
+            shifts = numpy.cumsum(ends) - ends
+            shifted = numpy.concatenate([item_offsets[:-1] for item_offsets in level_offsets] +
+                                        [empty_offsets]).astype(numpy.int64)
+            shifted[:-1] += numpy.repeat(shifts, [len(item_offsets) - 1 for item_offsets in level_offsets])
+            shifted[-1] = ends.sum()
+            offsets.append(shifted.astype(numpy.int32))
+        values = [item.values for item in indices if len(item) > 0]
+        if values:
+            values = numpy.concatenate(values)
+        else:
+            values = numpy.zeros(0, dtype=numpy.int32)
+        return cls(values, offsets)
+
+    def __len__(self):
+        if self.offsets:
+            return len(self.offsets[0]) - 1
+        return len(self.values)
+
+    def get_word_sequence_lengths(self) -> Dict[str, int]:
+        """
+        The same as :func:`IndexedInstance._get_word_sequence_lengths` on ``self.to_list()``, but
+        without building the lists.
+        """
+        padding_lengths = {'num_sentence_words': len(self)}
+        if self.offsets and len(self) > 0:
+            padding_lengths['num_word_characters'] = int(numpy.diff(self.offsets[0]).max())
+        return padding_lengths
+
+    @staticmethod
+    def _get_nesting_depth(sequence: List[Any]) -> int:
+        """
+        Returns how many levels of lists there are inside ``sequence`` (0 for a list of ints),
+        looking down the first non-empty list at each level.
+        """
+        depth = 0
+        current = sequence
+        while current and isinstance(current[0], list):
+            depth += 1
+            current = next((item for item in current if item), current[0])
+        return depth
+
+
+class ReadOnlyList(list):
+    """
+    A ``list`` that raises a ``TypeError`` if you try to modify it in place.  Otherwise, it works
+    like (and compares equal to) a plain list, and slicing it, adding it to another list, or
+    calling ``list()`` on it gives a plain list that you can modify.
+
+    This is what reading an :class:`IndicesField` gives: the lists are a new copy of the stored
+    indices, so modifying them couldn't change the instance anyway.
+    """
+    __slots__ = []
+
+    def _raise_read_only(self, *args, **kwargs):
+        raise TypeError("These indices are read-only; make a copy with list(), modify it, and "
+                        "assign it back to the attribute instead")
+
+    append = extend = insert = pop = remove = clear = sort = reverse = _raise_read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _raise_read_only
+
+    def __reduce__(self):
+        # The default pickling for list subclasses calls ``extend``.  Copies don't need to be
+        # read-only, so we just make them plain lists.
+        return (list, (list(self),))
+
+
+class IndicesField:
+    """
+    A data descriptor for the word index fields of ``IndexedInstances``.  Setting the attribute to
+    a (possibly nested) list of integers stores it as :class:`RaggedIndices`, in a slot with the
+    same name plus a leading underscore; reading the attribute gives back the lists, as
+    :class:`ReadOnlyLists <ReadOnlyList>`.
+
+    The lists are rebuilt from the ``RaggedIndices`` on every read, so modifying them in place
+    (e.g., ``instance.word_indices.append(0)``) couldn't change the instance, and raises a
+    ``TypeError`` instead; you need to modify a copy and assign it back to the attribute.
+    Rebuilding the lists also isn't free, so code that reads
+    the indices of many instances, like
+    :func:`~deep_qa.data.datasets.dataset.IndexedDataset.as_padded_training_data`, should use the
+    stored ``RaggedIndices`` directly.
+
+    Values that aren't lists of integers (e.g., ``None``) are stored as they are, and you can also
+    assign a ``RaggedIndices`` object directly, which lets several instances share one.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.slot_name = '_' + name
+
+    def __get__(self, instance, owner):
+        """
+        Returns a new, read-only copy of the indices as lists; see the class docstring.
+        """
+        if instance is None:
+            return self
+        value = getattr(instance, self.slot_name)
+        if isinstance(value, RaggedIndices):
+            return value.to_read_only_list()
+        return value
+
+    def __set__(self, instance, value):
+        if isinstance(value, list):
+            try:
+                value = RaggedIndices.from_list(value)
+            except (OverflowError, TypeError, ValueError):
+                pass
+        setattr(instance, self.slot_name, value)
+
 
 class TextInstance(Instance):
     """
@@ -62,15 +262,62 @@ class TextInstance(Instance):
     """
     tokenizer = tokenizers['words'](Params({}))
 
+    # Fields holding text that is often identical across many instances, like the passage that all
+    # of the questions about it share in reading comprehension data.  ``TextDatasets`` make
+    # instances with the same text in these fields share one string, and when indexing a dataset,
+    # we index each distinct text in these fields once, and give all of the instances the same
+    # indices (see ``_index_shared_text``).
+    shared_text_fields = []  # type: List[str]
+
     def __init__(self, label, index: int=None):
         super(TextInstance, self).__init__(label, index)
 
     def _words_from_text(self, text: str) -> Dict[str, List[str]]:
         return self.tokenizer.get_words_for_indexer(text)
 
-    def _index_text(self, text: str, data_indexer: DataIndexer) -> List[int]:
+    def _index_text(self, text: str, data_indexer: DataIndexer, context: 'IndexingContext'=None) -> List[int]:
+        if context is not None:
+            indices = context.get_precomputed_text_indices(text)
+            if indices is not None:
+                return indices
         return self.tokenizer.index_text(text, data_indexer)
 
+    def _index_shared_text(self,
+                           text: str,
+                           data_indexer: DataIndexer,
+                           context: 'IndexingContext'=None) -> 'RaggedIndices':
+        """
+        Like ``_index_text``, for text from one of the ``shared_text_fields``, but giving the
+        indices as :class:`RaggedIndices`, which an :class:`IndicesField` stores as is.  Every
+        instance indexed with the same ``context`` that has this same text gets the very same
+        ``RaggedIndices`` object, which saves a lot of time and memory for datasets with many
+        copies of the same text.
+        """
+        return self._get_shared_value(('indices', text),
+                                      lambda: RaggedIndices.from_list(self._index_text(text,
+                                                                                       data_indexer,
+                                                                                       context)),
+                                      context)
+
+    @staticmethod
+    def _get_shared_value(key: Any, compute_value: Callable[[], Any], context: 'IndexingContext'=None) -> Any:
+        """
+        Returns ``context.get_shared_value(key, compute_value)``, or just ``compute_value()`` if
+        there is no ``context``.
+        """
+        if context is None:
+            return compute_value()
+        return context.get_shared_value(key, compute_value)
+
+    def _texts_to_index(self) -> List[str]:
+        """
+        Returns all of the texts that :func:`to_indexed_instance` passes to ``_index_text``, so
+        that they can be indexed in a batch ahead of time (see
+        :func:`IndexingContext.precompute_text_indices`).  Subclasses that don't override this
+        still work, they just don't get the speed up.
+        """
+        return []
+
     def words(self) -> Dict[str, List[str]]:
         """
         Returns a list of all of the words in this instance, contained in a
@@ -97,7 +344,9 @@ class TextInstance(Instance):
         """
         raise NotImplementedError
 
-    def to_indexed_instance(self, data_indexer: DataIndexer) -> 'IndexedInstance':
+    def to_indexed_instance(self,
+                            data_indexer: DataIndexer,
+                            context: 'IndexingContext'=None) -> 'IndexedInstance':
         """
         Converts the words in this ``Instance`` into indices using
         the ``DataIndexer``.
@@ -107,6 +356,11 @@ class TextInstance(Instance):
         data_indexer : DataIndexer
             ``DataIndexer`` to use in converting the ``Instance`` to
             an ``IndexedInstance``.
+        context : IndexingContext, optional (default=None)
+            When indexing many instances, as :func:`TextDataset.to_indexed_dataset
+            <deep_qa.data.datasets.dataset.TextDataset.to_indexed_dataset>` does, this holds their
+            pre-computed text indices and the values they share.  Implementations should pass it
+            on to ``_index_text`` and ``_index_shared_text``.
 
         Returns
         -------
@@ -142,6 +396,103 @@ class TextInstance(Instance):
         raise RuntimeError("%s instances can't be read from a line!" % str(cls))
 
 
+class IndexingContext:
+    """
+    Holds the state that we keep while indexing many ``TextInstances`` with one ``DataIndexer``,
+    which :func:`TextDataset.to_indexed_dataset
+    <deep_qa.data.datasets.dataset.TextDataset.to_indexed_dataset>` creates for the whole dataset
+    and passes to each instance's ``to_indexed_instance``:
+
+    1. The indices of all of the texts in the current batch of instances, which we compute at once
+       with ``Tokenizer.index_texts`` (see :func:`precompute_text_indices`), because that's much
+       faster than indexing each text separately.
+    2. Values that many instances share, like the indices of a passage that many questions are
+       about, keyed by the text they were computed from (see :func:`get_shared_value`).  We keep
+       these for the whole dataset, so instances share them even if they are in different batches.
+
+    A context is only valid for one ``DataIndexer`` and tokenizer.  You can add words to the
+    ``DataIndexer`` while using it (like the stop token of a ``CharacterSpanInstance``), as long as
+    the texts that were already indexed don't contain them.
+    """
+    def __init__(self):
+        self._text_positions = {}  # type: Dict[str, int]
+        self._values = None
+        self._offsets = None
+        self._shared_values = {}  # type: Dict[Any, Any]
+        # The shared values used since the last call to ``pop_used_shared_values``.
+        self._used_shared_values = {}  # type: Dict[Any, Any]
+
+    def precompute_text_indices(self, instances: List[TextInstance], data_indexer: DataIndexer):
+        """
+        Indexes the texts of all of the given ``instances`` at once, using the tokenizer's
+        ``index_texts`` method, so that calling ``to_indexed_instance`` on them with this context
+        afterwards is faster.  Each distinct text is only indexed once.  This replaces the texts
+        from the previous call, so only call it with the instances you're about to index.
+        """
+        # pylint: disable=protected-access
+        texts = {}
+        for instance in instances:
+            for text in instance._texts_to_index():
+                if isinstance(text, str) and text not in texts:
+                    texts[text] = len(texts)
+        self._values, self._offsets = TextInstance.tokenizer.index_texts(list(texts), data_indexer)
+        self._text_positions = texts
+
+    def get_precomputed_text_indices(self, text: str) -> List[int]:
+        """
+        Returns the indices of ``text``, if they were computed by the last call to
+        :func:`precompute_text_indices`, and ``None`` otherwise.
+        """
+        position = self._text_positions.get(text) if isinstance(text, str) else None
+        if position is None:
+            return None
+        return get_ragged_item(self._values, self._offsets, position)
+
+    def get_shared_value(self, key: Any, compute_value: Callable[[], Any]) -> Any:
+        """
+        Returns the same value for every call with the same ``key``, only calling
+        ``compute_value`` the first time.  The ``key`` should contain everything the value is
+        computed from, like the text that gets indexed.
+        """
+        value = self._shared_values.get(key)
+        if value is None:
+            value = self._shared_values[key] = compute_value()
+        self._used_shared_values[key] = value
+        return value
+
+    def pop_used_shared_values(self) -> Dict[Any, Any]:
+        """
+        Returns the shared values (by key) that were used since the last call to this method.
+        When we index instances in another process, it sends these back along with the indexed
+        instances, so that :func:`share_values` can make them use the values in this process.
+        """
+        used_shared_values = self._used_shared_values
+        self._used_shared_values = {}
+        return used_shared_values
+
+    def share_values(self, indexed_instances: List['IndexedInstance'], shared_values: Dict[Any, Any]):
+        """
+        Makes ``indexed_instances``, which were indexed with a copy of this context in another
+        process, use the shared values in this context instead of their own copies.
+        ``shared_values`` are the values they used, as given by :func:`pop_used_shared_values` in
+        the other process, and must have been sent here together with the instances, so that they
+        are still the same objects.  Values that this context doesn't have yet are added to it.
+        """
+        replacements = {}
+        for key, value in shared_values.items():
+            shared_value = self._shared_values.setdefault(key, value)
+            if shared_value is not value:
+                replacements[id(value)] = shared_value
+        if not replacements:
+            return
+        for instance in indexed_instances:
+            for cls in type(instance).__mro__:
+                for slot_name in cls.__dict__.get('__slots__', []):
+                    replacement = replacements.get(id(getattr(instance, slot_name, None)))
+                    if replacement is not None:
+                        setattr(instance, slot_name, replacement)
+
+
 class IndexedInstance(Instance):
     """
     An indexed data instance has all word tokens replaced with word indices,
@@ -160,6 +511,22 @@ class IndexedInstance(Instance):
     This would mean that ``"Jamie"`` and ``"Holly"`` were OOV to the
     ``DataIndexer``, and the other words were given indices.
     """
+    # The word sequences that ``as_training_data`` returns as inputs, in order, described so that
+    # :func:`~deep_qa.data.datasets.dataset.IndexedDataset.as_padded_training_data` can build the
+    # padded input arrays for a whole batch at once, without padding each instance.  Each entry is
+    # ``(attribute, padding_keys, truncate_from_right)``, where ``padding_keys`` gives the padding
+    # length to use at each level of nesting of the attribute (e.g., ``['num_sentence_words']``
+    # for a list of word indices), and ``truncate_from_right`` says how to truncate and pad at each
+    # level (see :func:`pad_sequence_to_length`).  If the words are represented with characters,
+    # we add a ``'num_word_characters'`` level automatically.  Classes that leave this as ``None``
+    # get padded one instance at a time, with :func:`pad`, and also need to implement
+    # :func:`get_padded_label`.
+    padded_input_fields = None  # type: List[Tuple[str, List[str], List[bool]]]
+
+    # Subclasses should also declare ``__slots__``, with the word index fields stored by an
+    # :class:`IndicesField`, so that a large dataset of indexed instances stays small in memory.
+    __slots__ = []
+
     @classmethod
     def empty_instance(cls):
         """
@@ -215,8 +582,26 @@ class IndexedInstance(Instance):
         """
         raise NotImplementedError
 
+    def get_padded_label(self, padding_lengths: Dict[str, int]):
+        """
+        Returns the label part of :func:`as_training_data`, as it would be if this instance were
+        padded to ``padding_lengths``, without actually padding (or otherwise modifying) it.  This
+        only needs implementing in classes that set ``padded_input_fields``.
+        """
+        raise NotImplementedError
+
+    # pylint: disable=no-self-use,unused-argument
+    def is_label_truncated(self, padding_lengths: Dict[str, int]) -> bool:
+        """
+        Returns ``True`` if padding this instance to ``padding_lengths`` would cut off (part of) its
+        label, like a span answer in the part of a passage that gets truncated.  Most labels don't
+        depend on padding, so the default implementation returns ``False``.
+        """
+        return False
+    # pylint: enable=no-self-use,unused-argument
+
     @staticmethod
-    def _get_word_sequence_lengths(word_indices: List) -> Dict[str, int]:
+    def _get_word_sequence_lengths(word_indices: Union[List, RaggedIndices]) -> Dict[str, int]:
         """
         Because ``TextEncoders`` can return complex data structures, we might
         actually have several things to pad for a single word sequence. We
@@ -226,7 +611,12 @@ class IndexedInstance(Instance):
         characters, the dictionary additionally contains a
         'num_word_characters' key, with a value corresponding to the longest
         word in the sequence.
+
+        You can also pass the stored ``RaggedIndices`` of an :class:`IndicesField`, which is faster
+        than reading the field as lists.
         """
+        if isinstance(word_indices, RaggedIndices):
+            return word_indices.get_word_sequence_lengths()
         padding_lengths = {'num_sentence_words': len(word_indices)}
         if len(word_indices) > 0 and not isinstance(word_indices[0], int):
             if isinstance(word_indices[0], list):
@@ -3,7 +3,7 @@ from typing import Dict, List
 import numpy
 from overrides import overrides
 
-from ..instance import TextInstance, IndexedInstance
+from ..instance import TextInstance, IndexedInstance, IndexingContext, IndicesField
 from ...data_indexer import DataIndexer
 
 
@@ -27,8 +27,12 @@ class SentenceInstance(TextInstance):
         return self._words_from_text(self.text)
 
     @overrides
-    def to_indexed_instance(self, data_indexer: DataIndexer):
-        indices = self._index_text(self.text, data_indexer)
+    def _texts_to_index(self) -> List[str]:
+        return [self.text]
+
+    @overrides
+    def to_indexed_instance(self, data_indexer: DataIndexer, context: IndexingContext=None):
+        indices = self._index_text(self.text, data_indexer, context)
         # We'll add start and end symbols to the indices here, then split this into an input
         # sequence and an output sequence, offset by one, where the input has the start token, and
         # the output has the end token.
@@ -66,6 +70,10 @@ class SentenceInstance(TextInstance):
 
 
 class IndexedSentenceInstance(IndexedInstance):
+    padded_input_fields = [('word_indices', ['num_sentence_words'], [True])]
+    __slots__ = ['_word_indices']
+    word_indices = IndicesField('word_indices')
+
     def __init__(self, word_indices: List[int], label_indices: List[int], index: int=None):
         super(IndexedSentenceInstance, self).__init__(label_indices, index)
         self.word_indices = word_indices
@@ -78,7 +86,7 @@ class IndexedSentenceInstance(IndexedInstance):
     @overrides
     def get_padding_lengths(self) -> Dict[str, int]:
         # len(label_indices) == len(word_indices), so we only need to return this one length.
-        return self._get_word_sequence_lengths(self.word_indices)
+        return self._get_word_sequence_lengths(self._word_indices)
 
     @overrides
     def pad(self, padding_lengths: Dict[str, int]):
@@ -88,7 +96,11 @@ class IndexedSentenceInstance(IndexedInstance):
     @overrides
     def as_training_data(self):
         word_array = numpy.asarray(self.word_indices, dtype='int32')
-        label_array = numpy.asarray(self.label, dtype='int32')
+        return word_array, self.get_padded_label(self.get_padding_lengths())
+
+    @overrides
+    def get_padded_label(self, padding_lengths: Dict[str, int]):
+        label = self.pad_sequence_to_length(self.label, padding_lengths['num_sentence_words'])
         # The expand dims here is because Keras' sparse categorical cross entropy expects tensors
         # of shape (batch_size, num_words, 1).
-        return word_array, numpy.expand_dims(label_array, axis=2)
+        return numpy.expand_dims(numpy.asarray(label, dtype='int32'), axis=1)
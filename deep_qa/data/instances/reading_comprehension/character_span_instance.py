@@ -1,8 +1,9 @@
-from typing import Tuple, List
+from typing import Dict, List, Tuple
 
 import numpy
 from overrides import overrides
 
+from ..instance import IndexingContext, RaggedIndices
 from .question_passage_instance import QuestionPassageInstance, IndexedQuestionPassageInstance
 from ...data_indexer import DataIndexer
 
@@ -75,25 +76,52 @@ class CharacterSpanInstance(QuestionPassageInstance):
         return cls(question, passage, (span_begin, span_end), index)
 
     @overrides
-    def to_indexed_instance(self, data_indexer: DataIndexer):
-        instance = super(CharacterSpanInstance, self).to_indexed_instance(data_indexer)
+    def to_indexed_instance(self, data_indexer: DataIndexer, context: IndexingContext=None):
+        instance = super(CharacterSpanInstance, self).to_indexed_instance(data_indexer, context)
         stop_index = data_indexer.add_word_to_index(self.stop_token)
-        if isinstance(instance.passage_indices[0], list):
-            instance.passage_indices.append([stop_index])
-        else:
-            instance.passage_indices.append(stop_index)
-        return IndexedCharacterSpanInstance(instance.question_indices, instance.passage_indices,
+        # The passage indices can be shared with other instances, so we share the passage with the
+        # stop token, too.
+        passage_indices = self._get_shared_value(('passage with stop token', self.passage_text, self.stop_token),
+                                                 lambda: RaggedIndices.from_list(
+                                                         self._add_stop_index(instance.passage_indices,
+                                                                              stop_index)),
+                                                 context)
+        return IndexedCharacterSpanInstance(instance.question_indices, passage_indices,
                                             instance.label, instance.index)
 
+    @staticmethod
+    def _add_stop_index(passage_indices: List, stop_index: int) -> List:
+        if isinstance(passage_indices[0], list):
+            return passage_indices + [[stop_index]]
+        return passage_indices + [stop_index]
+
 
 class IndexedCharacterSpanInstance(IndexedQuestionPassageInstance):
+    __slots__ = []
+
     @overrides
     def as_training_data(self):
         input_arrays, _ = super(IndexedCharacterSpanInstance, self).as_training_data()
+        return input_arrays, self.get_padded_label(self.get_padding_lengths())
+
+    @overrides
+    def get_padded_label(self, padding_lengths: Dict[str, int]):
+        """
+        Returns one-hot arrays for the span begin and end.  If the passage gets truncated before
+        the end of the span, both arrays are all zeros, so the instance doesn't add anything to
+        the (cross-entropy) loss.
+        """
         span_begin_label = span_end_label = None
         if self.label is not None:
-            span_begin_label = numpy.zeros((len(self.passage_indices)))
-            span_end_label = numpy.zeros((len(self.passage_indices)))
-            span_begin_label[self.label[0]] = 1
-            span_end_label[self.label[1]] = 1
-        return input_arrays, (span_begin_label, span_end_label)
+            span_begin_label = numpy.zeros((padding_lengths['num_passage_words']))
+            span_end_label = numpy.zeros((padding_lengths['num_passage_words']))
+            if not self.is_label_truncated(padding_lengths):
+                span_begin_label[self.label[0]] = 1
+                span_end_label[self.label[1]] = 1
+        return (span_begin_label, span_end_label)
+
+    @overrides
+    def is_label_truncated(self, padding_lengths: Dict[str, int]) -> bool:
+        # Passages are truncated at the end (keeping the start), so the span is cut off if it ends
+        # past the padded length.
+        return self.label is not None and self.label[1] >= padding_lengths['num_passage_words']
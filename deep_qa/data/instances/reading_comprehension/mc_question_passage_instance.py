@@ -2,6 +2,7 @@ from typing import Dict, List, Tuple
 import numpy as np
 
 from overrides import overrides
+from ..instance import IndexingContext, IndicesField
 from .question_passage_instance import IndexedQuestionPassageInstance, QuestionPassageInstance
 from ...data_indexer import DataIndexer
 
@@ -45,10 +46,14 @@ class McQuestionPassageInstance(QuestionPassageInstance):
         return self.label
 
     @overrides
-    def to_indexed_instance(self, data_indexer: DataIndexer):
-        question_indices = self._index_text(self.question_text, data_indexer)
-        passage_indices = self._index_text(self.passage_text, data_indexer)
-        option_indices = [self._index_text(option, data_indexer) for option in
+    def _texts_to_index(self) -> List[str]:
+        return [self.question_text, self.passage_text] + self.answer_options
+
+    @overrides
+    def to_indexed_instance(self, data_indexer: DataIndexer, context: IndexingContext=None):
+        question_indices = self._index_text(self.question_text, data_indexer, context)
+        passage_indices = self._index_shared_text(self.passage_text, data_indexer, context)
+        option_indices = [self._index_text(option, data_indexer, context) for option in
                           self.answer_options]
         return IndexedMcQuestionPassageInstance(question_indices, passage_indices,
                                                 option_indices, self.label, self.index)
@@ -83,6 +88,11 @@ class McQuestionPassageInstance(QuestionPassageInstance):
 
 
 class IndexedMcQuestionPassageInstance(IndexedQuestionPassageInstance):
+    padded_input_fields = (IndexedQuestionPassageInstance.padded_input_fields +
+                           [('option_indices', ['num_options', 'num_option_words'], [False, True])])
+    __slots__ = ['_option_indices']
+    option_indices = IndicesField('option_indices')
+
     def __init__(self,
                  question_indices: List[int],
                  passage_indices: List[int],
@@ -140,13 +150,14 @@ class IndexedMcQuestionPassageInstance(IndexedQuestionPassageInstance):
 
         # pad the number of options
         num_options = padding_lengths['num_options']
-        while len(self.option_indices) < num_options:
-            self.option_indices.append([])
-        self.option_indices = self.option_indices[:num_options]
+        option_indices = list(self.option_indices)
+        while len(option_indices) < num_options:
+            option_indices.append([])
+        option_indices = option_indices[:num_options]
 
         # pad the number of words in the options, number of characters in each word in option
         padded_options = []
-        for indices in self.option_indices:
+        for indices in option_indices:
             padding_lengths['num_sentence_words'] = padding_lengths['num_option_words']
             padded_options.append(self.pad_word_sequence(indices, padding_lengths))
         self.option_indices = padded_options
@@ -157,9 +168,13 @@ class IndexedMcQuestionPassageInstance(IndexedQuestionPassageInstance):
         question_array = np.asarray(self.question_indices, dtype='int32')
         passage_array = np.asarray(self.passage_indices, dtype='int32')
         options_array = np.asarray(self.option_indices, dtype='int32')
-        if self.label is None:
-            label = None
-        else:
-            label = np.zeros((len(self.option_indices)))
-            label[self.label] = 1
+        label = self.get_padded_label(self.get_padding_lengths())
         return (question_array, passage_array, options_array), label
+
+    @overrides
+    def get_padded_label(self, padding_lengths: Dict[str, int]):
+        if self.label is None:
+            return None
+        label = np.zeros((padding_lengths['num_options']))
+        label[self.label] = 1
+        return label
@@ -3,7 +3,7 @@ from typing import Dict, List, Any
 import numpy as np
 from overrides import overrides
 
-from ..instance import TextInstance, IndexedInstance
+from ..instance import TextInstance, IndexedInstance, IndexingContext, IndicesField
 from ...data_indexer import DataIndexer
 
 
@@ -13,6 +13,9 @@ class QuestionPassageInstance(TextInstance):
     text and a passage, where the passage contains the answer to the question. This class should
     not be used directly due to the missing ``_index_label`` function, use a subclass instead.
     """
+    # Datasets like SQuAD have several questions about each passage.
+    shared_text_fields = ['passage_text']
+
     def __init__(self, question_text: str, passage_text: str, label: Any, index: int=None):
         super(QuestionPassageInstance, self).__init__(label, index)
         self.question_text = question_text
@@ -39,9 +42,13 @@ class QuestionPassageInstance(TextInstance):
         raise NotImplementedError
 
     @overrides
-    def to_indexed_instance(self, data_indexer: DataIndexer):
-        question_indices = self._index_text(self.question_text, data_indexer)
-        passage_indices = self._index_text(self.passage_text, data_indexer)
+    def _texts_to_index(self) -> List[str]:
+        return [self.question_text, self.passage_text]
+
+    @overrides
+    def to_indexed_instance(self, data_indexer: DataIndexer, context: IndexingContext=None):
+        question_indices = self._index_text(self.question_text, data_indexer, context)
+        passage_indices = self._index_shared_text(self.passage_text, data_indexer, context)
         label_indices = self._index_label(self.label)
         return IndexedQuestionPassageInstance(question_indices,
                                               passage_indices, label_indices,
@@ -51,6 +58,12 @@ class IndexedQuestionPassageInstance(IndexedInstance):
     """
     This is an indexed instance that is used for (question, passage) pairs.
     """
+    padded_input_fields = [('question_indices', ['num_question_words'], [True]),
+                           ('passage_indices', ['num_passage_words'], [False])]
+    __slots__ = ['_question_indices', '_passage_indices']
+    question_indices = IndicesField('question_indices')
+    passage_indices = IndicesField('passage_indices')
+
     def __init__(self,
                  question_indices: List[int],
                  passage_indices: List[int],
@@ -73,8 +86,8 @@ class IndexedQuestionPassageInstance(IndexedInstance):
         add more arguments should also override this method to enable padding on said
         arguments.
         """
-        question_lengths = self._get_word_sequence_lengths(self.question_indices)
-        passage_lengths = self._get_word_sequence_lengths(self.passage_indices)
+        question_lengths = self._get_word_sequence_lengths(self._question_indices)
+        passage_lengths = self._get_word_sequence_lengths(self._passage_indices)
         lengths = {}
 
         # the number of words to pad the question to
@@ -107,3 +120,7 @@ class IndexedQuestionPassageInstance(IndexedInstance):
         question_array = np.asarray(self.question_indices, dtype='int32')
         passage_array = np.asarray(self.passage_indices, dtype='int32')
         return (question_array, passage_array), np.asarray(self.label)
+
+    @overrides
+    def get_padded_label(self, padding_lengths: Dict[str, int]):
+        return np.asarray(self.label)
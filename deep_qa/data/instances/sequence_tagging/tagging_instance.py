@@ -3,7 +3,7 @@ from typing import Dict, List, Any
 import numpy
 from overrides import overrides
 
-from ..instance import TextInstance, IndexedInstance
+from ..instance import TextInstance, IndexedInstance, IndexingContext, IndicesField
 from ...data_indexer import DataIndexer
 
 
@@ -46,14 +46,22 @@ class TaggingInstance(TextInstance):
         """
         raise NotImplementedError
 
-    def to_indexed_instance(self, data_indexer: DataIndexer):
-        text_indices = self._index_text(self.text, data_indexer)
+    @overrides
+    def _texts_to_index(self) -> List[str]:
+        return [self.text]
+
+    def to_indexed_instance(self, data_indexer: DataIndexer, context: IndexingContext=None):
+        text_indices = self._index_text(self.text, data_indexer, context)
         label_indices = self._index_label(self.label, data_indexer)
         assert len(text_indices) == len(label_indices), "Tokenization is off somehow"
         return IndexedTaggingInstance(text_indices, label_indices, self.index)
 
 
 class IndexedTaggingInstance(IndexedInstance):
+    padded_input_fields = [('text_indices', ['num_sentence_words'], [False])]
+    __slots__ = ['_text_indices']
+    text_indices = IndicesField('text_indices')
+
     def __init__(self, text_indices: List[int], label: List[int], index: int=None):
         super(IndexedTaggingInstance, self).__init__(label, index)
         self.text_indices = text_indices
@@ -65,7 +73,7 @@ class IndexedTaggingInstance(IndexedInstance):
 
     @overrides
     def get_padding_lengths(self) -> Dict[str, int]:
-        return self._get_word_sequence_lengths(self.text_indices)
+        return self._get_word_sequence_lengths(self._text_indices)
 
     @overrides
     def pad(self, padding_lengths: Dict[str, int]):
@@ -81,3 +89,11 @@ class IndexedTaggingInstance(IndexedInstance):
         text_array = numpy.asarray(self.text_indices, dtype='int32')
         label_array = numpy.asarray(self.label, dtype='int32')
         return text_array, label_array
+
+    @overrides
+    def get_padded_label(self, padding_lengths: Dict[str, int]):
+        label = self.pad_sequence_to_length(self.label,
+                                            desired_length=padding_lengths['num_sentence_words'],
+                                            default_value=lambda: self.label[0],
+                                            truncate_from_right=False)
+        return numpy.asarray(label, dtype='int32')
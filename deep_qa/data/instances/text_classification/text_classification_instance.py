@@ -3,7 +3,7 @@ from typing import Dict, List
 import numpy
 from overrides import overrides
 
-from ..instance import TextInstance, IndexedInstance
+from ..instance import TextInstance, IndexedInstance, IndexingContext, IndicesField
 from ...data_indexer import DataIndexer
 
 
@@ -27,8 +27,12 @@ class TextClassificationInstance(TextInstance):
         return self._words_from_text(self.text)
 
     @overrides
-    def to_indexed_instance(self, data_indexer: DataIndexer):
-        indices = self._index_text(self.text, data_indexer)
+    def _texts_to_index(self) -> List[str]:
+        return [self.text]
+
+    @overrides
+    def to_indexed_instance(self, data_indexer: DataIndexer, context: IndexingContext=None):
+        indices = self._index_text(self.text, data_indexer, context)
         return IndexedTextClassificationInstance(indices, self.label, self.index)
 
     @classmethod
@@ -68,6 +72,10 @@ class TextClassificationInstance(TextInstance):
 
 
 class IndexedTextClassificationInstance(IndexedInstance):
+    padded_input_fields = [('word_indices', ['num_sentence_words'], [True])]
+    __slots__ = ['_word_indices']
+    word_indices = IndicesField('word_indices')
+
     def __init__(self, word_indices: List[int], label, index: int=None):
         super(IndexedTextClassificationInstance, self).__init__(label, index)
         self.word_indices = word_indices
@@ -79,7 +87,7 @@ class IndexedTextClassificationInstance(IndexedInstance):
 
     @overrides
     def get_padding_lengths(self) -> Dict[str, int]:
-        return self._get_word_sequence_lengths(self.word_indices)
+        return self._get_word_sequence_lengths(self._word_indices)
 
     @overrides
     def pad(self, padding_lengths: Dict[str, int]):
@@ -88,6 +96,10 @@ class IndexedTextClassificationInstance(IndexedInstance):
     @overrides
     def as_training_data(self):
         word_array = numpy.asarray(self.word_indices, dtype='int32')
+        return word_array, self.get_padded_label(self.get_padding_lengths())
+
+    @overrides
+    def get_padded_label(self, padding_lengths: Dict[str, int]):
         if self.label is True:
             label = numpy.zeros((2))
             label[1] = 1
@@ -96,4 +108,4 @@ class IndexedTextClassificationInstance(IndexedInstance):
             label[0] = 1
         else:
             label = None
-        return word_array, label
+        return label
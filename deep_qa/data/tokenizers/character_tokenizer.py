@@ -1,5 +1,6 @@
 from typing import Callable, Dict, List, Tuple
 from keras.layers import Layer
+import numpy
 from overrides import overrides
 
 from .tokenizer import Tokenizer
@@ -31,9 +32,13 @@ class CharacterTokenizer(Tokenizer):
         super(CharacterTokenizer, self).__init__(params)
 
     @overrides
-    def tokenize(self, text: str) -> List[str]:
+    def _tokenize(self, text: str) -> List[str]:
         return list(text)
 
+    @overrides
+    def _tokenize_with_offsets(self, text: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+        return list(text), [(index, index + 1) for index in range(len(text))]
+
     @overrides
     def get_words_for_indexer(self, text: str) -> Dict[str, List[str]]:
         return {'words': self.tokenize(text)}
@@ -44,6 +49,13 @@ class CharacterTokenizer(Tokenizer):
                    data_indexer: DataIndexer) -> List:
         return [data_indexer.get_word_index(char) for char in self.tokenize(text)]
 
+    @overrides
+    def index_texts(self,
+                    texts: List[str],
+                    data_indexer: DataIndexer) -> Tuple[numpy.array, List[numpy.array]]:
+        offsets = self._get_offsets([len(text) for text in texts])
+        return self._index_characters(''.join(texts), data_indexer, 'words'), [offsets]
+
     @overrides
     def embed_input(self,
                     input_layer: Layer,
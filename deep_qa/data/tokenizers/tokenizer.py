@@ -1,8 +1,15 @@
-from typing import Callable, Dict, List, Tuple
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterable, List, Tuple
+import sys
 
 from keras.layers import Layer
+import numpy
+
 from ..data_indexer import DataIndexer
 from ...common.params import Params
+from ...common.parallel import parallel_imap
+from ...common.util import flatten_ragged
 
 class Tokenizer:
     """
@@ -13,11 +20,21 @@ class Tokenizer:
     handle these things because the tokenization you do could affect the shape of word sequence
     tensors in the model (e.g., a sentence could have shape (num_words,), (num_characters,), or
     (num_words, num_characters)).
+
+    The same text typically gets tokenized several times while preparing a dataset: once to fit
+    the vocabulary, once to index it, and maybe again to convert a character-based label into
+    tokens.  To avoid this, you can tokenize all of the text up front with :func:`pretokenize`;
+    ``tokenize`` then returns the saved tokens until you call :func:`clear_token_cache`.
+    Subclasses implement the actual tokenization in ``_tokenize``.
     """
+    # How many texts ``pretokenize`` tokenizes in one call to ``_tokenize_many_with_offsets``.
+    pretokenize_batch_size = 10000
+
     def __init__(self, params: Params):
         # This class does not take any parameters, but for consistency in the API we take a params
         # dict as an argument.
         params.assert_empty("Tokenizer")
+        self._token_cache = None
 
     def get_custom_objects(self) -> Dict[str, 'Layer']:  # pylint: disable=no-self-use
         """
@@ -28,12 +45,98 @@ class Tokenizer:
 
     def tokenize(self, text: str) -> List[str]:
         """
-        Actually splits the string into a sequence of tokens.  Note that this will only give you
-        top-level tokenization!  If you're using a word-and-character tokenizer, for instance, this
-        will only return the word tokenization.
+        Splits the string into a sequence of tokens.  Note that this will only give you top-level
+        tokenization!  If you're using a word-and-character tokenizer, for instance, this will only
+        return the word tokenization.
+
+        If we're caching tokens (see :func:`pretokenize`), we only call ``_tokenize`` the first
+        time we see a particular text.
+        """
+        if self._token_cache is None or not isinstance(text, str):
+            return self._tokenize(text)
+        # The callers are free to modify the list we return, so it can't be the cached one.
+        return list(self.__get_cached_tokens(text)[0])
+
+    def tokenize_with_offsets(self, text: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """
+        Like :func:`tokenize`, but also returns the ``(start, end)`` character offsets of each
+        token in ``text`` (``end`` is exclusive), or ``None`` for the offsets if this tokenizer
+        can't compute them.
+        """
+        if self._token_cache is None or not isinstance(text, str):
+            return self._tokenize_with_offsets(text)
+        tokens, starts, ends = self.__get_cached_tokens(text)
+        if starts is None:
+            return list(tokens), None
+        return list(tokens), list(zip(starts, ends))
+
+    def _tokenize(self, text: str) -> List[str]:
+        """
+        Actually splits the string into a sequence of tokens; see :func:`tokenize`.
         """
         raise NotImplementedError
 
+    def _tokenize_with_offsets(self, text: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """
+        Actually splits the string into tokens with offsets; see :func:`tokenize_with_offsets`.
+        By default, we don't compute offsets.
+        """
+        return self._tokenize(text), None
+
+    def _tokenize_many_with_offsets(self, texts: List[str]) -> List[Tuple[List[str], List[Tuple[int, int]]]]:
+        """
+        Equivalent to calling ``_tokenize_with_offsets`` on each of the ``texts``.  Subclasses can
+        override this if they can tokenize many texts at once faster than one at a time.
+        """
+        return [self._tokenize_with_offsets(text) for text in texts]
+
+    def pretokenize(self, texts: Iterable[str], num_workers: int=1):
+        """
+        Tokenizes all of the given ``texts``, using ``num_workers`` processes, and saves the
+        tokens, along with their character offsets, so that later calls to :func:`tokenize` or
+        :func:`tokenize_with_offsets` on these texts don't have to do any work.  Each distinct text
+        is only tokenized once, and we intern the tokens, so every occurrence of a word shares one
+        string.  Until you call :func:`clear_token_cache`, we also save the tokens of any other
+        text passed to ``tokenize``.
+        """
+        if self._token_cache is None:
+            self._token_cache = {}
+        texts_to_tokenize = [text for text in dict.fromkeys(texts)
+                             if isinstance(text, str) and text not in self._token_cache]
+        # We hand whole batches of texts to ``_tokenize_many_with_offsets``, so that tokenizers that
+        # are faster on many texts at once can take advantage of that.
+        batches = (texts_to_tokenize[start:start + self.pretokenize_batch_size]
+                   for start in range(0, len(texts_to_tokenize), self.pretokenize_batch_size))
+        tokenized_batches = parallel_imap(self._tokenize_many_with_offsets, batches, num_workers, chunk_size=1)
+        tokenized_texts = (tokenized_text for batch in tokenized_batches for tokenized_text in batch)
+        for text, (tokens, offsets) in zip(texts_to_tokenize, tokenized_texts):
+            self._token_cache[text] = self.__compact_tokens(tokens, offsets)
+
+    def clear_token_cache(self):
+        """
+        Throws away the tokens saved by :func:`pretokenize`, and stops saving tokens.
+        """
+        self._token_cache = None
+
+    def __get_cached_tokens(self, text: str) -> Tuple[Tuple[str, ...], array, array]:
+        cached_tokens = self._token_cache.get(text)
+        if cached_tokens is None:
+            cached_tokens = self.__compact_tokens(*self._tokenize_with_offsets(text))
+            self._token_cache[text] = cached_tokens
+        return cached_tokens
+
+    @staticmethod
+    def __compact_tokens(tokens: List[str],
+                         offsets: List[Tuple[int, int]]) -> Tuple[Tuple[str, ...], array, array]:
+        """
+        Converts tokens and their offsets into the compact form we keep in the token cache: a
+        tuple of interned strings, and two integer arrays with the start and end offsets.
+        """
+        tokens = tuple(sys.intern(token) if isinstance(token, str) else token for token in tokens)
+        if offsets is None:
+            return tokens, None, None
+        return tokens, array('i', (start for start, _ in offsets)), array('i', (end for _, end in offsets))
+
     def get_words_for_indexer(self, text: str) -> Dict[str, List[str]]:
         """
         The DataIndexer needs to assign indices to whatever strings we see in the training data
@@ -56,6 +159,60 @@ class Tokenizer:
         """
         raise NotImplementedError
 
+    def index_texts(self,
+                    texts: List[str],
+                    data_indexer: DataIndexer) -> Tuple[numpy.array, List[numpy.array]]:
+        """
+        Indexes a whole batch of texts at once, which is a lot faster than calling
+        :func:`index_text` on each of them.  Instead of nested lists, this returns the indices as
+        one flat ``int32`` array, plus arrays of offsets, in the format described in
+        :func:`~deep_qa.common.util.flatten_ragged`; ``unflatten_ragged(*index_texts(texts,
+        data_indexer))`` is the same as ``[index_text(text, data_indexer) for text in texts]``.
+
+        The default implementation just calls :func:`index_text` on each text; subclasses override
+        this with something faster.
+        """
+        indexed_texts = [self.index_text(text, data_indexer) for text in texts]
+        depth = 1
+        item = next((indexed_text for indexed_text in indexed_texts if indexed_text), None)
+        while item and isinstance(item[0], list):
+            item = item[0]
+            depth += 1
+        return flatten_ragged(indexed_texts, depth)
+
+    @staticmethod
+    def _index_tokens(tokens: List[str], data_indexer: DataIndexer, namespace: str) -> numpy.array:
+        """
+        Returns the indices of ``tokens`` in ``namespace`` as an ``int32`` array, looking up each
+        unique token in the ``DataIndexer`` only once.
+        """
+        token_indices = {}
+        for token in tokens:
+            if token not in token_indices:
+                token_indices[token] = data_indexer.get_word_index(token, namespace=namespace)
+        return numpy.fromiter(map(token_indices.__getitem__, tokens), dtype=numpy.int32, count=len(tokens))
+
+    @staticmethod
+    def _index_characters(text: str, data_indexer: DataIndexer, namespace: str) -> numpy.array:
+        """
+        Returns the index of every character in ``text`` in ``namespace`` as an ``int32`` array.
+        We get the unicode code points of all of the characters at once from a UTF-32 encoding of
+        the text, look up each unique code point in the ``DataIndexer``, then use that as a table
+        to index all of the characters with a single numpy operation.
+        """
+        code_points = numpy.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+        unique_code_points, positions = numpy.unique(code_points, return_inverse=True)
+        code_point_indices = numpy.asarray([data_indexer.get_word_index(chr(code_point), namespace=namespace)
+                                            for code_point in unique_code_points.tolist()],
+                                           dtype=numpy.int32)
+        return code_point_indices[positions.reshape(-1)]
+
+    @staticmethod
+    def _get_offsets(lengths: List[int]) -> numpy.array:
+        offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        return offsets
+
     def embed_input(self,
                     input_layer: Layer,
                     embed_function: Callable[[Layer, str, str], Layer],
@@ -112,18 +269,45 @@ class Tokenizer:
         """
         Converts a character span from a sentence into the corresponding token span in the
         tokenized version of the sentence.  If you pass in a character span that does not
-        correspond to complete tokens in the tokenized version, we'll do our best, but the behavior
-        is officially undefined.
+        correspond to complete tokens in the tokenized version, we return the span of all of the
+        tokens that overlap it.
 
-        The basic outline of this method is to find the token that starts the same number of
-        characters into the sentence as the given character span.  We try to handle a bit of error
-        in the tokenization by checking `slack` tokens in either direction from that initial
-        estimate.
+        If this tokenizer gives us the character offsets of each token (see
+        :func:`tokenize_with_offsets`), this is exact, and just a binary search over those
+        offsets.  If not, we fall back to estimating the start of the span by adding up token
+        lengths, which is less reliable; see ``_char_span_to_token_span_without_offsets``, which
+        is where ``slack`` is used.
 
         The returned ``(begin, end)`` indices are `inclusive` for ``begin``, and `exclusive` for
         ``end``.  So, for example, ``(2, 2)`` is an empty span, ``(2, 3)`` is the one-word span
         beginning at token index 2, and so on.
         """
+        if self._token_cache is not None and isinstance(sentence, str):
+            tokens, token_starts, token_ends = self.__get_cached_tokens(sentence)
+        else:
+            tokens, token_starts, token_ends = self.__compact_tokens(*self._tokenize_with_offsets(sentence))
+        if token_starts is None:
+            return self._char_span_to_token_span_without_offsets(sentence, span, slack)
+        # The span begins with the first token that ends after the span starts, and ends before
+        # the first token that starts at or after the span ends.
+        begin = bisect_right(token_ends, span[0])
+        end = bisect_left(token_starts, span[1])
+        if end <= begin and begin < len(tokens):
+            # The span didn't overlap any token (e.g., it was just whitespace); we give the token
+            # after it, which is what the span most likely meant.
+            end = begin + 1
+        return (begin, end)
+
+    def _char_span_to_token_span_without_offsets(self,
+                                                 sentence: str,
+                                                 span: Tuple[int, int],
+                                                 slack: int) -> Tuple[int, int]:
+        """
+        The basic outline of this method is to find the token that starts the same number of
+        characters into the sentence as the given character span.  We try to handle a bit of error
+        in the tokenization by checking `slack` tokens in either direction from that initial
+        estimate.
+        """
         # First we'll tokenize the span and the sentence, so we can count tokens and check for
         # matches.
         span_chars = sentence[span[0]:span[1]]
@@ -3,6 +3,7 @@ from typing import Any, Callable, Dict, List, Tuple
 from overrides import overrides
 from keras import backend as K
 from keras.layers import Concatenate, Layer
+import numpy
 
 from .tokenizer import Tokenizer
 from .word_processor import WordProcessor
@@ -36,9 +37,17 @@ class WordAndCharacterTokenizer(Tokenizer):
         super(WordAndCharacterTokenizer, self).__init__(params)
 
     @overrides
-    def tokenize(self, text: str) -> List[str]:
+    def _tokenize(self, text: str) -> List[str]:
         return self.word_processor.get_tokens(text)
 
+    @overrides
+    def _tokenize_with_offsets(self, text: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+        return self.word_processor.get_tokens_with_offsets(text)
+
+    @overrides
+    def _tokenize_many_with_offsets(self, texts: List[str]) -> List[Tuple[List[str], List[Tuple[int, int]]]]:
+        return self.word_processor.get_tokens_with_offsets_bulk(texts)
+
     @overrides
     def get_words_for_indexer(self, text: str) -> Dict[str, List[str]]:
         words = self.tokenize(text)
@@ -57,6 +66,24 @@ class WordAndCharacterTokenizer(Tokenizer):
             arrays.append([word_index] + char_indices)
         return arrays
 
+    @overrides
+    def index_texts(self,
+                    texts: List[str],
+                    data_indexer: DataIndexer) -> Tuple[numpy.array, List[numpy.array]]:
+        tokenized_texts = [self.tokenize(text) for text in texts]
+        words = [word for tokenized_text in tokenized_texts for word in tokenized_text]
+        text_offsets = self._get_offsets([len(tokenized_text) for tokenized_text in tokenized_texts])
+        word_lengths = numpy.fromiter((len(word) for word in words), dtype=numpy.int64, count=len(words))
+        # Each word is represented as its word index followed by the indices of its characters, so
+        # each word takes up one more slot than it has characters.
+        word_offsets = self._get_offsets(word_lengths + 1)
+        values = numpy.zeros(word_offsets[-1], dtype=numpy.int32)
+        is_word_index = numpy.zeros(word_offsets[-1], dtype=numpy.bool_)
+        is_word_index[word_offsets[:-1]] = True
+        values[is_word_index] = self._index_tokens(words, data_indexer, 'words')
+        values[~is_word_index] = self._index_characters(''.join(words), data_indexer, 'characters')
+        return values, [text_offsets, word_offsets]
+
     @overrides
     def embed_input(self,
                     input_layer: Layer,
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Tuple
 
 from .word_splitter import word_splitters
 from .word_stemmer import word_stemmers
@@ -24,11 +24,16 @@ class WordProcessor:
     word_stemmer: str, default="pass_through"
         The name of the ``WordStemmer`` to use (see the options at the bottom of
         ``word_stemmer.py``).
+
+    word_splitter_params: Dict[str, Any], default={}
+        Keyword arguments for the constructor of the ``WordSplitter``, e.g., ``{"batch_size": 500,
+        "num_workers": 4}`` for the ``"spacy"`` splitter.
     """
     def __init__(self, params: Params):
         word_splitter_choice = params.pop_choice('word_splitter', list(word_splitters.keys()),
                                                  default_to_first_choice=True)
-        self.word_splitter = word_splitters[word_splitter_choice]()
+        word_splitter_params = params.pop('word_splitter_params', {})
+        self.word_splitter = word_splitters[word_splitter_choice](**word_splitter_params.as_dict(quiet=True))
         word_filter_choice = params.pop_choice('word_filter', list(word_filters.keys()),
                                                default_to_first_choice=True)
         self.word_filter = word_filters[word_filter_choice]()
@@ -48,3 +53,53 @@ class WordProcessor:
         filtered_words = self.word_filter.filter_words(words)
         stemmed_words = [self.word_stemmer.stem_word(word) for word in filtered_words]
         return stemmed_words
+
+    def get_tokens_with_offsets(self, sentence: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """
+        Like :func:`get_tokens`, but also returns the ``(start, end)`` character offsets of each
+        token in ``sentence``, if the ``WordSplitter`` can compute them.  If it can't, the offsets
+        are ``None``.
+        """
+        try:
+            words, offsets = self.word_splitter.split_words_with_offsets(sentence)
+        except NotImplementedError:
+            return self.get_tokens(sentence), None
+        return self._process_words_with_offsets(words, offsets)
+
+    def get_tokens_bulk(self, sentences: List[str]) -> List[List[str]]:
+        """
+        Equivalent to calling :func:`get_tokens` on each of the ``sentences``, but lets the
+        ``WordSplitter`` split them all in one pass, which is much faster for some splitters.
+        """
+        return [[self.word_stemmer.stem_word(word) for word in self.word_filter.filter_words(words)]
+                for words in self.word_splitter.split_many(sentences)]
+
+    def get_tokens_with_offsets_bulk(self,
+                                     sentences: List[str]) -> List[Tuple[List[str], List[Tuple[int, int]]]]:
+        """
+        Equivalent to calling :func:`get_tokens_with_offsets` on each of the ``sentences``, but
+        lets the ``WordSplitter`` split them all in one pass.
+        """
+        try:
+            split_sentences = self.word_splitter.split_many_with_offsets(sentences)
+        except NotImplementedError:
+            return [(tokens, None) for tokens in self.get_tokens_bulk(sentences)]
+        return [self._process_words_with_offsets(words, offsets) for words, offsets in split_sentences]
+
+    def _process_words_with_offsets(self,
+                                    words: List[str],
+                                    offsets: List[Tuple[int, int]]) -> Tuple[List[str], List[Tuple[int, int]]]:
+        filtered_words = self.word_filter.filter_words(words)
+        if len(filtered_words) != len(words):
+            # Filters keep the remaining words in order, so we can match them up with the original
+            # words to find their offsets.
+            filtered_offsets = []
+            word_index = 0
+            for word in filtered_words:
+                while words[word_index] != word:
+                    word_index += 1
+                filtered_offsets.append(offsets[word_index])
+                word_index += 1
+            offsets = filtered_offsets
+        stemmed_words = [self.word_stemmer.stem_word(word) for word in filtered_words]
+        return stemmed_words, offsets
@@ -1,8 +1,12 @@
 from collections import OrderedDict
-from typing import List
+from typing import Dict, List, Tuple
+import multiprocessing
+import re
 
 from overrides import overrides
 
+from ...common.parallel import parallel_imap
+
 
 class WordSplitter:
     """
@@ -14,6 +18,28 @@ class WordSplitter:
     def split_words(self, sentence: str) -> List[str]:
         raise NotImplementedError
 
+    def split_words_with_offsets(self, sentence: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """
+        Like :func:`split_words`, but also returns the ``(start, end)`` character offsets in
+        ``sentence`` of each word (``end`` is exclusive).  Not all ``WordSplitters`` can do this;
+        the ones that can't raise a ``NotImplementedError``.
+        """
+        raise NotImplementedError
+
+    def split_many(self, sentences: List[str]) -> List[List[str]]:
+        """
+        Splits each of a list of sentences into words.  This is equivalent to calling
+        :func:`split_words` on each sentence, but some ``WordSplitters`` can do it faster in bulk.
+        """
+        return [self.split_words(sentence) for sentence in sentences]
+
+    def split_many_with_offsets(self,
+                                sentences: List[str]) -> List[Tuple[List[str], List[Tuple[int, int]]]]:
+        """
+        Like :func:`split_many`, but calls :func:`split_words_with_offsets` on each sentence.
+        """
+        return [self.split_words_with_offsets(sentence) for sentence in sentences]
+
 
 class SimpleWordSplitter(WordSplitter):
     """
@@ -29,6 +55,13 @@ class SimpleWordSplitter(WordSplitter):
         self.contractions |= set([x.replace("'", "’") for x in self.contractions])
         self.ending_punctuation = set(['"', "'", '.', ',', ';', ')', ']', '}', ':', '!', '?', '%', '”', "’"])
         self.beginning_punctuation = set(['"', "'", '(', '[', '{', '#', '$', '“', "‘"])
+        # This matches the same fields as ``str.split()``.
+        self._field_regex = re.compile(r'\S+')
+        # Every contraction contains an apostrophe, so a field with no apostrophe and no punctuation
+        # at either end can't be split, which is true of most fields.  We check for this first.
+        self._contraction_tuple = tuple(self.contractions)
+        self._apostrophe_regex = re.compile("['’]")
+        self._max_special_case_length = max(len(special_case) for special_case in self.special_cases)
 
     @overrides
     def split_words(self, sentence: str) -> List[str]:
@@ -45,33 +78,97 @@ class SimpleWordSplitter(WordSplitter):
         to after the word itself has been added.  Before stripping off any part of a token, we
         first check to be sure the token isn't in our list of special cases.
         """
-        fields = sentence.lower().split()
         tokens = []
-        for field in fields:  # type: str
-            add_at_end = []
-            while self._can_split(field) and field[0] in self.beginning_punctuation:
-                tokens.append(field[0])
-                field = field[1:]
-            while self._can_split(field) and field[-1] in self.ending_punctuation:
-                add_at_end.insert(0, field[-1])
-                field = field[:-1]
-
-            # There could (rarely) be several contractions in a word, but we check contractions
-            # sequentially, in a random order.  If we've removed one, we need to check again to be
-            # sure there aren't others.
-            remove_contractions = True
-            while remove_contractions:
-                remove_contractions = False
-                for contraction in self.contractions:
-                    if self._can_split(field) and field.endswith(contraction):
-                        field = field[:-len(contraction)]
-                        add_at_end.insert(0, contraction)
-                        remove_contractions = True
-            if field:
-                tokens.append(field)
-            tokens.extend(add_at_end)
+        for field in sentence.lower().split():
+            tokens.extend(self._split_field(field))
         return tokens
 
+    @overrides
+    def split_many(self, sentences: List[str]) -> List[List[str]]:
+        # Most fields show up many times in a batch of sentences, so we only split each distinct
+        # field once.
+        split_fields = {}
+        split_sentences = []
+        for sentence in sentences:
+            tokens = []
+            for field in sentence.lower().split():
+                field_tokens = split_fields.get(field)
+                if field_tokens is None:
+                    field_tokens = self._split_field(field)
+                    split_fields[field] = field_tokens
+                tokens.extend(field_tokens)
+            split_sentences.append(tokens)
+        return split_sentences
+
+    @overrides
+    def split_words_with_offsets(self, sentence: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+        tokens = []
+        offsets = []
+        for match in self._field_regex.finditer(sentence):
+            field_start, field_end = match.span()
+            field_tokens = self._split_field(match.group().lower())
+            tokens.extend(field_tokens)
+            if sum(len(token) for token in field_tokens) == field_end - field_start:
+                # The tokens of a field are just the field cut into pieces, so we can get their
+                # offsets by adding up their lengths.
+                token_start = field_start
+                for token in field_tokens:
+                    offsets.append((token_start, token_start + len(token)))
+                    token_start += len(token)
+            else:
+                # Lower-casing changed the length of the field (which happens with a few unicode
+                # characters), so the best we can do is to give each token the span of the field.
+                offsets.extend((field_start, field_end) for _ in field_tokens)
+        return tokens, offsets
+
+    def _split_field(self, field: str) -> List[str]:
+        """
+        Splits a single lower-cased, whitespace-delimited field into tokens.  The tokens, joined
+        together, always give back the field.
+
+        Instead of repeatedly slicing the field, we move a ``start`` and an ``end`` index inwards
+        as we strip things off, recording where we cut, and only build the token strings at the
+        end.
+        """
+        if (field[0] not in self.beginning_punctuation and
+                    field[-1] not in self.ending_punctuation and
+                    not self._apostrophe_regex.search(field)):
+            return [field]
+        start = 0
+        end = len(field)
+        while self._can_split_span(field, start, end) and field[start] in self.beginning_punctuation:
+            start += 1
+        # ``cuts`` holds the positions we split the end of the field at, from right to left.
+        cuts = [end]
+        while self._can_split_span(field, start, end) and field[end - 1] in self.ending_punctuation:
+            end -= 1
+            cuts.append(end)
+        # Exactly one contraction can match the end of a field at a time (none of them is a suffix
+        # of another), so we just keep removing whichever one matches.
+        while self._can_split_span(field, start, end) and field.endswith(self._contraction_tuple, start, end):
+            for contraction in self._contraction_tuple:
+                if field.endswith(contraction, start, end):
+                    end -= len(contraction)
+                    break
+            cuts.append(end)
+        tokens = list(field[:start])
+        if end > start:
+            tokens.append(field[start:end])
+        for i in range(len(cuts) - 1, 0, -1):
+            tokens.append(field[cuts[i]:cuts[i - 1]])
+        return tokens
+
+    def _can_split_span(self, field: str, start: int, end: int) -> bool:
+        """
+        Equivalent to ``self._can_split(field[start:end])``, without building the substring unless
+        it could be a special case.
+        """
+        if start >= end:
+            return False
+        if end - start > self._max_special_case_length:
+            return True
+        return field[start:end] not in self.special_cases
+
     def _can_split(self, token: str):
         return token and token not in self.special_cases
 
@@ -94,18 +191,76 @@ class NltkWordSplitter(WordSplitter):
         return word_tokenize(sentence.lower())
 
 
+# Building a spaCy tokenizer is slow, so we only do it once per process for each language, no
+# matter how many ``SpacyWordSplitters`` get created.
+_spacy_tokenizers = {}  # type: Dict[str, 'spacy.tokenizer.Tokenizer']  # pylint: disable=invalid-name
+
+
+def _get_spacy_tokenizer(language: str):
+    if language not in _spacy_tokenizers:
+        # Import is here it's slow, and can be unnecessary.
+        import spacy
+        # We only use the tokenizer, whose rules come with the language, so we build a blank
+        # pipeline for it instead of loading a model package, with its vocabulary, vectors and
+        # statistical pipes.
+        _spacy_tokenizers[language] = spacy.blank(language).tokenizer
+    return _spacy_tokenizers[language]
+
+
 class SpacyWordSplitter(WordSplitter):
     """
     A tokenizer that uses spaCy's Tokenizer, which is much faster than the others.
+
+    When splitting many sentences at once (with :func:`split_many`), we stream them through
+    spaCy's ``pipe``, optionally spread over several processes.  These processes are forked from
+    this one, so they share the already-loaded tokenizer.
+
+    Parameters
+    ----------
+    batch_size: int, optional (default=1000)
+        How many sentences ``pipe`` tokenizes at a time.
+    num_workers: int, optional (default=1)
+        How many processes to use in :func:`split_many`.  If we're already running in a worker
+        process (e.g., because a whole dataset is being tokenized in parallel), we ignore this and
+        use just that process.
     """
-    def __init__(self):
-        # Import is here it's slow, and can be unnecessary.
-        import spacy
-        self.en_nlp = spacy.load('en')
+    def __init__(self, batch_size: int=1000, num_workers: int=1):
+        self.tokenizer = _get_spacy_tokenizer('en')
+        self.batch_size = batch_size
+        self.num_workers = num_workers
 
     @overrides
     def split_words(self, sentence: str) -> List[str]:
-        return [str(token.lower_) for token in self.en_nlp.tokenizer(sentence)]
+        return [str(token.lower_) for token in self.tokenizer(sentence)]
+
+    @overrides
+    def split_words_with_offsets(self, sentence: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+        return self._get_words_and_offsets(self.tokenizer(sentence))
+
+    @overrides
+    def split_many(self, sentences: List[str]) -> List[List[str]]:
+        return [words for words, _ in self.split_many_with_offsets(sentences)]
+
+    @overrides
+    def split_many_with_offsets(self,
+                                sentences: List[str]) -> List[Tuple[List[str], List[Tuple[int, int]]]]:
+        num_workers = self.num_workers
+        if multiprocessing.current_process().daemon:
+            # Pool workers can't start pools of their own.
+            num_workers = 1
+        batches = (sentences[start:start + self.batch_size]
+                   for start in range(0, len(sentences), self.batch_size))
+        split_batches = parallel_imap(self._split_batch, batches, num_workers, chunk_size=1)
+        return [split_sentence for batch in split_batches for split_sentence in batch]
+
+    def _split_batch(self, sentences: List[str]) -> List[Tuple[List[str], List[Tuple[int, int]]]]:
+        return [self._get_words_and_offsets(tokens)
+                for tokens in self.tokenizer.pipe(sentences, batch_size=self.batch_size)]
+
+    @staticmethod
+    def _get_words_and_offsets(tokens) -> Tuple[List[str], List[Tuple[int, int]]]:
+        return ([str(token.lower_) for token in tokens],
+                [(token.idx, token.idx + len(token.text)) for token in tokens])
 
 
 class NoOpWordSplitter(WordSplitter):
@@ -2,6 +2,7 @@ from typing import Callable, Dict, List, Tuple
 
 from overrides import overrides
 from keras.layers import Layer
+import numpy
 
 from .tokenizer import Tokenizer
 from .word_processor import WordProcessor
@@ -32,9 +33,17 @@ class WordTokenizer(Tokenizer):
         super(WordTokenizer, self).__init__(params)
 
     @overrides
-    def tokenize(self, text: str) -> List[str]:
+    def _tokenize(self, text: str) -> List[str]:
         return self.word_processor.get_tokens(text)
 
+    @overrides
+    def _tokenize_with_offsets(self, text: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+        return self.word_processor.get_tokens_with_offsets(text)
+
+    @overrides
+    def _tokenize_many_with_offsets(self, texts: List[str]) -> List[Tuple[List[str], List[Tuple[int, int]]]]:
+        return self.word_processor.get_tokens_with_offsets_bulk(texts)
+
     @overrides
     def get_words_for_indexer(self, text: str) -> Dict[str, List[str]]:
         return {'words': self.tokenize(text)}
@@ -43,6 +52,15 @@ class WordTokenizer(Tokenizer):
     def index_text(self, text: str, data_indexer: DataIndexer) -> List:
         return [data_indexer.get_word_index(word, namespace='words') for word in self.tokenize(text)]
 
+    @overrides
+    def index_texts(self,
+                    texts: List[str],
+                    data_indexer: DataIndexer) -> Tuple[numpy.array, List[numpy.array]]:
+        tokenized_texts = [self.tokenize(text) for text in texts]
+        words = [word for tokenized_text in tokenized_texts for word in tokenized_text]
+        offsets = self._get_offsets([len(tokenized_text) for tokenized_text in tokenized_texts])
+        return self._index_tokens(words, data_indexer, 'words'), [offsets]
+
     @overrides
     def embed_input(self,
                     input_layer: Layer,
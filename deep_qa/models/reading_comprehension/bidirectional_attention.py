@@ -1,6 +1,7 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from keras.layers import Dense, Input, Concatenate, TimeDistributed
+import numpy
 from overrides import overrides
 
 from ...data.instances.reading_comprehension import CharacterSpanInstance
@@ -250,30 +251,202 @@ class BidirectionalAttentionFlow(TextTrainer):
 
     @staticmethod
     def get_best_span(span_begin_probs, span_end_probs):
+        """
+        Returns the ``(begin, end)`` span for one instance with the highest ``span_begin_probs[begin]
+        * span_end_probs[end]``, where ``begin < end`` (the only other span we consider is ``(0,
+        0)``).  The inputs must have shape ``(X,)`` or ``(1, X)``; to decode a whole batch of
+        predictions at once, use :func:`get_best_spans`.
+        """
         if len(span_begin_probs.shape) > 2 or len(span_end_probs.shape) > 2:
             raise ValueError("Input shapes must be (X,) or (1,X)")
         if len(span_begin_probs.shape) == 2:
             assert span_begin_probs.shape[0] == 1, "2D input must have an initial dimension of 1"
-            span_begin_probs = span_begin_probs.flatten()
         if len(span_end_probs.shape) == 2:
             assert span_end_probs.shape[0] == 1, "2D input must have an initial dimension of 1"
-            span_end_probs = span_end_probs.flatten()
-        max_span_probability = 0
-        best_word_span = (0, 1)
-        begin_span_argmax = 0
-        for j, _ in enumerate(span_begin_probs):
-            val1 = span_begin_probs[begin_span_argmax]
-            val2 = span_end_probs[j]
-
-            if val1 * val2 > max_span_probability:
-                best_word_span = (begin_span_argmax, j)
-                max_span_probability = val1 * val2
-
-            # We need to update best_span_argmax here _after_ we've checked the current span
-            # position, so that we don't allow things like (1, 1), which are empty spans.  We've
-            # added a special stop symbol to the end of the passage, so this still allows for all
-            # valid spans over the passage.
-            if val1 < span_begin_probs[j]:
-                val1 = span_begin_probs[j]
-                begin_span_argmax = j
-        return (best_word_span[0], best_word_span[1])
+        spans, _ = BidirectionalAttentionFlow.get_best_spans(span_begin_probs.reshape(1, -1),
+                                                             span_end_probs.reshape(1, -1))
+        return (int(spans[0, 0, 0]), int(spans[0, 0, 1]))
+
+    @staticmethod
+    def get_best_spans(span_begin_probs: numpy.array,
+                       span_end_probs: numpy.array,
+                       mask: numpy.array=None,
+                       max_span_length: int=None,
+                       num_spans: int=1) -> Tuple[numpy.array, numpy.array]:
+        """
+        Finds the most probable spans for a whole batch of predictions at once, with numpy, instead
+        of looping over the instances and passage words in python.
+
+        A span ``(begin, end)`` has probability ``span_begin_probs[begin] * span_end_probs[end]``,
+        and must have ``begin < end`` (we've added a stop symbol to the end of the passage, so this
+        still allows for all valid spans over the passage).  The only exception is ``(0, 0)``,
+        which :func:`get_best_span` has always allowed.  If no span has a positive probability, the
+        best span is ``(0, 1)``.  Ties go to the span that ends first, then to the one that begins
+        first, so the best span is exactly the one :func:`get_best_span` finds.
+
+        With no ``max_span_length``, and ``num_spans=1``, this is linear in the passage length:
+        the best begin for each end is the running argmax of ``span_begin_probs``, which we get
+        with ``numpy.maximum.accumulate``.  With a ``max_span_length``, we keep the best span
+        ending at each position as we go through the span lengths.  For more than one span, we
+        score every span up to ``max_span_length`` long, a chunk of instances at a time.
+
+        Parameters
+        ----------
+        span_begin_probs: numpy.array
+            The span begin probabilities from the model, with shape ``(batch_size,
+            num_passage_words)``.
+        span_end_probs: numpy.array
+            The span end probabilities, with the same shape.
+        mask: numpy.array, optional (default=None)
+            If given, this has the same shape as the probabilities, and is zero for padded passage
+            positions, which we won't put in any span.
+        max_span_length: int, optional (default=None)
+            If given, we only consider spans with ``end - begin <= max_span_length``.
+        num_spans: int, optional (default=1)
+            How many spans to return for each instance, most probable first.  If there are fewer
+            possible spans than this, the rest are ``(-1, -1)``, with probability 0.  We find each
+            of these spans with a separate pass over the span probabilities, so this is meant for
+            a handful of spans, not all of them.
+
+        Returns
+        -------
+        spans: numpy.array
+            The ``(begin, end)`` spans, with shape ``(batch_size, num_spans, 2)``.
+        probabilities: numpy.array
+            The probability of each span, with shape ``(batch_size, num_spans)``.
+        """
+        span_begin_probs = numpy.asarray(span_begin_probs)
+        span_end_probs = numpy.asarray(span_end_probs)
+        if span_begin_probs.ndim != 2 or span_begin_probs.shape != span_end_probs.shape:
+            raise ValueError("Span probabilities must both have shape (batch_size, num_passage_words), "
+                             "but got %s and %s" % (span_begin_probs.shape, span_end_probs.shape))
+        if max_span_length is not None and max_span_length < 1:
+            raise ValueError("max_span_length must be at least 1, but got %d" % max_span_length)
+        if num_spans < 1:
+            raise ValueError("num_spans must be at least 1, but got %d" % num_spans)
+        if mask is not None:
+            mask = numpy.asarray(mask).astype(bool)
+            span_begin_probs = numpy.where(mask, span_begin_probs, 0)
+            span_end_probs = numpy.where(mask, span_end_probs, 0)
+        if max_span_length is None and num_spans == 1:
+            spans, probabilities = BidirectionalAttentionFlow.__get_best_unconstrained_spans(span_begin_probs,
+                                                                                            span_end_probs)
+        elif num_spans == 1:
+            spans, probabilities = BidirectionalAttentionFlow.__get_best_short_spans(span_begin_probs,
+                                                                                    span_end_probs,
+                                                                                    mask,
+                                                                                    max_span_length)
+        else:
+            spans, probabilities = BidirectionalAttentionFlow.__get_top_spans(span_begin_probs,
+                                                                             span_end_probs,
+                                                                             mask,
+                                                                             max_span_length,
+                                                                             num_spans)
+        no_positive_span = ~(probabilities[:, 0] > 0)
+        spans[no_positive_span, 0] = (0, 1)
+        probabilities[no_positive_span, 0] = 0
+        return spans, probabilities
+
+    @staticmethod
+    def __get_best_unconstrained_spans(span_begin_probs: numpy.array, span_end_probs: numpy.array):
+        batch_size, num_passage_words = span_begin_probs.shape
+        rows = numpy.arange(batch_size)[:, numpy.newaxis]
+        positions = numpy.arange(num_passage_words)
+        # The running argmax of the begin probabilities, going to the first position with the
+        # maximum if there are ties.  A position is a new maximum if it's strictly greater than
+        # everything before it.
+        running_max = numpy.maximum.accumulate(span_begin_probs, axis=1)
+        is_new_max = numpy.ones(span_begin_probs.shape, dtype=bool)
+        is_new_max[:, 1:] = span_begin_probs[:, 1:] > running_max[:, :-1]
+        running_argmax = numpy.maximum.accumulate(numpy.where(is_new_max, positions, 0), axis=1)
+        # Each end gets the best begin strictly before it, except for the first position, which
+        # can only pair with itself.
+        best_begins = numpy.zeros_like(running_argmax)
+        best_begins[:, 1:] = running_argmax[:, :-1]
+        span_probs = span_begin_probs[rows, best_begins] * span_end_probs
+        best_ends = span_probs.argmax(axis=1)[:, numpy.newaxis]
+        spans = numpy.stack([best_begins[rows, best_ends], best_ends], axis=-1)
+        return spans, span_probs[rows, best_ends].astype('float64')
+
+    @staticmethod
+    def __get_best_short_spans(span_begin_probs: numpy.array,
+                               span_end_probs: numpy.array,
+                               mask: numpy.array,
+                               max_span_length: int):
+        batch_size, num_passage_words = span_begin_probs.shape
+        max_span_length = min(max_span_length, max(num_passage_words - 1, 0))
+        # The best span ending at each position so far.  We go from the longest spans to the
+        # shortest, and only replace a span with a strictly better one, so ties go to the
+        # earliest begin.
+        dtype = numpy.result_type(span_begin_probs, span_end_probs, numpy.float32)
+        best_probs = numpy.full(span_begin_probs.shape, -numpy.inf, dtype=dtype)
+        best_begins = numpy.zeros(span_begin_probs.shape, dtype='int64')
+        for length in range(max_span_length, -1, -1):
+            # (0, 0) is the only empty span we allow.
+            num_ends = num_passage_words - length if length > 0 else 1
+            ends = slice(length, length + num_ends)
+            length_probs = span_begin_probs[:, :num_ends] * span_end_probs[:, ends]
+            if mask is not None:
+                length_probs = numpy.where(mask[:, :num_ends] & mask[:, ends], length_probs, -numpy.inf)
+            is_better = length_probs > best_probs[:, ends]
+            numpy.copyto(best_probs[:, ends], length_probs, where=is_better)
+            numpy.copyto(best_begins[:, ends], numpy.arange(num_ends), where=is_better)
+        rows = numpy.arange(batch_size)[:, numpy.newaxis]
+        best_ends = best_probs.argmax(axis=1)[:, numpy.newaxis]
+        spans = numpy.stack([best_begins[rows, best_ends], best_ends], axis=-1)
+        return spans, numpy.maximum(best_probs[rows, best_ends], 0).astype('float64')
+
+    # How many (instance, span) scores we compute at once in ``__get_top_spans``.
+    _max_span_scores_per_chunk = 2 ** 22
+
+    @staticmethod
+    def __get_top_spans(span_begin_probs: numpy.array,
+                        span_end_probs: numpy.array,
+                        mask: numpy.array,
+                        max_span_length: int,
+                        num_spans: int):
+        batch_size, num_passage_words = span_begin_probs.shape
+        if max_span_length is None or max_span_length >= num_passage_words:
+            max_span_length = max(num_passage_words - 1, 0)
+        # We score the spans in an array of (end, length) pairs, with the lengths going down, so
+        # that when we flatten it, the spans are ordered by end, then by begin, which is the order
+        # we break ties in.  Spans that aren't possible get a score of -inf.
+        lengths = numpy.arange(max_span_length, -1, -1)
+        num_spans_per_instance = num_passage_words * len(lengths)
+        num_spans_to_keep = min(num_spans, num_spans_per_instance)
+        chunk_size = max(BidirectionalAttentionFlow._max_span_scores_per_chunk // num_spans_per_instance, 1)
+        spans = numpy.full((batch_size, num_spans, 2), -1, dtype='int64')
+        probabilities = numpy.zeros((batch_size, num_spans))
+        dtype = numpy.result_type(span_begin_probs, span_end_probs, numpy.float32)
+        for chunk_start in range(0, batch_size, chunk_size):
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            begin_probs = span_begin_probs[chunk]
+            end_probs = span_end_probs[chunk]
+            span_probs = numpy.full((len(begin_probs), num_passage_words, len(lengths)),
+                                    -numpy.inf,
+                                    dtype=dtype)
+            for index, length in enumerate(lengths):
+                # (0, 0) is the only empty span we allow.
+                num_ends = num_passage_words - length if length > 0 else 1
+                length_probs = begin_probs[:, :num_ends] * end_probs[:, length:length + num_ends]
+                if mask is not None:
+                    length_probs = numpy.where(mask[chunk, :num_ends] & mask[chunk, length:length + num_ends],
+                                               length_probs, -numpy.inf)
+                span_probs[:, length:length + num_ends, index] = length_probs
+            span_probs = span_probs.reshape(len(span_probs), -1)
+            rows = numpy.arange(len(span_probs))
+            # We take the best remaining span num_spans times, which is much faster than sorting all
+            # of them when we only want a few, and ``argmax`` gives the first of any tied spans.
+            top_spans = numpy.zeros((len(span_probs), num_spans_to_keep), dtype='int64')
+            top_probs = numpy.zeros((len(span_probs), num_spans_to_keep))
+            for rank in range(num_spans_to_keep):
+                top_spans[:, rank] = span_probs.argmax(axis=1)
+                top_probs[:, rank] = span_probs[rows, top_spans[:, rank]]
+                span_probs[rows, top_spans[:, rank]] = -numpy.inf
+            top_ends = top_spans // len(lengths)
+            top_spans = numpy.stack([top_ends - lengths[top_spans % len(lengths)], top_ends], axis=-1)
+            is_valid = top_probs > -numpy.inf
+            top_spans[~is_valid] = -1
+            spans[chunk, :num_spans_to_keep] = top_spans
+            probabilities[chunk, :num_spans_to_keep] = numpy.where(is_valid, top_probs, 0)
+        return spans, probabilities
@@ -127,6 +127,64 @@ def run_model(param_dict: Dict[str, any], model_class=None):
         raise ConfigurationError("The supplied model does not have enough training inputs.")
 
 
+def calibrate_adaptive_batch_sizes(param_path: str,
+                                   output_param_path: str=None,
+                                   memory_budget_bytes: int=None,
+                                   max_probe_batch_size: int=None,
+                                   model_class=None) -> int:
+    """
+    Measures how much memory the model specified in ``param_path`` needs on this machine, and
+    computes the ``adaptive_memory_usage_constant`` to use for its ``data_generator``, so you don't
+    have to tune it by hand.  See :func:`~deep_qa.training.Trainer.calibrate_adaptive_memory_usage_constant`.
+
+    Parameters
+    ----------
+    param_path: str, required
+        A json parameter file specifying a DeepQA model, as you would give to
+        ``run_model_from_file``.
+    output_param_path: str, optional (default=None)
+        If given, we write the parameters from ``param_path`` to this file as json, with the
+        ``adaptive_memory_usage_constant`` that we found.
+    memory_budget_bytes: int, optional (default=None)
+        How much memory training can use.  By default, this is all of the memory that's available
+        on the machine.
+    max_probe_batch_size: int, optional (default=None)
+        The largest batch size we'll try when measuring memory usage.  By default, this is the
+        ``maximum_batch_size`` of the ``data_generator``.
+    model_class: DeepQaModel, optional (default=None)
+        This option is useful if you have implemented a new model class which
+        is not one of the ones implemented in this library.
+
+    Returns
+    -------
+    adaptive_memory_usage_constant: int
+    """
+    param_dict = pyhocon.ConfigFactory.parse_file(param_path)
+    params = Params(replace_none(param_dict))
+    output_params = deepcopy(params).as_dict(quiet=True)
+    prepare_environment(params)
+
+    from deep_qa.models import concrete_models
+    if model_class is None:
+        model_type = params.pop_choice('model_class', concrete_models.keys())
+        model_class = concrete_models[model_type]
+    else:
+        if params.pop('model_class', None) is not None:
+            raise ConfigurationError("You have specified a local model class and passed a model_class argument"
+                                     "in the json specification. These options are mutually exclusive.")
+    model = model_class(params)
+    constant = model.calibrate_adaptive_memory_usage_constant(memory_budget_bytes=memory_budget_bytes,
+                                                              max_probe_batch_size=max_probe_batch_size)
+    if output_param_path is not None:
+        data_generator_params = output_params.get('data_generator') or {}
+        data_generator_params['adaptive_memory_usage_constant'] = constant
+        output_params['data_generator'] = data_generator_params
+        with open(output_param_path, "w") as param_file:
+            json.dump(output_params, param_file, indent=4)
+        logger.info("Wrote calibrated parameters to %s", output_param_path)
+    return constant
+
+
 def load_model(param_path: str, model_class=None):
     """
     Loads and returns a model.
@@ -181,14 +239,56 @@ def score_dataset(param_path: str, dataset_files: List[str], model_class=None):
     -------
     predictions: numpy.array
         Numpy array of model predictions in the format of model.outputs (typically one array, but
-        could be List[numpy.array] if your model has multiple outputs).
+        could be List[numpy.array] if your model has multiple outputs), with a row for each
+        instance.  If the model scores in batches with ``dynamic_padding``, outputs whose shape
+        depends on the padding (like span probabilities over the passage words) are instead a
+        numpy object array, holding one array per instance, padded to the length of its batch.
+        See :func:`~deep_qa.training.TextTrainer.score_dataset`.
     labels: numpy.array
         The labels on the dataset, as read by the model.  We return this so you can compute
-        whatever metrics you want, if the data was labeled.
+        whatever metrics you want, if the data was labeled.  These can be object arrays too.
     """
     model = load_model(param_path, model_class=model_class)
-    dataset = model.load_dataset_from_files(dataset_files)
-    return model.score_dataset(dataset)
+    _, indexed_dataset = model.load_indexed_dataset(dataset_files)
+    return model.score_dataset(indexed_dataset)
+
+
+def predict(param_path: str,
+            input_file: str,
+            output_file: str,
+            num_processes: int=1,
+            shard_size: int=10000,
+            model_class=None) -> int:
+    """
+    Loads a model and writes its predictions for every instance in ``input_file`` to
+    ``output_file``, as JSON lines.  Unlike ``score_dataset``, this streams through the input a
+    shard at a time, so it works on files that don't fit in memory, can use several processes, and
+    can resume if it crashes.  See :func:`~deep_qa.training.batch_prediction.predict_file`.
+
+    Parameters
+    ----------
+    param_path: str, required
+        A json file specifying a DeepQaModel.
+    input_file: str, required
+        A file with one instance per line, in the same format as the model's ``test_files``.
+    output_file: str, required
+        Where to write the predictions.
+    num_processes: int, optional (default=1)
+        How many processes to score the input with.  These are forked after the model is loaded,
+        so they share its weights.
+    shard_size: int, optional (default=10000)
+        How many lines of the input to read and score at a time.
+    model_class: DeepQaModel, optional (default=None)
+        This option is useful if you have implemented a new model class which
+        is not one of the ones implemented in this library.
+
+    Returns
+    -------
+    The number of predictions written.
+    """
+    model = load_model(param_path, model_class=model_class)
+    from deep_qa.training.batch_prediction import predict_file
+    return predict_file(model, input_file, output_file, num_processes=num_processes, shard_size=shard_size)
 
 
 def evaluate_model(param_path: str, dataset_files: List[str]=None, model_class=None):
@@ -241,7 +341,12 @@ def score_dataset_with_ensemble(param_paths: List[str],
     -------
     predictions: numpy.array
         Numpy array of model predictions in the format of model.outputs (typically one array, but
-        could be List[numpy.array] if your model has multiple outputs).
+        could be List[numpy.array] if your model has multiple outputs).  Outputs that come back
+        from :func:`score_dataset` as object arrays, with one array per instance, are averaged
+        instance by instance, and stay object arrays.  The models might have padded an instance
+        to different lengths, so we pad its arrays with zeros to the longest one before averaging
+        them; that's right for outputs that are masked to zero past the end of the instance, like
+        span probabilities.
     labels: numpy.array
         The labels on the dataset, as read by the first model.  We return this so you can compute
         whatever metrics you want, if the data was labeled.  Note that if your models all represent
@@ -254,23 +359,53 @@ def score_dataset_with_ensemble(param_paths: List[str],
     labels_to_return = None
     for i, model in enumerate(models):
         logger.info("Scoring model %d of %d", i + 1, len(models))
-        dataset = model.load_dataset_from_files(dataset_files)
-        model_predictions, labels = model.score_dataset(dataset)
+        _, indexed_dataset = model.load_indexed_dataset(dataset_files)
+        model_predictions, labels = model.score_dataset(indexed_dataset)
         predictions.append(model_predictions)
         if labels_to_return is None:
             labels_to_return = labels
     logger.info("Averaging model predictions")
-    all_predictions = numpy.stack(predictions)
-    averaged = numpy.mean(all_predictions, axis=0)
-    return averaged, labels_to_return
+    return _average_predictions(predictions), labels_to_return
+
+
+def _average_predictions(model_predictions: List):
+    """
+    Averages the predictions from several models (each an array, or a list of arrays for a model
+    with several outputs) for :func:`score_dataset_with_ensemble`.
+    """
+    if isinstance(model_predictions[0], (list, tuple)):
+        return [_average_predictions(list(outputs)) for outputs in zip(*model_predictions)]
+    model_predictions = [numpy.asarray(predictions) for predictions in model_predictions]
+    if not any(predictions.dtype.hasobject for predictions in model_predictions):
+        return numpy.mean(numpy.stack(model_predictions), axis=0)
+    averaged = numpy.empty(len(model_predictions[0]), dtype=object)
+    for index, rows in enumerate(zip(*model_predictions)):
+        rows = [numpy.asarray(row, dtype='float64') for row in rows]
+        shape = numpy.max([row.shape for row in rows], axis=0)
+        padded_rows = numpy.zeros((len(rows),) + tuple(shape))
+        for padded_row, row in zip(padded_rows, rows):
+            padded_row[tuple(slice(0, length) for length in row.shape)] = row
+        averaged[index] = padded_rows.mean(axis=0)
+    return averaged
 
 
 def compute_accuracy(predictions: numpy.array, labels: numpy.array):
     """
     Computes a simple categorical accuracy metric, useful if you used ``score_dataset`` to get
-    predictions.
+    predictions.  The predictions and labels can also be object arrays, with one array per
+    instance (which ``score_dataset`` gives for outputs whose shape depends on the padding); we
+    take the argmax of each instance's array separately.
     """
-    accuracy = numpy.mean(numpy.equal(numpy.argmax(predictions, axis=-1),
-                                      numpy.argmax(labels, axis=-1)))
+    accuracy = numpy.mean(numpy.equal(_argmax_per_instance(predictions),
+                                      _argmax_per_instance(labels)))
     logger.info("Accuracy: %f", accuracy)
     return accuracy
+
+
+def _argmax_per_instance(array: numpy.array) -> numpy.array:
+    array = numpy.asarray(array)
+    if array.dtype.hasobject:
+        # Comparing (or taking the argmax over) arrays of arrays would silently do the wrong
+        # thing, so we go instance by instance.
+        return numpy.asarray([numpy.argmax(row, axis=-1) for row in array])
+    return numpy.argmax(array, axis=-1)
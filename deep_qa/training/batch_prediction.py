@@ -0,0 +1,191 @@
+"""
+Runs a trained model over an input file that may be too large to hold in memory, writing its
+predictions as JSON lines as it goes.  See :func:`predict_file`.
+"""
+from typing import Any, Dict, List
+import itertools
+import json
+import logging
+import os
+import shutil
+
+import numpy
+
+from ..common.checks import ConfigurationError
+from ..common.parallel import parallel_imap
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def predict_file(model,
+                 input_file: str,
+                 output_file: str,
+                 num_processes: int=1,
+                 shard_size: int=10000) -> int:
+    """
+    Scores every instance in ``input_file`` with ``model``, and writes the predictions to
+    ``output_file`` as JSON lines, in the order of the input.
+
+    We split the input into shards of ``shard_size`` lines.  For each shard, we read and index its
+    instances with ``model.load_dataset_from_lines``, score them with ``model.score_dataset`` (so
+    if the model has a ``data_generator``, they're scored in dynamically padded batches), and
+    write the predictions to a file of their own, in the directory ``[output_file].shards``.  Once
+    every shard is done, we concatenate those files into ``output_file`` and remove the directory.
+    So each process only ever holds one shard's instances and predictions in memory.
+
+    If ``num_processes`` is greater than 1, we fork that many worker processes, each of which
+    takes the next shard when it finishes one.  The model is already loaded when we fork, so the
+    workers share its weights (copy-on-write), instead of each loading a copy.  The workers are
+    daemonic, so they can't start processes of their own: in them, the model reads and indexes
+    instances with ``num_workers=1``, and its ``data_generator`` builds batches with threads.
+
+    If this crashes part of the way through, running it again with the same arguments skips the
+    shards that were already written.  We record the input file's size and modification time, and
+    the ``shard_size``, in the shard directory, and refuse to resume if any of them has changed.
+
+    Each line of ``output_file`` is a JSON object with the ``line`` of ``input_file`` that the
+    instance came from (counting from 0; we skip blank lines), and its ``predictions``, keyed by
+    the name of the model output.
+
+    Parameters
+    ----------
+    model: TextTrainer
+        A trained model, with its weights loaded (see :func:`~deep_qa.run.load_model`).
+    input_file: str
+        A file with one instance per line, in the format of the model's dataset files.
+    output_file: str
+        Where to write the predictions.
+    num_processes: int, optional (default=1)
+        How many processes to score shards in.  With 1, we score them in this process.
+    shard_size: int, optional (default=10000)
+        How many lines of ``input_file`` to read and score at once.  Each shard is one unit of
+        work for a worker, and one unit of progress that's kept if we crash.
+
+    Returns
+    -------
+    num_predictions: int
+        The number of lines written to ``output_file``.
+    """
+    shard_directory = output_file + ".shards"
+    shard_offsets = get_shard_offsets(input_file, shard_size)
+    _prepare_shard_directory(shard_directory, input_file, shard_size)
+    shards_to_predict = [shard for shard in range(len(shard_offsets))
+                         if not os.path.exists(_get_shard_path(shard_directory, shard))]
+    logger.info("Predicting %d of the %d shards of %s; the rest were already done",
+                len(shards_to_predict), len(shard_offsets), input_file)
+    output_names = model.model.output_names
+
+    def predict_shard(shard: int) -> int:
+        with open(input_file, 'rb') as input_stream:
+            input_stream.seek(shard_offsets[shard])
+            lines = [(shard * shard_size + index, line.decode('utf-8').strip())
+                     for index, line in enumerate(itertools.islice(input_stream, shard_size))]
+        lines = [(line_number, line) for line_number, line in lines if line]
+        records = []
+        if lines:
+            dataset = model.load_dataset_from_lines([line for _, line in lines])
+            predictions, _ = model.score_dataset(dataset)
+            records = get_prediction_records([line_number for line_number, _ in lines],
+                                             predictions,
+                                             output_names)
+        shard_path = _get_shard_path(shard_directory, shard)
+        with open(shard_path + ".tmp", "w") as shard_file:
+            for record in records:
+                shard_file.write(json.dumps(record) + "\n")
+        # The shard only counts as done once its file has this name, so a crash while we're
+        # writing it just means it gets predicted again.
+        os.replace(shard_path + ".tmp", shard_path)
+        return len(records)
+
+    def predict_in_worker_process():
+        model.num_workers = 1
+        if getattr(model, 'data_generator', None) is not None:
+            model.data_generator.worker_type = 'thread'
+
+    shard_results = parallel_imap(predict_shard,
+                                  shards_to_predict,
+                                  num_processes,
+                                  chunk_size=1,
+                                  initializer=predict_in_worker_process)
+    for shard, num_shard_predictions in zip(shards_to_predict, shard_results):
+        logger.info("Wrote %d predictions for shard %d of %d",
+                    num_shard_predictions, shard + 1, len(shard_offsets))
+    num_predictions = 0
+    with open(output_file + ".tmp", "w") as output_stream:
+        for shard in range(len(shard_offsets)):
+            with open(_get_shard_path(shard_directory, shard)) as shard_file:
+                for line in shard_file:
+                    output_stream.write(line)
+                    num_predictions += 1
+    os.replace(output_file + ".tmp", output_file)
+    shutil.rmtree(shard_directory)
+    logger.info("Wrote %d predictions to %s", num_predictions, output_file)
+    return num_predictions
+
+
+def get_shard_offsets(filename: str, shard_size: int) -> List[int]:
+    """
+    Returns the byte offsets in ``filename`` at which each shard of ``shard_size`` lines starts, so
+    a worker can seek straight to its shard.  This is one pass over the file, but we don't decode
+    or parse anything, so it's much faster than reading the instances.
+    """
+    offsets = []
+    position = 0
+    with open(filename, 'rb') as input_stream:
+        for line_number, line in enumerate(input_stream):
+            if line_number % shard_size == 0:
+                offsets.append(position)
+            position += len(line)
+    return offsets
+
+
+def get_prediction_records(line_numbers: List[int],
+                           predictions,
+                           output_names: List[str]) -> List[Dict[str, Any]]:
+    """
+    Converts the ``predictions`` from ``score_dataset`` (an array, or a list of arrays if the
+    model has several outputs, with a row for each instance) into one JSON-serializable record per
+    instance, as written by :func:`predict_file`.  Rows of object arrays (for outputs whose shape
+    depends on the padding) are arrays themselves.
+    """
+    if not isinstance(predictions, (list, tuple)):
+        predictions = [predictions]
+    output_rows = []
+    for output in predictions:
+        if output.dtype.hasobject:
+            output_rows.append([numpy.asarray(row).tolist() for row in output])
+        else:
+            output_rows.append(output.tolist())
+    return [{'line': line_number,
+             'predictions': {name: rows[index] for name, rows in zip(output_names, output_rows)}}
+            for index, line_number in enumerate(line_numbers)]
+
+
+def _get_shard_path(shard_directory: str, shard: int) -> str:
+    return os.path.join(shard_directory, "shard_%06d.jsonl" % shard)
+
+
+def _prepare_shard_directory(shard_directory: str, input_file: str, shard_size: int):
+    """
+    Creates ``shard_directory``, or, if it's left over from an earlier run, checks that the shards
+    in it were made from the same input, with the same ``shard_size``, so we can reuse them.
+    """
+    input_stat = os.stat(input_file)
+    manifest = {
+            'input_file': os.path.abspath(input_file),
+            'input_size': input_stat.st_size,
+            'input_mtime': input_stat.st_mtime,
+            'shard_size': shard_size,
+            }
+    manifest_path = os.path.join(shard_directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            previous_manifest = json.load(manifest_file)
+        if previous_manifest != manifest:
+            raise ConfigurationError("The shards in %s are from a different input or shard size (%s), "
+                                     "so we can't resume from them.  Remove that directory to start "
+                                     "over." % (shard_directory, previous_manifest))
+        return
+    os.makedirs(shard_directory, exist_ok=True)
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file)
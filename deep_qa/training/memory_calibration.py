@@ -0,0 +1,129 @@
+"""
+Measures how much memory a model needs per unit of
+:func:`~deep_qa.training.TextTrainer.get_padding_memory_scaling`, so that we can set the
+``adaptive_memory_usage_constant`` for :class:`~deep_qa.data.DataGenerator` automatically, instead
+of tuning it by hand.  See :func:`calibrate_adaptive_memory_usage_constant`.
+"""
+from typing import List, Tuple
+import gc
+import logging
+
+import numpy
+
+from ..common.checks import ConfigurationError
+from ..common.util import format_bytes, get_available_memory_bytes, get_memory_usage_bytes
+from ..common.util import get_peak_memory_usage_bytes, reset_peak_memory_usage
+from ..data import DataGenerator, IndexedDataset
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def calibrate_adaptive_memory_usage_constant(model,
+                                             data_generator: DataGenerator,
+                                             dataset: IndexedDataset,
+                                             memory_budget_bytes: int=None,
+                                             max_probe_batch_size: int=None,
+                                             safety_factor: float=0.9) -> int:
+    """
+    Finds an ``adaptive_memory_usage_constant`` for ``model`` on this machine.  We take the
+    instances in ``dataset`` with the largest ``get_padding_memory_scaling``, and run one training
+    step on batches of 1, 2, 4, ... of them, measuring the peak memory used by this process (its
+    resident set size) while building the batch and training on it.  We fit a line through the
+    peak memory as a function of ``batch size * get_padding_memory_scaling(padding lengths)``, and
+    solve for where that line hits ``memory_budget_bytes``.
+
+    Note that this measures main memory, not GPU memory, so it's only meaningful when you train on
+    the CPU, and it only works on Linux, where we can reset the peak memory usage between probes
+    (otherwise we raise a ``ConfigurationError``).  Also, these are real training steps, so
+    ``model``'s weights get updated; don't save the model afterwards.
+
+    Parameters
+    ----------
+    model: DeepQaModel
+        A compiled model, that takes the arrays from ``data_generator.build_batch``.
+    data_generator: DataGenerator
+        We use this to build batches, and to compute ``get_padding_memory_scaling``.  It should
+        use ``dynamic_padding``, or we'll measure every batch with the same padding.
+    dataset: IndexedDataset
+        The instances to probe with; typically the training data.
+    memory_budget_bytes: int, optional (default=None)
+        How much memory this process can use in total while training.  By default, this is what
+        it uses now, plus what's currently available on the machine.
+    max_probe_batch_size: int, optional (default=None)
+        The largest batch we'll try.  By default, this is the ``maximum_batch_size`` of the
+        ``data_generator``.  We also stop probing once a batch uses half of the memory that's
+        left in the budget.
+    safety_factor: float, optional (default=0.9)
+        We multiply the constant we find by this, to leave a bit of room for memory that we
+        didn't measure.
+
+    Returns
+    -------
+    adaptive_memory_usage_constant: int
+        The largest ``batch size * get_padding_memory_scaling(padding lengths)`` that should fit in
+        the memory budget.
+    """
+    if not reset_peak_memory_usage():
+        raise ConfigurationError("Can't reset the peak memory usage of this process (which needs "
+                                 "/proc/self/clear_refs, so Linux), so we can't measure how much "
+                                 "memory each batch uses.  Set adaptive_memory_usage_constant by hand.")
+    keys, table = dataset.get_padding_length_table()
+    lengths = table.astype('int64')
+    largest_first = numpy.argsort(-data_generator.padding_memory_scaling(keys, lengths), kind='mergesort')
+    if max_probe_batch_size is None:
+        max_probe_batch_size = data_generator.maximum_batch_size
+    max_probe_batch_size = min(max_probe_batch_size, len(largest_first))
+
+    def probe(batch_size: int) -> Tuple[float, int]:
+        batch = largest_first[:batch_size]
+        batch_cost = batch_size * data_generator.padding_memory_scaling(keys, lengths[batch].max(axis=0))
+        gc.collect()
+        memory_before = get_memory_usage_bytes()
+        reset_peak_memory_usage()
+        inputs, labels = data_generator.build_batch(dataset.select(batch.tolist()))
+        model.train_on_batch(inputs, labels)
+        return float(batch_cost), get_peak_memory_usage_bytes() - memory_before
+
+    # The first training step builds the training function and allocates some buffers that we
+    # don't want to count.
+    probe(1)
+    memory_before_probes = get_memory_usage_bytes()
+    if memory_budget_bytes is None:
+        memory_budget_bytes = memory_before_probes + get_available_memory_bytes()
+    logger.info("Calibrating memory usage with a budget of %s, of which %s is in use",
+                format_bytes(memory_budget_bytes), format_bytes(memory_before_probes))
+    batch_costs = []
+    memory_used = []
+    batch_size = 1
+    while batch_size <= max_probe_batch_size:
+        batch_cost, batch_memory = probe(batch_size)
+        logger.info("Batch size %d (memory scaling %d) used %s",
+                    batch_size, batch_cost, format_bytes(batch_memory))
+        batch_costs.append(batch_cost)
+        memory_used.append(batch_memory)
+        if memory_before_probes + 2 * batch_memory > memory_budget_bytes:
+            break
+        batch_size *= 2
+    base_memory, memory_per_unit = fit_memory_usage(batch_costs, memory_used)
+    if memory_per_unit <= 0:
+        raise ConfigurationError("Memory usage didn't grow with the batch size, so we can't calibrate "
+                                 "adaptive batch sizes.  Try a larger max_probe_batch_size.")
+    constant = safety_factor * (memory_budget_bytes - memory_before_probes - base_memory) / memory_per_unit
+    logger.info("Each unit of memory scaling takes %s, with %s of overhead per batch; "
+                "adaptive_memory_usage_constant: %d",
+                format_bytes(memory_per_unit), format_bytes(base_memory), constant)
+    return max(int(constant), 1)
+
+
+def fit_memory_usage(batch_costs: List[float], memory_used: List[int]) -> Tuple[float, float]:
+    """
+    Fits ``memory_used = base_memory + memory_per_unit * batch_cost`` by least squares, returning
+    ``(base_memory, memory_per_unit)``.  With only one distinct ``batch_cost``, we assume there's
+    no ``base_memory``.
+    """
+    batch_costs = numpy.asarray(batch_costs, dtype='float64')
+    memory_used = numpy.asarray(memory_used, dtype='float64')
+    if len(numpy.unique(batch_costs)) < 2:
+        return 0.0, float(numpy.mean(memory_used / batch_costs))
+    memory_per_unit, base_memory = numpy.polyfit(batch_costs, memory_used, 1)
+    return float(base_memory), float(memory_per_unit)
@@ -1,6 +1,8 @@
 from copy import deepcopy
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterable, List, Tuple, Union
+import json
 import logging
+import os
 
 import dill as pickle
 from keras import backend as K
@@ -80,9 +82,27 @@ class TextTrainer(Trainer):
     num_word_characters: int, optional (default=None)
         Upper limit on length of words in the training data. Only applicable for "words and
         characters" text encoding.
+    padding_percentile: float or Dict[str, float], optional (default=None)
+        If given, the padding lengths that we calculate from the training data (the ones you
+        haven't set, like ``num_sentence_words`` above, or ``num_passage_words`` in some models)
+        are this percentile of the instances' lengths, instead of the maximum, so that a few very
+        long instances don't set the size of every padded array.  E.g., with ``0.99``, we truncate
+        the longest 1% of the instances.  You can also give a dictionary from padding keys to
+        percentiles, and we use the maximum for any other keys.  We log how many instances and
+        tokens this truncates, and how many labels get cut off with them (e.g., span answers that
+        are past the truncated end of a passage).  This has no effect on lengths that are padded
+        dynamically by the ``data_generator``.
     tokenizer: Dict[str, Any], optional (default={})
         Which tokenizer to use for ``TextInstances``.  See
         :mod:``deep_qa.data.tokenizers.tokenizer`` for more information.
+    vocabulary: Dict[str, Any], optional (default={})
+        Controls which words from the training data get an index in the ``DataIndexer`` (other
+        words are mapped to the OOV token).  Valid keys are ``min_count`` (default 1), the number
+        of times a word must appear in the training data to be kept, and ``max_vocab_size``
+        (default ``None``, meaning no limit), the number of most frequent words to keep.  Either
+        can be an ``int``, which applies to every namespace, or a dictionary from namespace (e.g.
+        ``"words"`` or ``"characters"``) to ``int``.  See
+        :func:`~deep_qa.data.data_indexer.DataIndexer.fit_word_dictionary`.
     encoder: Dict[str, Dict[str, Any]], optional (default={'default': {}})
         These parameters specify the kind of encoder used to encode any word sequence input.  An
         encoder takes a sequence of vectors and returns a single vector.
@@ -124,8 +144,13 @@ class TextTrainer(Trainer):
         self.dataset_type = concrete_datasets[dataset_type_key]
         self.num_sentence_words = params.pop('num_sentence_words', None)
         self.num_word_characters = params.pop('num_word_characters', None)
+        self.padding_percentile = params.pop('padding_percentile', None)
+        if isinstance(self.padding_percentile, Params):
+            self.padding_percentile = self.padding_percentile.as_dict(quiet=True)
 
         tokenizer_params = params.pop('tokenizer', {})
+        # We keep a copy of the tokenizer configuration, to know when cached datasets are valid.
+        self.tokenizer_config = deepcopy(tokenizer_params.as_dict(quiet=True))
         tokenizer_choice = tokenizer_params.pop_choice('type', list(tokenizers.keys()),
                                                        default_to_first_choice=True)
         self.tokenizer = tokenizers[tokenizer_choice](tokenizer_params)
@@ -135,6 +160,11 @@ class TextTrainer(Trainer):
         # we read here.
         TextInstance.tokenizer = self.tokenizer
 
+        vocabulary_params = params.pop('vocabulary', {})
+        self.vocabulary_min_count = self.__get_vocabulary_setting(vocabulary_params.pop('min_count', 1))
+        self.max_vocab_size = self.__get_vocabulary_setting(vocabulary_params.pop('max_vocab_size', None))
+        vocabulary_params.assert_empty("vocabulary")
+
         self.encoder_params = params.pop('encoder', {'default': {}})
         fallback_choices = ['crash', 'use default encoder', 'use default params']
         self.encoder_fallback_behavior = params.pop_choice('encoder_fallback_behavior', fallback_choices,
@@ -170,11 +200,10 @@ class TextTrainer(Trainer):
         if self.data_generator is not None:
             return self.data_generator.create_generator(dataset, batch_size)
         else:
-            dataset.pad_instances(self.get_padding_lengths())
-            return dataset.as_training_data()
+            return dataset.as_padded_training_data(self.get_padding_lengths())
 
     @overrides
-    def load_dataset_from_files(self, files: List[str]):
+    def load_dataset_from_files(self, files: List[str], max_instances: int=None):
         """
         This method assumes you have a TextDataset that can be read from a single file.  If you
         have something more complicated, you'll need to override this method (though, a solver that
@@ -182,44 +211,88 @@ class TextTrainer(Trainer):
         rest of the list, for instance).
         """
         dataset_params = deepcopy(self.dataset_params)
-        return self.dataset_type.read_from_file(files[0], self._instance_type(), dataset_params)
+        dataset = self.dataset_type.read_from_file(files[0],
+                                                   self._instance_type(),
+                                                   dataset_params,
+                                                   max_instances=max_instances,
+                                                   num_workers=self.num_workers)
+        # We'll tokenize this text to fit the vocabulary, to index it, and maybe to convert labels,
+        # so we do it once here and save the result.
+        dataset.pretokenize(self.num_workers)
+        return dataset
+
+    def load_dataset_from_lines(self, lines: Iterable[str]) -> TextDataset:
+        """
+        Like :func:`load_dataset_from_files`, but reads the instances from ``lines`` (one instance
+        per line, in the format of the dataset files), so you can process part of a file at a
+        time.  See :func:`~deep_qa.training.batch_prediction.predict_file`.
+        """
+        dataset_params = deepcopy(self.dataset_params)
+        dataset = self.dataset_type.read_from_lines(lines,
+                                                    self._instance_type(),
+                                                    dataset_params,
+                                                    num_workers=self.num_workers)
+        dataset.pretokenize(self.num_workers)
+        return dataset
 
     @overrides
-    def score_dataset(self, dataset: TextDataset):
+    def score_dataset(self, dataset: Union[TextDataset, IndexedDataset]):
         """
         See the superclass docs (:func:`Trainer.score_dataset`) for usage info.  Just a note here
-        that we `do not` use data generators for this method, even if you've said elsewhere that
-        you want to use them, so that we can easily return the labels for the data.  This means
-        that we'll do whole-dataset padding, and this could be slow.  We could probably fix this,
-        but it's good enough for now.
+        that if you have a data generator, we score the data in batches with
+        :func:`DataGenerator.score_dataset`, so with ``dynamic_padding``, each batch is only padded
+        as much as it needs to be.  The predictions and labels still come back in the order of the
+        instances in ``dataset``, but outputs whose shape depends on the padding (like span
+        probabilities over the passage words) can't be stacked into one array in the format of
+        ``model.outputs``.  Those come back as a numpy object array instead, with one array per
+        instance, padded to the length of its batch, so code that does arithmetic on whole output
+        arrays needs to handle them instance by instance (as :func:`~deep_qa.run.compute_accuracy`
+        and :func:`~deep_qa.run.score_dataset_with_ensemble` do).  Without a data generator, we pad
+        the whole dataset at once, and this could be slow.
         """
         # TODO(matt): for some reason the reference to the super class docs above isn't getting
         # linked properly.  I'm guessing it's because of an indexing issue in sphinx, but I
         # couldn't figure it out.  Once that works, it can be changed to "See :func:`the superclass
         # docs <Trainer.score_dataset>` for usage info").
-        indexed_dataset = dataset.to_indexed_dataset(self.data_indexer)
-        # Because we're not using data generators here, we need to save and hide
-        # `self.data_generator`.  TODO(matt): it _should_ be as easy as iterating over the data
-        # again to pull out the labels, so we can still use data generators, but I'm waiting on
-        # implementing that.
-        data_generator = self.data_generator
-        self.data_generator = None
+        if isinstance(dataset, IndexedDataset):
+            indexed_dataset = dataset
+        else:
+            indexed_dataset = dataset.to_indexed_dataset(self.data_indexer, num_workers=self.num_workers)
+        if self.data_generator is not None:
+            return self.data_generator.score_dataset(self.model, indexed_dataset)
         inputs, labels = self.create_data_arrays(indexed_dataset)
         predictions = self.model.predict(inputs)
-        self.data_generator = data_generator
         return predictions, labels
 
     @overrides
     def set_model_state_from_dataset(self, dataset: TextDataset):
         logger.info("Fitting data indexer word dictionary.")
-        self.data_indexer.fit_word_dictionary(dataset)
+        self.data_indexer.fit_word_dictionary(dataset,
+                                              min_count=self.vocabulary_min_count,
+                                              max_vocab_size=self.max_vocab_size,
+                                              num_workers=self.num_workers)
 
     @overrides
     def set_model_state_from_indexed_dataset(self, dataset: IndexedDataset):
-        self._set_padding_lengths(dataset.padding_lengths())
+        self._set_padding_lengths(dataset.padding_lengths(self.padding_percentile))
+        truncation = dataset.truncation_statistics(self.get_padding_lengths())
+        if any(truncation.values()):
+            logger.info("Padding lengths %s truncate the training data: %s",
+                        self.get_padding_lengths(), json.dumps(truncation, sort_keys=True))
 
     def _dataset_indexing_kwargs(self) -> Dict[str, Any]:
-        return {'data_indexer': self.data_indexer}
+        return {'data_indexer': self.data_indexer, 'num_workers': self.num_workers}
+
+    @overrides
+    def _dataset_cache_key_data(self) -> Dict[str, Any]:
+        instance_type = self._instance_type()
+        return {
+                'dataset_type': self.dataset_type.__name__,
+                'dataset_params': self.dataset_params.as_dict(quiet=True),
+                'instance_type': instance_type.__module__ + '.' + instance_type.__name__,
+                'tokenizer': self.tokenizer_config,
+                'data_indexer': self.data_indexer.fingerprint(),
+                }
 
     @overrides
     def _set_params_from_model(self):
@@ -228,16 +301,19 @@ class TextTrainer(Trainer):
     @overrides
     def _save_auxiliary_files(self):
         super(TextTrainer, self)._save_auxiliary_files()
-        data_indexer_file = open("%s_data_indexer.pkl" % self.model_prefix, "wb")
-        pickle.dump(self.data_indexer, data_indexer_file)
-        data_indexer_file.close()
+        self.data_indexer.save("%s_data_indexer.bin" % self.model_prefix)
 
     @overrides
     def _load_auxiliary_files(self):
         super(TextTrainer, self)._load_auxiliary_files()
-        data_indexer_file = open("%s_data_indexer.pkl" % self.model_prefix, "rb")
-        self.data_indexer = pickle.load(data_indexer_file)
-        data_indexer_file.close()
+        data_indexer_filename = "%s_data_indexer.bin" % self.model_prefix
+        if os.path.exists(data_indexer_filename):
+            self.data_indexer = DataIndexer.load(data_indexer_filename, memory_map=True)
+        else:
+            # Models saved by older versions of this code pickled the data indexer.
+            data_indexer_file = open("%s_data_indexer.pkl" % self.model_prefix, "rb")
+            self.data_indexer = pickle.load(data_indexer_file)
+            data_indexer_file.close()
 
     @overrides
     def _overall_debug_output(self, output_dict: Dict[str, numpy.array]) -> str:
@@ -668,7 +744,8 @@ class TextTrainer(Trainer):
                         pretrained_file,
                         self.data_indexer,
                         embedding_params.pop('fine_tune', False),
-                        name=name + '_embedding')
+                        name=name + '_embedding',
+                        num_workers=self.num_workers)
 
                 if embedding_params.pop('project', False):
                     # This projection layer is not time distributed, because we handle it later
@@ -729,3 +806,10 @@ class TextTrainer(Trainer):
             result += '%s\t%s\n' % (word, word_vector)
         result += '\n'
         return result
+
+    @staticmethod
+    def __get_vocabulary_setting(setting):
+        # Per-namespace settings come out of the parameter file as Params objects.
+        if isinstance(setting, Params):
+            return setting.as_dict(quiet=True)
+        return setting
@@ -9,9 +9,12 @@ from keras.models import model_from_json
 from ..data.datasets import Dataset, IndexedDataset
 from ..common.checks import ConfigurationError
 from ..common.params import Params
+from ..common.util import format_bytes, get_memory_usage_bytes
+from ..data.dataset_cache import IndexedDatasetCache
 from ..data.instances.instance import Instance
 from ..layers.wrappers import OutputMask
 from .models import DeepQaModel
+from .memory_calibration import calibrate_adaptive_memory_usage_constant
 from .optimizers import optimizer_from_params
 from .multi_gpu import compile_parallel_model
 
@@ -50,13 +53,16 @@ class Trainer:
         The files containing the data that should be used for evaluation.  The default of None
         means to just not perform test set evaluation.
     max_training_instances: int, optional (default=None)
-        Upper limit on the number of training instances.  If this is set, and we get more than
-        this, we will truncate the data.  Mostly useful for testing things out on small datasets
-        before running them on large datasets.
+        Upper limit on the number of training instances.  If this is set, we stop reading the
+        training data once we have this many instances.  Mostly useful for testing things out on
+        small datasets before running them on large datasets.
     max_validation_instances: int, optional (default=None)
         Upper limit on the number of validation instances, analogous to ``max_training_instances``.
     max_test_instances: int, optional (default=None)
         Upper limit on the number of test instances, analogous to ``max_training_instances``.
+    num_workers: int, optional (default=1)
+        How many processes to use when reading and indexing data.  Processing the data in parallel
+        gives exactly the same result as processing it serially, just faster on large datasets.
     train_steps_per_epoch: int, optional (default=None)
         If :func:`~Trainer.create_data_arrays` returns a generator instead of actual arrays, how
         many steps should we run from this generator before declaring an "epoch" finished?  The
@@ -131,6 +137,23 @@ class Trainer:
     show_summary_with_masking_info: bool, optional (default=False)
         This is a debugging setting, mostly - we have written a custom model.summary() method that
         supports showing masking info, to help understand what's going on with the masks.
+    dataset_cache: Dict[str, Any], optional (default=None)
+        If given, we cache indexed datasets on disk, so that loading the same validation or test
+        data again (e.g., when evaluating a saved model) skips reading, tokenizing and indexing.
+        This dict must have a "directory" key, and can have a "max_size_mb" key; see
+        :class:`~deep_qa.data.dataset_cache.IndexedDatasetCache`.  Cached entries are keyed on the
+        contents of the data files and on everything that affects indexing (see
+        :func:`~Trainer._dataset_cache_key_data`), so you never get stale data.  We use the cache
+        for everything loaded with :func:`load_indexed_dataset`: validation, test and evaluation
+        data, the data scored by :func:`~deep_qa.run.score_dataset`, and the training data when
+        we're not fitting the model state (e.g., the vocabulary) on it, as that state is only known
+        after reading the data.
+    lean_data_loading: bool, optional (default=False)
+        If ``True``, we drop the raw (un-indexed) datasets as soon as they have been indexed,
+        instead of keeping them around in ``self.training_dataset`` and
+        ``self.validation_dataset``, and we log the memory used by the process after each stage of
+        data loading.  This can substantially reduce peak memory usage on large datasets.  The
+        exception is a dataset that's needed for the ``debug`` output, which we always keep.
     """
     def __init__(self, params: Params):
         self.name = "Trainer"
@@ -142,6 +165,7 @@ class Trainer:
         self.max_training_instances = params.pop('max_training_instances', None)
         self.max_validation_instances = params.pop('max_validation_instances', None)
         self.max_test_instances = params.pop('max_test_instances', None)
+        self.num_workers = params.pop('num_workers', 1)
 
         # Data generator parameters.
         self.train_steps_per_epoch = params.pop('train_steps_per_epoch', None)
@@ -179,6 +203,12 @@ class Trainer:
         self.tensorboard_frequency = params.pop('tensorboard_frequency', 0)
         self.debug_params = params.pop('debug', {})
         self.show_summary_with_masking = params.pop('show_summary_with_masking_info', False)
+        self.lean_data_loading = params.pop('lean_data_loading', False)
+        dataset_cache_params = params.pop('dataset_cache', None)
+        if dataset_cache_params is not None:
+            self.dataset_cache = IndexedDatasetCache(dataset_cache_params)
+        else:
+            self.dataset_cache = None
 
         # We've now processed all of the parameters, and we're the base class, so there should not
         # be anything left.
@@ -221,7 +251,8 @@ class Trainer:
     def load_data_arrays(self,
                          data_files: List[str],
                          batch_size: int=None,
-                         max_instances: int=None) -> Tuple[Dataset, numpy.array, numpy.array]:
+                         max_instances: int=None,
+                         use_cache: bool=True) -> Tuple[Dataset, numpy.array, numpy.array]:
         """
         Loads a :class:`Dataset` from a list of files, then converts it into numpy arrays for
         both inputs and outputs, returning all three of these to you.  This literally just calls
@@ -245,11 +276,15 @@ class Trainer:
         max_instances: int, optional (default=None)
             If not ``None``, we will restrict the dataset to only this many instances.  This is
             mostly useful for testing models out on subsets of your data.
+        use_cache: bool, optional (default=True)
+            If we were given ``dataset_cache`` parameters, should we use the cache here?  You should
+            pass ``False`` if you need the returned ``dataset``.
 
         Returns
         -------
         dataset: Dataset
-            A :class:`Dataset` object containing the instances read from the data files
+            A :class:`Dataset` object containing the instances read from the data files.  This is
+            ``None`` if we loaded the indexed data from the ``dataset_cache``.
         input_arrays: numpy.array
             An array or tuple of arrays suitable to be passed as inputs ``x`` to Keras'
             ``model.fit(x, y)``, ``model.evaluate(x, y)`` or ``model.predict(x)`` methods
@@ -259,18 +294,47 @@ class Trainer:
         """
         if batch_size is None:
             batch_size = self.batch_size
-
-        logger.info("Loading data from %s", str(data_files))
-        dataset = self.load_dataset_from_files(data_files)
-        if max_instances is not None:
-            logger.info("Truncating the dataset to %d instances", max_instances)
-            dataset = dataset.truncate(max_instances)
-        logger.info("Indexing dataset")
-        indexing_kwargs = self._dataset_indexing_kwargs()
-        indexed_dataset = dataset.to_indexed_dataset(**indexing_kwargs)
+        dataset, indexed_dataset = self.load_indexed_dataset(data_files, max_instances, use_cache)
         data_arrays = self.create_data_arrays(indexed_dataset, batch_size)
+        self.__log_memory_usage("creating data arrays for %s" % str(data_files))
         return (dataset, data_arrays)
 
+    def load_indexed_dataset(self,
+                             data_files: List[str],
+                             max_instances: int=None,
+                             use_cache: bool=True) -> Tuple[Dataset, IndexedDataset]:
+        """
+        Loads a :class:`Dataset` from a list of files and indexes it, returning both.  If we were
+        given ``dataset_cache`` parameters and ``use_cache`` is ``True``, we load the indexed
+        dataset from the cache if it's there (and then the raw ``dataset`` we return is ``None``),
+        and save it there if it isn't.  See :func:`load_data_arrays` for the parameters.
+        """
+        cache_key = None
+        indexed_dataset = None
+        dataset = None
+        key_data = self._dataset_cache_key_data() if use_cache and self.dataset_cache else None
+        if key_data is not None:
+            cache_key = IndexedDatasetCache.compute_key(data_files, max_instances=max_instances, **key_data)
+            indexed_dataset = self.dataset_cache.load(cache_key, IndexedDatasetCache.compute_key([], **key_data))
+        if indexed_dataset is None:
+            logger.info("Loading data from %s", str(data_files))
+            dataset = self.load_dataset_from_files(data_files, max_instances)
+            if max_instances is not None:
+                # Subclasses should already stop reading at `max_instances`; this is just in case
+                # they don't.
+                dataset = dataset.truncate(max_instances)
+            self.__log_memory_usage("reading %s" % str(data_files))
+            logger.info("Indexing dataset")
+            indexing_kwargs = self._dataset_indexing_kwargs()
+            indexed_dataset = dataset.to_indexed_dataset(**indexing_kwargs)
+            if cache_key is not None:
+                # Indexing might have changed the model state (e.g., by adding words to a
+                # vocabulary), so we recompute it here.
+                state_fingerprint = IndexedDatasetCache.compute_key([], **self._dataset_cache_key_data())
+                self.dataset_cache.save(cache_key, indexed_dataset, state_fingerprint)
+        self.__log_memory_usage("indexing %s" % str(data_files))
+        return dataset, indexed_dataset
+
     def train(self):
         '''
         Trains the model.
@@ -283,27 +347,28 @@ class Trainer:
         # First we need to prepare the data that we'll use for training.  For the training data, we
         # might need to update model state based on this dataset, so we handle it differently than
         # we do the validation and training data.
-        self.training_dataset = self.load_dataset_from_files(self.train_files)
-        if self.max_training_instances:
-            self.training_dataset = self.training_dataset.truncate(self.max_training_instances)
-        if self.update_model_state_with_training_data:
-            self.set_model_state_from_dataset(self.training_dataset)
-        logger.info("Indexing training data")
-        indexing_kwargs = self._dataset_indexing_kwargs()
-        indexed_training_dataset = self.training_dataset.to_indexed_dataset(**indexing_kwargs)
-        if self.update_model_state_with_training_data:
-            self.set_model_state_from_indexed_dataset(indexed_training_dataset)
+        indexed_training_dataset = self.__load_indexed_training_dataset()
         self.training_arrays = self.create_data_arrays(indexed_training_dataset, self.batch_size)
+        indexed_training_dataset = None
+        self.__log_memory_usage("creating training data arrays")
         if self._uses_data_generators():
             self.train_steps_per_epoch = self.data_generator.last_num_batches  # pylint: disable=no-member
+            self.training_arrays.name = "training"
 
         if self.validation_files:
-            batch_size_for_validation = self.batch_size / self.num_gpus if self.num_gpus > 1 else None
+            batch_size_for_validation = self.batch_size // self.num_gpus if self.num_gpus > 1 else None
+            # The debug output needs the validation dataset, which we don't get from the cache.
+            use_cache = self.debug_params.get('data') != "validation"
             self.validation_dataset, self.validation_arrays = self.load_data_arrays(self.validation_files,
+                                                                                    batch_size_for_validation,
                                                                                     self.max_validation_instances,
-                                                                                    batch_size_for_validation)
+                                                                                    use_cache=use_cache)
+            if self.lean_data_loading and self.debug_params.get('data') != "validation":
+                self.validation_dataset = None
         if self._uses_data_generators():
             self.validation_steps = self.data_generator.last_num_batches  # pylint: disable=no-member
+            if self.validation_arrays is not None:
+                self.validation_arrays.name = "validation"
 
         # Then we build the model and compile it.
         logger.info("Building the model")
@@ -338,7 +403,7 @@ class Trainer:
             else:
                 # If the `data` param is not "training" or "validation", we assume it's a list of
                 # file names.
-                self.debug_dataset, self.debug_arrays = self.load_data_arrays(debug_data)
+                self.debug_dataset, self.debug_arrays = self.load_data_arrays(debug_data, use_cache=False)
             self.debug_model = self.__build_debug_model(debug_layer_names, debug_masks)
 
         # Now we actually train the model using various Keras callbacks to control training.
@@ -378,6 +443,30 @@ class Trainer:
         if self.test_files:
             self.evaluate_model(self.test_files, self.max_test_instances)
 
+    def calibrate_adaptive_memory_usage_constant(self,
+                                                 memory_budget_bytes: int=None,
+                                                 max_probe_batch_size: int=None) -> int:
+        """
+        Loads the training data and builds the model, the same way as ``train()`` does, then
+        measures how much memory training steps take on the biggest training instances, and
+        returns a value for the ``adaptive_memory_usage_constant`` parameter of the
+        ``DataGenerator`` that should fit in ``memory_budget_bytes``.  See
+        :func:`~deep_qa.training.memory_calibration.calibrate_adaptive_memory_usage_constant`.
+        Your model needs to use data generators for this to work.
+        """
+        if not self._uses_data_generators():
+            raise ConfigurationError("Calibrating adaptive batch sizes requires a model that uses "
+                                     "data generators.")
+        indexed_training_dataset = self.__load_indexed_training_dataset()
+        logger.info("Building the model")
+        self.model = self._build_model()
+        self.model.compile(self.__compile_kwargs())
+        return calibrate_adaptive_memory_usage_constant(self.model,
+                                                        self.data_generator,  # pylint: disable=no-member
+                                                        indexed_training_dataset,
+                                                        memory_budget_bytes=memory_budget_bytes,
+                                                        max_probe_batch_size=max_probe_batch_size)
+
     def load_model(self, epoch: int=None):
         """
         Loads a serialized model, using the ``model_serialization_prefix`` that was passed to the
@@ -407,13 +496,16 @@ class Trainer:
         # We call self.load_model() first, to be sure that we load the best model we have, if we've
         # trained for a while.
         self.load_model()
-        _, arrays = self.load_data_arrays(data_files, max_instances)
-        logger.info("Evaluting model on the test set.")
         if not self._uses_data_generators():
+            _, arrays = self.load_data_arrays(data_files, max_instances=max_instances)
+            logger.info("Evaluting model on the test set.")
             scores = self.model.evaluate(arrays[0], arrays[1])
         else:
-            steps = self.data_generator.last_num_batches  # pylint: disable=no-member
-            scores = self.model.evaluate_generator(arrays, steps)
+            # We evaluate in the same sorted batches that we score in, instead of the noisy,
+            # shuffled batches that we train on.
+            _, indexed_dataset = self.load_indexed_dataset(data_files, max_instances=max_instances)
+            logger.info("Evaluting model on the test set.")
+            scores = self.data_generator.evaluate_dataset(self.model, indexed_dataset)  # pylint: disable=no-member
         for idx, metric in enumerate(self.model.metrics_names):
             print("{}: {}".format(metric, scores[idx]))
 
@@ -432,7 +524,9 @@ class Trainer:
         Parameters
         ----------
         dataset: Dataset
-            A ``Dataset`` read by `:func:`~Trainer.load_dataset_from_files()`.
+            A ``Dataset`` read by `:func:`~Trainer.load_dataset_from_files()`, or an
+            ``IndexedDataset`` from :func:`~Trainer.load_indexed_dataset()`, which we don't need to
+            index again.
 
         Returns
         -------
@@ -448,11 +542,13 @@ class Trainer:
         """
         raise NotImplementedError
 
-    def load_dataset_from_files(self, files: List[str]) -> Dataset:
+    def load_dataset_from_files(self, files: List[str], max_instances: int=None) -> Dataset:
         """
         Given a list of file inputs, load a raw dataset from the files.  This is a list because
         some datasets are specified in more than one file (e.g., a file containing the instances,
-        and a file containing background information about those instances).
+        and a file containing background information about those instances).  If
+        ``max_instances`` is given, implementations should stop reading once they have that many
+        instances, instead of reading everything and truncating afterwards.
         """
         raise NotImplementedError
 
@@ -535,6 +631,16 @@ class Trainer:
     # Protected methods - you CAN override these, if you want
     ###################
 
+    def _dataset_cache_key_data(self) -> Dict[str, Any]:
+        """
+        If you're using a ``dataset_cache``, this returns everything (other than the contents of
+        the data files) that determines what an indexed dataset looks like, like your vocabulary
+        and how you tokenize text.  This gets hashed into the key for the cache, so it must be
+        JSON-serializable, and should be small (use a hash of your vocabulary, not the vocabulary
+        itself).  The default of ``None`` means that we can't cache datasets for this model.
+        """
+        return None
+
     def _get_callbacks(self):
         """
          Returns a set of Callbacks which are used to perform various functions within Keras' .fit method.
@@ -661,6 +767,42 @@ class Trainer:
     # consider making them protected instead.
     #################
 
+    def __load_indexed_training_dataset(self) -> IndexedDataset:
+        """
+        Reads and indexes ``self.train_files``, updating the model state (e.g., the vocabulary)
+        from the training data if we're supposed to.  If we aren't (e.g., we're training a loaded
+        model some more), the indexed training data can come from the ``dataset_cache``.
+        """
+        if not self.update_model_state_with_training_data:
+            use_cache = self.debug_params.get('data') != "training"
+            self.training_dataset, indexed_training_dataset = self.load_indexed_dataset(
+                    self.train_files, self.max_training_instances, use_cache)
+            if self.lean_data_loading and self.debug_params.get('data') != "training":
+                self.training_dataset = None
+            return indexed_training_dataset
+        self.training_dataset = self.load_dataset_from_files(self.train_files,
+                                                             self.max_training_instances)
+        if self.max_training_instances:
+            self.training_dataset = self.training_dataset.truncate(self.max_training_instances)
+        self.__log_memory_usage("reading training data")
+        self.set_model_state_from_dataset(self.training_dataset)
+        logger.info("Indexing training data")
+        indexing_kwargs = self._dataset_indexing_kwargs()
+        indexed_training_dataset = self.training_dataset.to_indexed_dataset(**indexing_kwargs)
+        if self.lean_data_loading and self.debug_params.get('data') != "training":
+            self.training_dataset = None
+        self.__log_memory_usage("indexing training data")
+        self.set_model_state_from_indexed_dataset(indexed_training_dataset)
+        return indexed_training_dataset
+
+    def __log_memory_usage(self, stage: str):
+        """
+        In ``lean_data_loading`` mode, logs the memory held by this process after ``stage`` of data
+        loading.
+        """
+        if self.lean_data_loading:
+            logger.info("Memory usage after %s: %s", stage, format_bytes(get_memory_usage_bytes()))
+
     def __save_best_model(self):
         """
         Copies the weights from the best epoch to a final weight file.
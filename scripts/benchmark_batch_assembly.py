@@ -0,0 +1,100 @@
+"""
+Measures how long it takes to turn a batch of ``IndexedInstances`` into padded numpy arrays, and
+how much memory that allocates, comparing the old way (``IndexedDataset.pad_instances`` followed
+by ``as_training_data``) with ``IndexedDataset.as_padded_training_data``.  We use randomly
+generated instances with a word layout (``IndexedTextClassificationInstance``), a word and
+character layout (``IndexedCharacterSpanInstance``), and a multiple-choice layout
+(``IndexedMcQuestionPassageInstance``).
+"""
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from copy import deepcopy
+
+# pylint: disable=wrong-import-position
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from deep_qa.data.datasets import IndexedDataset
+from deep_qa.data.instances.reading_comprehension.character_span_instance import IndexedCharacterSpanInstance
+from deep_qa.data.instances.reading_comprehension.mc_question_passage_instance import \
+        IndexedMcQuestionPassageInstance
+from deep_qa.data.instances.text_classification.text_classification_instance import \
+        IndexedTextClassificationInstance
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def random_words(max_words: int, with_characters: bool):
+    words = [random.randint(2, 50000) for _ in range(random.randint(1, max_words))]
+    if with_characters:
+        return [[word] + [random.randint(2, 100) for _ in range(random.randint(1, 12))] for word in words]
+    return words
+
+
+def random_instances(layout: str, batch_size: int):
+    if layout == 'words':
+        return [IndexedTextClassificationInstance(random_words(50, False), True) for _ in range(batch_size)]
+    if layout == 'words and characters':
+        instances = []
+        for _ in range(batch_size):
+            passage = random_words(300, True)
+            instances.append(IndexedCharacterSpanInstance(random_words(20, True), passage, [0, len(passage) - 1]))
+        return instances
+    return [IndexedMcQuestionPassageInstance(random_words(20, False),
+                                             random_words(300, False),
+                                             [random_words(10, False) for _ in range(random.randint(2, 5))],
+                                             0)
+            for _ in range(batch_size)]
+
+
+def measure(function, batches):
+    """
+    Returns the average time per batch, and the average number of bytes allocated per batch (the
+    peak traced memory while building the batch).
+    """
+    total_time = 0.0
+    total_bytes = 0
+    for batch in batches:
+        start_time = time.time()
+        function(batch)
+        total_time += time.time() - start_time
+    for batch in batches:
+        tracemalloc.start()
+        function(batch)
+        total_bytes += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return total_time / len(batches), total_bytes / len(batches)
+
+
+def pad_then_convert(instances):
+    dataset = IndexedDataset(instances)
+    dataset.pad_instances(verbose=False)
+    return dataset.as_training_data()
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark assembling padded batches.")
+    parser.add_argument('--batch_size', type=int, default=32, help="Instances per batch (default 32).")
+    parser.add_argument('--num_batches', type=int, default=50, help="How many batches to time (default 50).")
+    arguments = parser.parse_args()
+    random.seed(0)
+    for layout in ['words', 'words and characters', 'multiple choice']:
+        batches = [random_instances(layout, arguments.batch_size) for _ in range(arguments.num_batches)]
+        # Padding instances modifies them, so each run of the old way gets its own copy.
+        old_time, old_bytes = measure(pad_then_convert, [deepcopy(batch) for batch in batches])
+        old_time_again, _ = measure(pad_then_convert, [deepcopy(batch) for batch in batches])
+        old_time = min(old_time, old_time_again)
+        new_time, new_bytes = measure(lambda instances: IndexedDataset(instances).as_padded_training_data(
+                verbose=False), batches)
+        print("%-22s pad + as_training_data: %8.2f ms, %8.1f KB   as_padded_training_data: %8.2f ms, %8.1f KB"
+              "   (%.1fx faster)" % (layout, old_time * 1000, old_bytes / 1024, new_time * 1000,
+                                     new_bytes / 1024, old_time / new_time))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                        level=logging.WARNING)
+    main()
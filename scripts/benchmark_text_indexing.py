@@ -0,0 +1,69 @@
+"""
+Measures how fast each ``Tokenizer`` indexes text, in tokens per second, both one text at a time
+with ``index_text`` and in a batch with ``index_texts``.  By default this uses randomly generated
+text; pass a file with one text per line (e.g., the passages from a dataset) to use real data.
+Both timings include tokenization, which is the same in both cases, so the difference between
+them is the cost of looking up the indices.
+"""
+import logging
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+
+# pylint: disable=wrong-import-position
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from deep_qa.common.params import Params
+from deep_qa.data.data_indexer import DataIndexer
+from deep_qa.data.datasets import TextDataset
+from deep_qa.data.instances.instance import TextInstance
+from deep_qa.data.instances.text_classification.text_classification_instance import TextClassificationInstance
+from deep_qa.data.tokenizers import tokenizers
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def random_texts(num_texts: int, words_per_text: int):
+    random.seed(0)
+    vocabulary = ["".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(random.randint(1, 10)))
+                  for _ in range(20000)]
+    return [" ".join(random.choice(vocabulary) for _ in range(words_per_text)) for _ in range(num_texts)]
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark index_text against index_texts.")
+    parser.add_argument('text_file', type=str, nargs='?', default=None,
+                        help="A file with one text per line.  Defaults to random text.")
+    parser.add_argument('--num_texts', type=int, default=5000,
+                        help="How many texts to index (default 5000).")
+    arguments = parser.parse_args()
+    if arguments.text_file:
+        with open(arguments.text_file) as text_file:
+            texts = [line.rstrip('\n') for line, _ in zip(text_file, range(arguments.num_texts))]
+    else:
+        texts = random_texts(arguments.num_texts, 100)
+    for tokenizer_name in ['words', 'characters', 'words and characters']:
+        tokenizer = tokenizers[tokenizer_name](Params({}))
+        TextInstance.tokenizer = tokenizer
+        data_indexer = DataIndexer()
+        data_indexer.fit_word_dictionary(TextDataset([TextClassificationInstance(text, None)
+                                                      for text in texts]))
+        num_tokens = sum(len(tokenizer.tokenize(text)) for text in texts)
+
+        start_time = time.time()
+        for text in texts:
+            tokenizer.index_text(text, data_indexer)
+        one_at_a_time = num_tokens / (time.time() - start_time)
+
+        start_time = time.time()
+        tokenizer.index_texts(texts, data_indexer)
+        batched = num_tokens / (time.time() - start_time)
+        print("%-22s index_text: %10.0f tokens/s   index_texts: %10.0f tokens/s   (%.1fx)" %
+              (tokenizer_name, one_at_a_time, batched, batched / one_at_a_time))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                        level=logging.WARNING)
+    main()
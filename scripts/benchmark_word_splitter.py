@@ -0,0 +1,70 @@
+"""
+Measures how fast ``SimpleWordSplitter`` splits text, in sentences per second, compared with the
+original implementation it replaced (``ReferenceSimpleWordSplitter``), and checks that the two
+give the same tokens.  By default this uses randomly generated text with plenty of punctuation
+and contractions; pass a file with one sentence per line to use real data.
+"""
+import logging
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+
+# pylint: disable=wrong-import-position
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from deep_qa.data.tokenizers.word_splitter import SimpleWordSplitter
+from tests.data.tokenizers.reference_word_splitter import ReferenceSimpleWordSplitter
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def random_sentences(num_sentences: int, words_per_sentence: int):
+    random.seed(0)
+    words = ["".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(random.randint(1, 10)))
+             for _ in range(20000)]
+    words += ["(the", "end.", "it's", "don't", "\"quoted\"", "mr.", "e.g.,", "100%", "would've"] * 500
+    return [" ".join(random.choice(words) for _ in range(words_per_sentence))
+            for _ in range(num_sentences)]
+
+
+def time_splitter(function, sentences):
+    start_time = time.time()
+    result = function(sentences)
+    return result, len(sentences) / (time.time() - start_time)
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark SimpleWordSplitter against the reference implementation.")
+    parser.add_argument('text_file', type=str, nargs='?', default=None,
+                        help="A file with one sentence per line.  Defaults to random text.")
+    parser.add_argument('--num_sentences', type=int, default=20000,
+                        help="How many sentences to split (default 20000).")
+    arguments = parser.parse_args()
+    if arguments.text_file:
+        with open(arguments.text_file) as text_file:
+            sentences = [line.rstrip('\n') for line, _ in zip(text_file, range(arguments.num_sentences))]
+    else:
+        sentences = random_sentences(arguments.num_sentences, 30)
+    reference_splitter = ReferenceSimpleWordSplitter()
+    word_splitter = SimpleWordSplitter()
+
+    expected, reference_speed = time_splitter(
+            lambda sentences: [reference_splitter.split_words(sentence) for sentence in sentences],
+            sentences)
+    one_at_a_time, speed = time_splitter(
+            lambda sentences: [word_splitter.split_words(sentence) for sentence in sentences],
+            sentences)
+    batched, batched_speed = time_splitter(word_splitter.split_many, sentences)
+    if one_at_a_time != expected or batched != expected:
+        raise RuntimeError("SimpleWordSplitter disagrees with the reference implementation!")
+    print("reference split_words: %10.0f sentences/s" % reference_speed)
+    print("split_words:           %10.0f sentences/s   (%.1fx)" % (speed, speed / reference_speed))
+    print("split_many:            %10.0f sentences/s   (%.1fx)" %
+          (batched_speed, batched_speed / reference_speed))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                        level=logging.WARNING)
+    main()
@@ -0,0 +1,48 @@
+"""
+Finds the ``adaptive_memory_usage_constant`` for a model's ``data_generator`` on this machine, by
+running a few training steps on the biggest training instances and measuring how much memory they
+use, and writes a copy of the parameter file with that constant filled in.  You need to have
+``adaptive_batch_sizes`` turned on in the parameter file for the constant to be used.  This
+measures main memory, so it's for training on the CPU.
+"""
+import logging
+import os
+import sys
+from argparse import ArgumentParser
+
+# pylint: disable=wrong-import-position
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from deep_qa import calibrate_adaptive_batch_sizes
+from deep_qa.common.checks import ensure_pythonhashseed_set
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('param_file', help="the parameter file for the model")
+    parser.add_argument('--output', help="where to write the calibrated parameters; by default, "
+                        "next to param_file, with _calibrated added to the name")
+    parser.add_argument('--memory_budget_mb', type=float,
+                        help="how much memory training can use; by default, all available memory")
+    parser.add_argument('--max_probe_batch_size', type=int,
+                        help="the largest batch to try; by default, the data generator's maximum_batch_size")
+    args = parser.parse_args()
+    output = args.output
+    if output is None:
+        output = os.path.splitext(args.param_file)[0] + "_calibrated.json"
+    memory_budget_bytes = None
+    if args.memory_budget_mb is not None:
+        memory_budget_bytes = int(args.memory_budget_mb * 1024 * 1024)
+    constant = calibrate_adaptive_batch_sizes(args.param_file,
+                                              output,
+                                              memory_budget_bytes=memory_budget_bytes,
+                                              max_probe_batch_size=args.max_probe_batch_size)
+    print("adaptive_memory_usage_constant:", constant)
+
+
+if __name__ == "__main__":
+    ensure_pythonhashseed_set()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                        level=logging.INFO)
+    main()
@@ -0,0 +1,40 @@
+"""
+Converts a gzipped, glove-formatted embedding file into the binary format that
+``PretrainedEmbeddings`` can memory-map: a ``.vocab`` file with one word per line, and a
+``float32`` ``.npy`` matrix.  Use the ``.npy`` file as the ``pretrained_file`` in your model
+parameters.
+"""
+import logging
+import os
+import sys
+from argparse import ArgumentParser
+
+# pylint: disable=wrong-import-position
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from deep_qa.data.embeddings import PretrainedEmbeddings
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def main():
+    parser = ArgumentParser(description="Convert a .txt.gz embedding file to a binary format.")
+    parser.add_argument('embeddings_file', type=str,
+                        help="The gzipped, glove-formatted embedding file to convert.")
+    parser.add_argument('output_prefix', type=str, nargs='?', default=None,
+                        help=("Where to write the output; we will write [output_prefix].vocab and "
+                              "[output_prefix].npy.  Defaults to the input filename, without the "
+                              ".txt.gz or .gz extension."))
+    arguments = parser.parse_args()
+    output_prefix = arguments.output_prefix
+    if output_prefix is None:
+        output_prefix = arguments.embeddings_file
+        for extension in ['.gz', '.txt']:
+            if output_prefix.endswith(extension):
+                output_prefix = output_prefix[:-len(extension)]
+    PretrainedEmbeddings.convert_to_binary(arguments.embeddings_file, output_prefix)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                        level=logging.INFO)
+    main()
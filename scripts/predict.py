@@ -0,0 +1,41 @@
+"""
+Writes a trained model's predictions for every instance in an input file (in the same format as
+the model's test files) as JSON lines.  The input is read and scored a shard at a time, optionally
+in several processes that share the model's weights, and if this crashes, running it again with
+the same arguments picks up from the shards that were already done.
+"""
+import logging
+import os
+import sys
+from argparse import ArgumentParser
+
+# pylint: disable=wrong-import-position
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from deep_qa import predict
+from deep_qa.common.checks import ensure_pythonhashseed_set
+
+logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('param_file', help="the parameter file the model was trained with")
+    parser.add_argument('input_file', help="the instances to score, one per line")
+    parser.add_argument('output_file', help="where to write the predictions")
+    parser.add_argument('--num_processes', type=int, default=1,
+                        help="how many processes to score the input with")
+    parser.add_argument('--shard_size', type=int, default=10000,
+                        help="how many lines of the input to score at a time")
+    args = parser.parse_args()
+    predict(args.param_file,
+            args.input_file,
+            args.output_file,
+            num_processes=args.num_processes,
+            shard_size=args.shard_size)
+
+
+if __name__ == "__main__":
+    ensure_pythonhashseed_set()
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                        level=logging.INFO)
+    main()
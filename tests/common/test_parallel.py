@@ -0,0 +1,35 @@
+# pylint: disable=no-self-use,invalid-name
+import numpy
+from numpy.testing import assert_array_equal
+
+from deep_qa.common.parallel import parallel_map, prefetch_imap
+from deep_qa.testing.test_case import DeepQaTestCase
+
+
+class TestParallel(DeepQaTestCase):
+    def test_parallel_map_keeps_the_order_of_the_items(self):
+        assert parallel_map(lambda x: x * x, range(20), num_workers=3, chunk_size=4) == \
+                [x * x for x in range(20)]
+
+    def test_prefetch_imap_keeps_the_order_of_the_items(self):
+        for num_workers in [0, 1, 3]:
+            for use_processes in [False, True]:
+                results = list(prefetch_imap(lambda x: x + 1, range(20), num_workers,
+                                             num_prefetched=4, use_processes=use_processes))
+                assert results == list(range(1, 21))
+
+    def test_prefetch_imap_sends_arrays_back_from_processes(self):
+        def make_arrays(x):
+            return (numpy.full((x, 3), x, dtype='int32'), [numpy.arange(x, dtype='float64'), None]), x
+        # The second setting makes the slots too small for the bigger results, which then get
+        # pickled instead.
+        for slot_size_mb in [1, 0.0001]:
+            results = list(prefetch_imap(make_arrays, range(1, 12), 2, num_prefetched=3,
+                                         use_processes=True, slot_size_mb=slot_size_mb))
+            assert len(results) == 11
+            for x, ((first, (second, third)), label) in zip(range(1, 12), results):
+                assert_array_equal(first, numpy.full((x, 3), x, dtype='int32'))
+                assert first.dtype == numpy.int32
+                assert_array_equal(second, numpy.arange(x, dtype='float64'))
+                assert third is None
+                assert label == x
@@ -6,3 +6,28 @@ from deep_qa.testing.test_case import DeepQaTestCase
 class TestCommonUtils(DeepQaTestCase):
     def test_group_by_count(self):
         assert util.group_by_count([1, 2, 3, 4, 5, 6, 7], 3, 20) == [[1, 2, 3], [4, 5, 6], [7, 20, 20]]
+
+    def test_get_ragged_item_matches_unflatten_ragged(self):
+        for sequences, depth in [([[1, 2], [], [3]], 1),
+                                 ([[[1, 2], [3]], [], [[4], [], [5, 6, 7]]], 2)]:
+            values, offsets = util.flatten_ragged(sequences, depth)
+            assert util.unflatten_ragged(values, offsets) == sequences
+            for index, sequence in enumerate(sequences):
+                assert util.get_ragged_item(values, offsets, index) == sequence
+
+    def test_pad_ragged_pads_and_truncates_each_level(self):
+        sequences = [[1, 2, 3], [], [4]]
+        assert util.pad_ragged(sequences, (2,), (True,)).tolist() == [[2, 3], [0, 0], [0, 4]]
+        assert util.pad_ragged(sequences, (2,), (False,)).tolist() == [[1, 2], [0, 0], [4, 0]]
+        sequences = [[[1, 2, 3], [4]], [[5]], [[6], [7, 8], [9]]]
+        padded = util.pad_ragged(sequences, (2, 2), (True, False))
+        assert padded.dtype == 'int32'
+        assert padded.tolist() == [[[1, 2], [4, 0]], [[0, 0], [5, 0]], [[7, 8], [9, 0]]]
+
+    def test_pad_flattened_ragged_matches_pad_ragged(self):
+        sequences = [[[1, 2, 3], [4]], [], [[5]], [[6], [7, 8], [9]]]
+        values, offsets = util.flatten_ragged(sequences, 2)
+        for padded_shape, truncate_from_right in [((2, 2), (True, False)), ((3, 1), (False, True))]:
+            padded = util.pad_flattened_ragged(values, offsets, padded_shape, truncate_from_right)
+            assert padded.dtype == 'int32'
+            assert padded.tolist() == util.pad_ragged(sequences, padded_shape, truncate_from_right).tolist()
@@ -1,6 +1,11 @@
 # pylint: disable=no-self-use,invalid-name
+import random
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy
+import pytest
 
+from deep_qa.common.checks import ConfigurationError
 from deep_qa.common.params import Params
 from deep_qa.data import DataGenerator, IndexedDataset
 from deep_qa.testing.test_case import DeepQaTestCase
@@ -84,6 +89,27 @@ class TestDataGenerator(DeepQaTestCase):
         assert self.as_list(one_epoch_arrays[2][0]) == [7, 2, 1]
         assert self.as_list(one_epoch_arrays[3][0]) == [8, 9, 5, 6]
 
+    def test_optimal_adaptive_grouping_wastes_less_on_padding(self):
+        params = {
+                'padding_noise': 0.0,
+                'dynamic_padding': True,
+                'adaptive_batch_sizes': True,
+                'adaptive_memory_usage_constant': 130,
+                }
+        greedy = DataGenerator(self.text_trainer, Params(dict(params)))
+        greedy.create_generator(IndexedDataset(self.instances))
+        generator = DataGenerator(self.text_trainer, Params(dict(params, adaptive_batch_planner='optimal')))
+        batches = generator.create_generator(IndexedDataset(self.instances))
+        assert generator.last_num_batches == len(batches.batches) == 4
+        one_epoch_arrays = [next(batches) for _ in range(4)]
+        one_epoch_arrays.sort(key=lambda x: x[0][0])
+        assert self.as_list(one_epoch_arrays[0][0]) == [2, 1, 0]
+        assert self.as_list(one_epoch_arrays[1][0]) == [4, 3]
+        assert self.as_list(one_epoch_arrays[2][0]) == [6, 7]
+        assert self.as_list(one_epoch_arrays[3][0]) == [8, 9, 5]
+        assert greedy.last_padding_efficiency < generator.last_padding_efficiency
+        numpy.testing.assert_almost_equal(generator.last_padding_efficiency, 109 / 135)
+
     def test_sort_every_batch_actually_adds_noise_every_batch(self):
         # We're just going to get two epoch's worth of batches, and make sure that they're
         # different.
@@ -125,6 +151,108 @@ class TestDataGenerator(DeepQaTestCase):
         assert self.as_list(one_epoch_arrays[5][0]) == [7]
         assert self.as_list(one_epoch_arrays[6][0]) == [8, 9]
 
+    def test_workers_give_the_same_batches_in_the_same_order(self):
+        base_params = {'padding_noise': 0.5, 'dynamic_padding': True}
+        random.seed(1)
+        expected = DataGenerator(self.text_trainer, Params(dict(base_params)))
+        expected_batches = expected.create_generator(IndexedDataset(self.instances))
+        expected_arrays = [self.as_list(next(expected_batches)[0]) for _ in range(12)]
+        for worker_type in ['thread', 'process']:
+            params = dict(base_params, num_workers=2, worker_type=worker_type, prefetch_batches=3)
+            random.seed(1)
+            generator = DataGenerator(self.text_trainer, Params(params))
+            batches = generator.create_generator(IndexedDataset(self.instances))
+            arrays = [self.as_list(next(batches)[0]) for _ in range(12)]
+            assert arrays == expected_arrays
+
+    def test_batch_generator_is_index_addressable_and_thread_safe(self):
+        params = Params({'padding_noise': 0.0, 'dynamic_padding': True, 'sort_every_epoch': False})
+        generator = DataGenerator(self.text_trainer, params)
+        batches = generator.create_generator(IndexedDataset(self.instances))
+        assert len(batches) == 4
+        indexed_arrays = [self.as_list(batches[i][0]) for i in range(len(batches))]
+        with ThreadPoolExecutor(4) as executor:
+            arrays = list(executor.map(lambda _: self.as_list(next(batches)[0]), range(8)))
+        assert sorted(arrays) == sorted(indexed_arrays * 2)
+
+    def test_epochs_do_not_modify_or_copy_the_dataset(self):
+        params = Params({'padding_noise': 0.5, 'dynamic_padding': True, 'sort_every_epoch': True})
+        generator = DataGenerator(self.text_trainer, params)
+        dataset = IndexedDataset(list(self.instances))
+        batches = generator.create_generator(dataset)
+        arrays = [self.as_list(next(batches)[0]) for _ in range(12)]
+        assert dataset.instances == self.instances
+        # Each epoch still has every instance exactly once.
+        for epoch in range(3):
+            epoch_indices = sorted(index for batch in arrays[epoch * 4:(epoch + 1) * 4] for index in batch)
+            assert epoch_indices == list(range(10))
+
+    def test_batch_statistics_count_real_and_padded_cells(self):
+        generator = DataGenerator(self.text_trainer, Params({}))
+        dataset = IndexedDataset(self.instances)
+        statistics = generator.get_batch_statistics(dataset, [[0, 1, 2], [8, 9]])
+        assert statistics['num_batches'] == 2
+        assert statistics['num_instances'] == 5
+        assert statistics['real_cells/a'] == 5 + 4 + 4 + 1 + 1
+        assert statistics['padded_cells/a'] == 3 * 5 + 2 * 1
+        assert statistics['real_cells/c'] == 2 + 2 + 2 + 2 + 3
+        assert statistics['padded_cells/c'] == 3 * 2 + 2 * 3
+        numpy.testing.assert_almost_equal(statistics['padding_efficiency/b'],
+                                          (3 + 3 + 1 + 1 + 1) / (3 * 3 + 2 * 1))
+        assert statistics['batch_shapes'] == [[3, {'a': 5, 'b': 3, 'c': 2}, 1], [2, {'a': 1, 'b': 1, 'c': 3}, 1]]
+        # Fixed padding lengths from the trainer are used for every batch, and truncate instances.
+        self.text_trainer.a_length = 4
+        statistics = generator.get_batch_statistics(dataset, [[0, 1, 2], [8, 9]])
+        assert statistics['real_cells/a'] == 4 + 4 + 4 + 1 + 1
+        assert statistics['padded_cells/a'] == 5 * 4
+
+    def test_batch_statistics_are_reported_at_the_end_of_each_epoch(self):
+        params = Params({'padding_noise': 0.0, 'dynamic_padding': True})
+        generator = DataGenerator(self.text_trainer, params)
+        batches = generator.create_generator(IndexedDataset(self.instances), name='training')
+        for _ in range(4):
+            next(batches)
+        assert generator.last_batch_statistics is None
+        next(batches)
+        assert batches.epoch == 1
+        statistics = generator.last_batch_statistics
+        assert statistics['num_instances'] == 10
+        assert statistics['padded_cells/a'] == 3 * 8 + 1 * 9 + 3 * 4 + 3 * 2
+        assert statistics['instances_per_second'] > 0
+
+    def test_score_dataset_restores_the_dataset_order(self):
+        dataset = IndexedDataset(self.instances)
+        for params in [{'dynamic_padding': True, 'padding_noise': 0.5}, {'num_workers': 2}]:
+            generator = DataGenerator(self.text_trainer, Params(params))
+            (predictions, widths), labels = generator.score_dataset(FakeModel(), dataset)
+            assert self.as_list(predictions) == [index * 10 for index in range(10)]
+            assert self.as_list(labels) == list(range(10))
+            if generator.dynamic_padding:
+                # Batches are sorted by padding length, without noise, so the width of this output
+                # differs between batches, and we get one array per instance.
+                assert widths.dtype == object
+                assert [len(row) for row in widths] == [3, 3, 3, 1, 3, 3, 3, 3, 3, 3]
+
+    def test_score_dataset_handles_an_empty_dataset(self):
+        for params in [{'dynamic_padding': True}, {}]:
+            generator = DataGenerator(self.text_trainer, Params(params))
+            predictions, labels = generator.score_dataset(FakeModel(), IndexedDataset([]))
+            assert len(predictions) == 0
+            assert len(labels) == 0
+            with pytest.raises(ConfigurationError):
+                generator.evaluate_dataset(FakeModel(), IndexedDataset([]))
+
+    def test_evaluate_dataset_averages_over_sorted_batches(self):
+        params = Params({'dynamic_padding': True, 'padding_noise': 0.5})
+        generator = DataGenerator(self.text_trainer, params)
+        dataset = IndexedDataset(self.instances)
+        model = FakeModel()
+        loss, batch_size = generator.evaluate_dataset(model, dataset)
+        assert model.batches == [sorted(batch) for batch in generator.create_scoring_batches(dataset, 3)]
+        numpy.testing.assert_almost_equal(loss, 4.5)
+        # Each instance counts once, so bigger batches count for more.
+        numpy.testing.assert_almost_equal(batch_size, (3 * 3 * 3 + 1 * 1) / 10)
+
     def as_list(self, array):
         return list(numpy.squeeze(array, axis=-1))
 
@@ -159,3 +287,17 @@ class FakeTextTrainer:
 
     def get_padding_memory_scaling(self, lengths):
         return lengths['a'] * lengths['b'] * lengths['c']
+
+
+class FakeModel:
+    def __init__(self):
+        self.batches = []
+
+    def predict_on_batch(self, inputs):
+        # The second output has a shape that depends on the batch, like span probabilities do.
+        return [inputs * 10, numpy.zeros((len(inputs), len(inputs)))]
+
+    def test_on_batch(self, inputs, labels):  # pylint: disable=unused-argument
+        # The "loss" is the mean instance index, and the "metric" is the batch size.
+        self.batches.append(sorted(inputs.flatten().tolist()))
+        return [float(numpy.mean(inputs)), len(inputs)]
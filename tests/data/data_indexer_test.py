@@ -1,12 +1,22 @@
 # pylint: disable=no-self-use,invalid-name
 import codecs
+import pickle
 
-from deep_qa.data.data_indexer import DataIndexer
+import pytest
+
+from deep_qa.common.params import Params
+from deep_qa.data.data_indexer import DataIndexer, NewWordError
 from deep_qa.data.datasets import TextDataset
+from deep_qa.data.instances.instance import TextInstance
 from deep_qa.data.instances.text_classification.text_classification_instance import TextClassificationInstance
+from deep_qa.data.tokenizers import tokenizers
 from deep_qa.testing.test_case import DeepQaTestCase
 
 class TestDataIndexer(DeepQaTestCase):
+    def tearDown(self):
+        super(TestDataIndexer, self).tearDown()
+        TextInstance.tokenizer = tokenizers['words'](Params({}))
+
     def test_fit_word_dictionary_respects_min_count(self):
         instance = TextClassificationInstance("a a a a b b c c c", True)
         dataset = TextDataset([instance])
@@ -38,6 +48,19 @@ class TestDataIndexer(DeepQaTestCase):
         assert data_indexer.get_word_from_index(word_index) == "word"
         assert data_indexer.get_vocab_size() == initial_vocab_size + 1
 
+    def test_finalizing_with_raise_on_new_words_only_raises_for_new_words(self):
+        data_indexer = DataIndexer()
+        word_index = data_indexer.add_word_to_index("word")
+        data_indexer.finalize(raise_on_new_words=True)
+        assert data_indexer.add_word_to_index("word") == word_index
+        with pytest.raises(NewWordError):
+            data_indexer.add_word_to_index("new word")
+        # A data indexer that was already finalized keeps ignoring new words.
+        data_indexer = DataIndexer()
+        data_indexer.finalize()
+        data_indexer.finalize(raise_on_new_words=True)
+        assert data_indexer.add_word_to_index("new word") == -1
+
     def test_namespaces(self):
         data_indexer = DataIndexer()
         initial_vocab_size = data_indexer.get_vocab_size()
@@ -98,3 +121,95 @@ class TestDataIndexer(DeepQaTestCase):
         assert data_indexer.get_word_from_index(4) == "a"
         assert data_indexer.get_word_from_index(5) == "word"
         assert data_indexer.get_word_from_index(6) == "another"
+
+    def test_fingerprint_changes_only_when_the_vocabulary_changes(self):
+        data_indexer = DataIndexer()
+        data_indexer.add_word_to_index("word")
+        fingerprint = data_indexer.fingerprint()
+        # Looking up an empty namespace creates it, but doesn't change how we index things.
+        data_indexer.get_vocab_size("characters")
+        data_indexer.add_word_to_index("word")
+        assert data_indexer.fingerprint() == fingerprint
+        data_indexer.add_word_to_index("word", namespace="characters")
+        assert data_indexer.fingerprint() != fingerprint
+
+    def test_save_and_load_round_trip(self):
+        data_indexer = DataIndexer()
+        for word in ["a", "word", "another", "wörd", ""]:
+            data_indexer.add_word_to_index(word)
+        data_indexer.add_word_to_index("c", namespace="characters")
+        data_indexer.finalize()
+        filename = self.TEST_DIR + "data_indexer.bin"
+        data_indexer.save(filename)
+        for memory_map in [False, True]:
+            loaded = DataIndexer.load(filename, memory_map=memory_map)
+            assert loaded.fingerprint() == data_indexer.fingerprint()
+            assert loaded.get_vocab_size() == 7
+            for index in range(7):
+                word = data_indexer.get_word_from_index(index)
+                assert loaded.get_word_from_index(index) == word
+                assert loaded.get_word_index(word) == index
+            assert loaded.get_word_index("not in vocabulary") == 1
+            assert "wörd" in loaded.words_in_index()
+            assert set(loaded.words_in_index()) == set(data_indexer.words_in_index())
+            assert loaded.get_word_index("c", namespace="characters") == 2
+            # The loaded data indexer is still finalized.
+            assert loaded.add_word_to_index("new word") == -1
+
+    def test_adding_to_a_memory_mapped_data_indexer_copies_it(self):
+        data_indexer = DataIndexer()
+        data_indexer.add_word_to_index("word")
+        filename = self.TEST_DIR + "data_indexer.bin"
+        data_indexer.save(filename)
+        loaded = DataIndexer.load(filename, memory_map=True)
+        assert loaded.add_word_to_index("word") == 2
+        assert loaded.add_word_to_index("another") == 3
+        assert loaded.get_word_from_index(3) == "another"
+        assert loaded.get_word_index("word") == 2
+        # Memory-mapped data indexers can still be pickled.
+        assert pickle.loads(pickle.dumps(loaded)).fingerprint() == loaded.fingerprint()
+
+    def test_unpickling_an_old_data_indexer(self):
+        data_indexer = DataIndexer()
+        old_state = {
+                '_padding_token': "@@PADDING@@",
+                '_oov_token': "@@UNKOWN@@",
+                'word_indices': {'words': {"@@PADDING@@": 0, "@@UNKOWN@@": 1, "word": 2}},
+                'reverse_word_indices': {'words': {0: "@@PADDING@@", 1: "@@UNKOWN@@", 2: "word"}},
+                '_finalized': False,
+                }
+        data_indexer.__setstate__(old_state)
+        assert data_indexer.get_word_index("word") == 2
+        assert data_indexer.get_word_from_index(2) == "word"
+        assert data_indexer.add_word_to_index("another") == 3
+
+    def test_fit_word_dictionary_respects_max_vocab_size(self):
+        dataset = TextDataset([TextClassificationInstance("a a a b b c c c c d e", True)])
+        data_indexer = DataIndexer()
+        data_indexer.fit_word_dictionary(dataset, max_vocab_size=3)
+        # "a" and "b" are tied for third most frequent, and "a" was seen first.
+        assert data_indexer.get_vocab_size() == 5
+        assert data_indexer.get_word_from_index(2) == "c"
+        assert data_indexer.get_word_from_index(3) == "a"
+        assert data_indexer.get_word_from_index(4) == "b"
+
+    def test_fit_word_dictionary_takes_settings_per_namespace(self):
+        TextInstance.tokenizer = tokenizers['words and characters'](Params({}))
+        dataset = TextDataset([TextClassificationInstance("a aa aaa bbb c", True)])
+        data_indexer = DataIndexer()
+        data_indexer.fit_word_dictionary(dataset,
+                                         min_count={'characters': 3},
+                                         max_vocab_size={'words': 2})
+        assert set(data_indexer.words_in_index("words")) == {"@@PADDING@@", "@@UNKOWN@@", "a", "aa"}
+        assert set(data_indexer.words_in_index("characters")) == {"@@PADDING@@", "@@UNKOWN@@", "a", "b"}
+
+    def test_fit_word_dictionary_in_parallel_matches_serial(self):
+        instances = [TextClassificationInstance(" ".join("word%d" % ((i * j) % 23) for j in range(10)), True)
+                     for i in range(2500)]
+        dataset = TextDataset(instances)
+        serial_indexer = DataIndexer()
+        serial_indexer.fit_word_dictionary(dataset, min_count=2, max_vocab_size=15)
+        parallel_indexer = DataIndexer()
+        parallel_indexer.fit_word_dictionary(dataset, min_count=2, max_vocab_size=15, num_workers=3)
+        assert serial_indexer.get_vocab_size() == 17
+        assert parallel_indexer.fingerprint() == serial_indexer.fingerprint()
@@ -0,0 +1,66 @@
+# pylint: disable=no-self-use,invalid-name
+import os
+
+from deep_qa.common.params import Params
+from deep_qa.data.data_indexer import DataIndexer
+from deep_qa.data.dataset_cache import IndexedDatasetCache
+from deep_qa.data.datasets import TextDataset
+from deep_qa.data.instances.instance import TextInstance
+from deep_qa.data.instances.reading_comprehension.character_span_instance import CharacterSpanInstance
+from deep_qa.data.instances.text_classification.text_classification_instance import TextClassificationInstance
+from deep_qa.data.tokenizers import tokenizers
+from deep_qa.testing.test_case import DeepQaTestCase
+
+
+class TestIndexedDatasetCache(DeepQaTestCase):
+    def setUp(self):
+        super(TestIndexedDatasetCache, self).setUp()
+        self.cache_dir = self.TEST_DIR + 'cache/'
+        self.cache = IndexedDatasetCache(Params({'directory': self.cache_dir}))
+
+    def _index(self, instances):
+        dataset = TextDataset(instances)
+        data_indexer = DataIndexer()
+        data_indexer.fit_word_dictionary(dataset)
+        return dataset.to_indexed_dataset(data_indexer)
+
+    def test_save_and_load_round_trips_instances(self):
+        TextInstance.tokenizer = tokenizers['words and characters'](Params({}))
+        indexed_dataset = self._index([CharacterSpanInstance("What do dogs eat?", "Dogs eat cats.", (9, 13)),
+                                       CharacterSpanInstance("Who?", "Nobody.", None)])
+        self.cache.save('key', indexed_dataset, 'state')
+        loaded_dataset = self.cache.load('key', 'state')
+        assert len(loaded_dataset.instances) == 2
+        for loaded, original in zip(loaded_dataset.instances, indexed_dataset.instances):
+            assert loaded.__class__ is original.__class__
+            assert loaded.get_fields() == original.get_fields()
+
+    def test_load_misses_on_unknown_key_or_different_state(self):
+        indexed_dataset = self._index([TextClassificationInstance("a b c", True)])
+        self.cache.save('key', indexed_dataset, 'state')
+        assert self.cache.load('other key', 'state') is None
+        assert self.cache.load('key', 'other state') is None
+        assert self.cache.load('key', 'state') is not None
+
+    def test_compute_key_depends_on_file_contents_and_key_data(self):
+        with open(self.TRAIN_FILE, 'w') as data_file:
+            data_file.write("a b c\t1\n")
+        key = IndexedDatasetCache.compute_key([self.TRAIN_FILE], tokenizer={'type': 'words'})
+        assert key == IndexedDatasetCache.compute_key([self.TRAIN_FILE], tokenizer={'type': 'words'})
+        assert key != IndexedDatasetCache.compute_key([self.TRAIN_FILE], tokenizer={'type': 'characters'})
+        with open(self.TRAIN_FILE, 'w') as data_file:
+            data_file.write("a b d\t1\n")
+        assert key != IndexedDatasetCache.compute_key([self.TRAIN_FILE], tokenizer={'type': 'words'})
+
+    def test_eviction_removes_least_recently_used_entries(self):
+        indexed_dataset = self._index([TextClassificationInstance("a b c " * 1000, True)])
+        self.cache.save('first', indexed_dataset)
+        entry_size = os.path.getsize(os.path.join(self.cache_dir, 'first.npz'))
+        self.cache.max_size_mb = 2.5 * entry_size / (1024 * 1024)
+        self.cache.save('second', indexed_dataset)
+        os.utime(os.path.join(self.cache_dir, 'first.npz'), (0, 0))
+        os.utime(os.path.join(self.cache_dir, 'second.npz'), (1, 1))
+        # Using an entry makes it the most recently used.
+        assert self.cache.load('first') is not None
+        self.cache.save('third', indexed_dataset)
+        assert sorted(os.listdir(self.cache_dir)) == ['first.npz', 'third.npz']
@@ -1,6 +1,22 @@
 # pylint: disable=no-self-use,invalid-name
-from deep_qa.data.datasets.dataset import Dataset, TextDataset
+from copy import deepcopy
+
+from numpy.testing import assert_array_equal
+
+from deep_qa.common.params import Params
+from deep_qa.data.data_indexer import DataIndexer
+from deep_qa.data.datasets.dataset import Dataset, IndexedDataset, TextDataset
+from deep_qa.data.instances.instance import TextInstance
+from deep_qa.data.instances.language_modeling.sentence_instance import IndexedSentenceInstance
+from deep_qa.data.instances.reading_comprehension.character_span_instance import CharacterSpanInstance
+from deep_qa.data.instances.reading_comprehension.character_span_instance import IndexedCharacterSpanInstance
+from deep_qa.data.instances.reading_comprehension.mc_question_passage_instance import \
+        IndexedMcQuestionPassageInstance
+from deep_qa.data.instances.sequence_tagging.tagging_instance import IndexedTaggingInstance
 from deep_qa.data.instances.text_classification.text_classification_instance import TextClassificationInstance
+from deep_qa.data.instances.text_classification.text_classification_instance import \
+        IndexedTextClassificationInstance
+from deep_qa.data.tokenizers import tokenizers
 
 from deep_qa.testing.test_case import DeepQaTestCase
 
@@ -36,3 +52,264 @@ class TestTextDataset(DeepQaTestCase):
         assert instance.index == 3
         assert instance.text == "instance3"
         assert instance.label is None
+
+    def test_read_from_file_stops_at_max_instances(self):
+        filename = self.TEST_DIR + 'test_dataset_file'
+        with open(filename, 'w') as datafile:
+            datafile.write("1\tinstance1\t0\n")
+            datafile.write("2\tinstance2\t1\n")
+            # This line would crash if we tried to parse it.
+            datafile.write("not\ta\tvalid\tline\tat\tall\n")
+        dataset = TextDataset.read_from_file(filename, TextClassificationInstance, max_instances=2)
+        assert len(dataset.instances) == 2
+        assert dataset.instances[1].text == "instance2"
+
+    def test_read_from_lines_accepts_a_generator(self):
+        lines = (line for line in ["instance1\t0", "instance2\t1", "instance3\t1"])
+        dataset = TextDataset.read_from_lines(lines, TextClassificationInstance, max_instances=2)
+        assert [instance.text for instance in dataset.instances] == ["instance1", "instance2"]
+        assert next(lines) == "instance3\t1"
+
+    def test_parallel_reading_and_indexing_match_serial(self):
+        lines = ["%d\tquestion %d ?\tpassage with words %d and answer %d .\t%d,%d" %
+                 (i, i, i % 7, i % 3, 18, 22) for i in range(50)]
+        serial_dataset = TextDataset.read_from_lines(lines, CharacterSpanInstance)
+        parallel_dataset = TextDataset.read_from_lines(lines, CharacterSpanInstance, num_workers=3)
+        assert [instance.get_fields() for instance in parallel_dataset.instances] == \
+                [instance.get_fields() for instance in serial_dataset.instances]
+
+        data_indexer = DataIndexer()
+        data_indexer.fit_word_dictionary(serial_dataset, min_count=2)
+        # The stop token gets added to the data indexer during indexing, which has to still work
+        # when we're using several processes.
+        serial_indexed = serial_dataset.to_indexed_dataset(data_indexer)
+        parallel_indexer = DataIndexer()
+        parallel_indexer.fit_word_dictionary(serial_dataset, min_count=2)
+        parallel_indexed = parallel_dataset.to_indexed_dataset(parallel_indexer, num_workers=3)
+        assert parallel_indexer.get_vocab_size() == data_indexer.get_vocab_size()
+        assert [instance.get_fields() for instance in parallel_indexed.instances] == \
+                [instance.get_fields() for instance in serial_indexed.instances]
+
+    def test_parallel_indexing_matches_serial_when_a_later_instance_adds_a_word(self):
+        lines = ["%d\tquestion %d ?\tpassage with words %d and answer %d .\t%d,%d" %
+                 (i, i, i, i % 3, 18, 22) for i in range(30)]
+        indexed_datasets = []
+        data_indexers = []
+        for num_workers in [1, 3]:
+            dataset = TextDataset.read_from_lines(lines, CharacterSpanInstance)
+            dataset.indexing_batch_size = 4
+            # Only instances from here on add this word to the vocabulary, so the workers' copies
+            # of the data indexer don't have it.
+            for instance in dataset.instances[17:]:
+                instance.stop_token = "@@LATE_STOP@@"
+            data_indexer = DataIndexer()
+            data_indexer.fit_word_dictionary(dataset, min_count=2)
+            indexed_datasets.append(dataset.to_indexed_dataset(data_indexer, num_workers=num_workers))
+            data_indexers.append(data_indexer)
+        serial_indexed, parallel_indexed = indexed_datasets
+        late_stop_index = data_indexers[1].get_word_index("@@LATE_STOP@@")
+        assert late_stop_index == data_indexers[0].get_word_index("@@LATE_STOP@@")
+        assert late_stop_index > 1  # Not padding or OOV.
+        assert parallel_indexed.instances[20].passage_indices[-1] == late_stop_index
+        assert [instance.get_fields() for instance in parallel_indexed.instances] == \
+                [instance.get_fields() for instance in serial_indexed.instances]
+
+    def test_to_indexed_dataset_matches_indexing_instances_one_at_a_time(self):
+        TextInstance.tokenizer = tokenizers['words and characters'](Params({}))
+        try:
+            passages = ["passage number %d , with some words ." % i for i in range(3)]
+            lines = ["%d\tquestion %d ?\t%s\t%d,%d" % (i, i, passages[i % 3], 15, 19) for i in range(30)]
+            dataset = TextDataset.read_from_lines(lines, CharacterSpanInstance)
+            data_indexer = DataIndexer()
+            data_indexer.fit_word_dictionary(dataset, min_count=2)
+            expected = [instance.to_indexed_instance(data_indexer) for instance in dataset.instances]
+            indexed_dataset = dataset.to_indexed_dataset(data_indexer)
+            assert [instance.get_fields() for instance in indexed_dataset.instances] == \
+                    [instance.get_fields() for instance in expected]
+        finally:
+            TextInstance.tokenizer = tokenizers['words'](Params({}))
+
+    def test_pretokenizing_does_not_change_the_indexed_dataset(self):
+        lines = ["%d\tquestion %d ?\tpassage with words %d and answer %d .\t%d,%d" %
+                 (i, i, i % 7, i % 3, 18, 22) for i in range(20)]
+        expected_dataset = TextDataset.read_from_lines(lines, CharacterSpanInstance)
+        data_indexer = DataIndexer()
+        data_indexer.fit_word_dictionary(expected_dataset)
+        expected = expected_dataset.to_indexed_dataset(data_indexer)
+
+        dataset = TextDataset.read_from_lines(lines, CharacterSpanInstance)
+        dataset.pretokenize(num_workers=2)
+        pretokenized_indexer = DataIndexer()
+        pretokenized_indexer.fit_word_dictionary(dataset)
+        indexed_dataset = dataset.to_indexed_dataset(pretokenized_indexer)
+        assert pretokenized_indexer.fingerprint() == data_indexer.fingerprint()
+        assert [instance.get_fields() for instance in indexed_dataset.instances] == \
+                [instance.get_fields() for instance in expected.instances]
+        # Indexing is the last step that needs the tokens, so they get thrown away.
+        assert TextInstance.tokenizer._token_cache is None  # pylint: disable=protected-access
+
+    def test_instances_share_duplicate_passages(self):
+        lines = ["%d\tquestion %d ?\t%s\t0,7" % (i, i, "passage %d , with some words ." % (i % 2))
+                 for i in range(6)]
+        dataset = TextDataset.read_from_lines(lines, CharacterSpanInstance)
+        instances = dataset.instances
+        assert instances[0].passage_text is instances[2].passage_text
+        assert instances[0].passage_text is not instances[1].passage_text
+        data_indexer = DataIndexer()
+        data_indexer.fit_word_dictionary(dataset)
+        indexed_instances = dataset.to_indexed_dataset(data_indexer).instances
+        # pylint: disable=protected-access
+        assert indexed_instances[1]._passage_indices is indexed_instances[3]._passage_indices
+        assert indexed_instances[2]._passage_indices is indexed_instances[4]._passage_indices
+        assert indexed_instances[1].passage_indices[-1] == data_indexer.get_word_index("@@STOP@@")
+        # Padding gives each instance its own copy of the passage.
+        passage_length = len(indexed_instances[3].passage_indices)
+        indexed_instances[1].pad({'num_question_words': 3, 'num_passage_words': 10})
+        assert len(indexed_instances[1].passage_indices) == 10
+        assert len(indexed_instances[3].passage_indices) == passage_length
+
+    def test_instances_share_duplicate_passages_across_indexing_batches(self):
+        lines = ["%d\tquestion %d ?\t%s\t0,7" % (i, i, "passage %d , with some words ." % (i % 3))
+                 for i in range(20)]
+        dataset = TextDataset.read_from_lines(lines, CharacterSpanInstance)
+        dataset.indexing_batch_size = 4
+        data_indexer = DataIndexer()
+        data_indexer.fit_word_dictionary(dataset)
+        # pylint: disable=protected-access
+        for num_workers in [1, 2]:
+            indexed_instances = dataset.to_indexed_dataset(data_indexer, num_workers=num_workers).instances
+            for i in range(3, 20):
+                assert indexed_instances[i]._passage_indices is indexed_instances[i % 3]._passage_indices
+
+
+class TestIndexedDataset:
+    def assert_padded_training_data_matches_padding_instances(self, instances, padding_lengths=None):
+        expected_dataset = IndexedDataset(deepcopy(instances))
+        expected_dataset.pad_instances(padding_lengths, verbose=False)
+        expected_inputs, expected_labels = expected_dataset.as_training_data()
+        dataset = IndexedDataset(instances)
+        unpadded_instances = deepcopy(instances)
+        inputs, labels = dataset.as_padded_training_data(padding_lengths, verbose=False)
+        if not isinstance(expected_inputs, list):
+            inputs, expected_inputs = [inputs], [expected_inputs]
+        if not isinstance(expected_labels, list):
+            labels, expected_labels = [labels], [expected_labels]
+        assert len(inputs) == len(expected_inputs)
+        assert len(labels) == len(expected_labels)
+        for array, expected_array in zip(inputs + labels, expected_inputs + expected_labels):
+            assert array.shape == expected_array.shape
+            assert_array_equal(array, expected_array)
+        # The instances themselves don't get padded.
+        assert [instance.get_fields() for instance in instances] == \
+                [instance.get_fields() for instance in unpadded_instances]
+
+    def test_as_padded_training_data_handles_word_sequences(self):
+        instances = [IndexedTextClassificationInstance([1, 2, 3], True),
+                     IndexedTextClassificationInstance([4], False),
+                     IndexedTextClassificationInstance([5, 6, 7, 8, 9], True)]
+        self.assert_padded_training_data_matches_padding_instances(instances)
+        self.assert_padded_training_data_matches_padding_instances(instances, {'num_sentence_words': 4})
+        instances = [IndexedTaggingInstance([1, 2, 3], [4, 5, 6]), IndexedTaggingInstance([7], [8])]
+        self.assert_padded_training_data_matches_padding_instances(instances, {'num_sentence_words': 2})
+        instances = [IndexedSentenceInstance([1, 2, 3], [2, 3, 4]), IndexedSentenceInstance([7], [8])]
+        self.assert_padded_training_data_matches_padding_instances(instances, {'num_sentence_words': 2})
+
+    def test_as_padded_training_data_handles_word_and_character_sequences(self):
+        instances = [IndexedCharacterSpanInstance([[1, 2], [3, 4, 5]], [[6], [7, 8, 9, 10], [11]], [0, 1]),
+                     IndexedCharacterSpanInstance([[12]], [[13, 14], [15]], [1, 1])]
+        self.assert_padded_training_data_matches_padding_instances(instances)
+        self.assert_padded_training_data_matches_padding_instances(instances, {'num_question_words': 1,
+                                                                               'num_passage_words': 2,
+                                                                               'num_word_characters': 3})
+
+    def test_as_padded_training_data_handles_multiple_choice_options(self):
+        instances = [IndexedMcQuestionPassageInstance([1, 2], [3, 4, 5], [[6], [7, 8, 9]], 1),
+                     IndexedMcQuestionPassageInstance([10], [11], [[12, 13], [14], [15, 16, 17]], 2)]
+        self.assert_padded_training_data_matches_padding_instances(instances)
+        instances = [IndexedMcQuestionPassageInstance([[1, 2]], [[3], [4, 5]], [[[6]], [[7, 8], [9]]], 1),
+                     IndexedMcQuestionPassageInstance([[10]], [[11]], [[[12, 13]], [[14]], [[15]]], 0)]
+        self.assert_padded_training_data_matches_padding_instances(instances)
+        self.assert_padded_training_data_matches_padding_instances(instances, {'num_question_words': None,
+                                                                               'num_passage_words': None,
+                                                                               'num_options': 2,
+                                                                               'num_option_words': 1,
+                                                                               'num_word_characters': 1})
+
+    def test_as_padded_training_data_handles_empty_and_differently_nested_sequences(self):
+        instances = [IndexedCharacterSpanInstance([[12]], [[13, 14], [15]], [1, 1]),
+                     IndexedCharacterSpanInstance([], [[6], [7, 8, 9, 10], [11]], [0, 1])]
+        padding_lengths = {'num_question_words': None, 'num_passage_words': None, 'num_word_characters': 3}
+        (questions, _), _ = IndexedDataset(instances).as_padded_training_data(padding_lengths, verbose=False)
+        assert questions.tolist() == [[[12, 0, 0]], [[0, 0, 0]]]
+        # An option with no words doesn't look like it's made of characters, so we can't pad the
+        # stored indices of this field directly.
+        instances = [IndexedMcQuestionPassageInstance([[1, 2]], [[3], [4, 5]], [[[6]], [[7, 8], [9]]], 1),
+                     IndexedMcQuestionPassageInstance([[10]], [[11]], [[]], 0)]
+        self.assert_padded_training_data_matches_padding_instances(instances)
+
+    def test_get_padding_sorted_indices_does_not_reorder_the_dataset(self):
+        instances = [IndexedTextClassificationInstance([1, 2, 3], True),
+                     IndexedTextClassificationInstance([4], False),
+                     IndexedTextClassificationInstance([5, 6, 7, 8, 9], True),
+                     IndexedTextClassificationInstance([10], True)]
+        dataset = IndexedDataset(list(instances))
+        assert dataset.get_padding_sorted_indices(['num_sentence_words']) == [1, 3, 0, 2]
+        assert dataset.instances == instances
+        dataset.sort_by_padding(['num_sentence_words'])
+        assert dataset.instances == [instances[1], instances[3], instances[0], instances[2]]
+
+    def test_padding_length_table_is_cached_and_kept_up_to_date(self):
+        instances = [IndexedTextClassificationInstance([[1, 2], [3]], True),
+                     IndexedTextClassificationInstance([[9]], False),
+                     IndexedTextClassificationInstance([[4], [5, 6, 7], [8]], True)]
+        dataset = IndexedDataset(instances)
+        keys, table = dataset.get_padding_length_table()
+        assert keys == ['num_sentence_words', 'num_word_characters']
+        assert table.tolist() == [[2, 2], [1, 1], [3, 3]]
+        assert dataset.get_padding_length_table()[1] is table
+        assert dataset.padding_lengths() == {'num_sentence_words': 3, 'num_word_characters': 3}
+        batch = dataset.select([2, 0])
+        assert batch.instances == [instances[2], instances[0]]
+        assert batch.get_padding_length_table()[1].tolist() == [[3, 3], [2, 2]]
+        dataset.sort_by_padding(['num_sentence_words'])
+        assert dataset.get_padding_length_table()[1].tolist() == [[1, 1], [2, 2], [3, 3]]
+        dataset.pad_instances({'num_sentence_words': 4, 'num_word_characters': 3}, verbose=False)
+        assert dataset.get_padding_length_table()[1].tolist() == [[4, 3], [4, 3], [4, 3]]
+        dataset.instances = dataset.instances[:1]
+        assert dataset.get_padding_length_table()[1].tolist() == [[4, 3]]
+
+    def test_padding_length_table_fills_in_missing_keys_with_zeros(self):
+        instances = [IndexedTextClassificationInstance([], False),
+                     IndexedTextClassificationInstance([[1, 2], [3]], True)]
+        keys, table = IndexedDataset(instances).get_padding_length_table()
+        assert keys == ['num_sentence_words', 'num_word_characters']
+        assert table.tolist() == [[0, 0], [2, 2]]
+
+    def test_padding_lengths_with_a_percentile_ignore_the_longest_instances(self):
+        instances = [IndexedTextClassificationInstance(list(range(length)), True) for length in range(1, 11)]
+        dataset = IndexedDataset(instances)
+        assert dataset.padding_lengths() == {'num_sentence_words': 10}
+        assert dataset.padding_lengths(0.9) == {'num_sentence_words': 9}
+        assert dataset.padding_lengths(0.85) == {'num_sentence_words': 9}
+        assert dataset.padding_lengths(0.5) == {'num_sentence_words': 5}
+        assert dataset.padding_lengths({'num_sentence_words': 0.8}) == {'num_sentence_words': 8}
+        assert dataset.padding_lengths({'num_word_characters': 0.5}) == {'num_sentence_words': 10}
+
+    def test_truncation_statistics_count_truncated_instances_tokens_and_labels(self):
+        instances = [IndexedCharacterSpanInstance([1, 2], [1, 2, 3, 4, 5], (1, 2)),
+                     IndexedCharacterSpanInstance([1, 2, 3], [1, 2, 3, 4, 5, 6, 7], (4, 5)),
+                     IndexedCharacterSpanInstance([1], [1, 2, 3, 4, 5, 6], (0, 1))]
+        dataset = IndexedDataset(instances)
+        statistics = dataset.truncation_statistics({'num_question_words': 2, 'num_passage_words': 5})
+        assert statistics == {'truncated_instances/num_question_words': 1,
+                              'truncated_cells/num_question_words': 1,
+                              'truncated_instances/num_passage_words': 2,
+                              'truncated_cells/num_passage_words': 3,
+                              'truncated_labels': 1}
+        statistics = dataset.truncation_statistics({'num_question_words': None, 'num_passage_words': None})
+        assert not any(statistics.values())
+        # The instance that loses its answer doesn't get a label, instead of crashing.
+        _, (span_begins, span_ends) = dataset.as_padded_training_data({'num_question_words': 2,
+                                                                       'num_passage_words': 5})
+        assert span_begins.sum(axis=1).tolist() == [1, 0, 1]
+        assert span_ends.sum(axis=1).tolist() == [1, 0, 1]
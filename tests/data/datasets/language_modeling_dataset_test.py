@@ -19,3 +19,12 @@ class TestLanguageModellingDataset(DeepQaTestCase):
         assert instances[0].text == "This is a sentence"
         assert instances[1].text == "for language modelling. Here's"
         assert instances[2].text == "another one for language"
+        assert len(instances) == 3
+
+    def test_read_from_file_stops_at_max_instances(self):
+        args = Params({"sequence_length": 4})
+        dataset = LanguageModelingDataset.read_from_file(self.TRAIN_FILE, SentenceInstance, args,
+                                                         max_instances=2)
+        instances = dataset.instances
+        assert len(instances) == 2
+        assert instances[1].text == "for language modelling. Here's"
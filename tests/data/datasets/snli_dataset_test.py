@@ -40,3 +40,8 @@ class TestSnliDataset(DeepQaTestCase):
         assert instance.first_sentence == instance3.first_sentence
         assert instance.second_sentence == instance3.second_sentence
         assert instance.label == instance3.label
+
+    def test_read_from_file_stops_at_max_instances(self):
+        dataset = SnliDataset.read_from_file(self.TRAIN_FILE, SnliInstance, max_instances=2)
+        assert len(dataset.instances) == 2
+        assert dataset.instances[1].second_sentence == "A person is at a diner, ordering an omelette."
@@ -1,5 +1,6 @@
 # pylint: disable=no-self-use,invalid-name
 import gzip
+import os
 
 import numpy
 import pytest
@@ -70,6 +71,59 @@ class TestPretrainedEmbeddings(DeepQaTestCase):
         word_vector = embedding_layer._initial_weights[0][data_indexer.get_word_index("word2")]
         assert not numpy.allclose(word_vector, numpy.asarray([0.0, 0.0, 0.0]))
 
+    def test_get_embedding_layer_gives_the_same_result_with_several_workers(self):
+        data_indexer = DataIndexer()
+        for word in ["word1", "word2", "word3", "word4"]:
+            data_indexer.add_word_to_index(word)
+        embeddings_filename = self.TEST_DIR + "embeddings.gz"
+        with gzip.open(embeddings_filename, 'wb') as embeddings_file:
+            for i in range(100):
+                embeddings_file.write(("word%d %d.0 2.3 -1.0\n" % (i % 7, i)).encode('utf-8'))
+                embeddings_file.write(("word%d 0.1 0.4\n" % (i % 5)).encode('utf-8'))
+        serial_layer = PretrainedEmbeddings.get_embedding_layer(embeddings_filename, data_indexer)
+        parallel_layer = PretrainedEmbeddings.get_embedding_layer(embeddings_filename, data_indexer,
+                                                                  num_workers=2)
+        serial_weights = serial_layer._initial_weights[0]
+        assert numpy.array_equal(serial_weights, parallel_layer._initial_weights[0])
+        # The last vector for a word in the file wins.
+        assert numpy.allclose(serial_weights[data_indexer.get_word_index("word1")], [99.0, 2.3, -1.0])
+
+    def test_binary_embeddings_match_text_embeddings(self):
+        data_indexer = DataIndexer()
+        for word in ["word1", "word2", "word3", "word4"]:
+            data_indexer.add_word_to_index(word)
+        embeddings_filename = self.TEST_DIR + "embeddings.gz"
+        with gzip.open(embeddings_filename, 'wb') as embeddings_file:
+            embeddings_file.write("word1 1.0 2.3 -1.0\n".encode('utf-8'))
+            embeddings_file.write("word2 0.1 0.4\n".encode('utf-8'))
+            embeddings_file.write("word3 0.5 0.6 -4.0\n".encode('utf-8'))
+            embeddings_file.write("unused 0.5 0.6 -4.0\n".encode('utf-8'))
+            embeddings_file.write("word1 3.0 2.0 1.0\n".encode('utf-8'))
+        PretrainedEmbeddings.convert_to_binary(embeddings_filename, self.TEST_DIR + "embeddings")
+        assert numpy.load(self.TEST_DIR + "embeddings.npy").shape == (4, 3)
+        text_layer = PretrainedEmbeddings.get_embedding_layer(embeddings_filename, data_indexer)
+        binary_layer = PretrainedEmbeddings.get_embedding_layer(self.TEST_DIR + "embeddings.npy",
+                                                                data_indexer)
+        assert binary_layer.output_dim == 3
+        text_weights = text_layer._initial_weights[0]
+        binary_weights = binary_layer._initial_weights[0]
+        assert numpy.array_equal(text_weights, binary_weights)
+        assert numpy.allclose(binary_weights[data_indexer.get_word_index("word1")], [3.0, 2.0, 1.0])
+
+    def test_convert_to_binary_raises_a_configuration_error_for_files_without_vectors(self):
+        embeddings_filename = self.TEST_DIR + "embeddings.gz"
+        with gzip.open(embeddings_filename, 'wb') as embeddings_file:
+            embeddings_file.write("".encode('utf-8'))
+        with pytest.raises(ConfigurationError) as error:
+            PretrainedEmbeddings.convert_to_binary(embeddings_filename, self.TEST_DIR + "embeddings")
+        assert embeddings_filename in str(error.value)
+        with gzip.open(embeddings_filename, 'wb') as embeddings_file:
+            embeddings_file.write("400000 300\n".encode('utf-8'))
+        with pytest.raises(ConfigurationError) as error:
+            PretrainedEmbeddings.convert_to_binary(embeddings_filename, self.TEST_DIR + "embeddings")
+        assert embeddings_filename in str(error.value)
+        assert not os.path.exists(self.TEST_DIR + "embeddings.vocab")
+
     def test_embedding_will_not_project_random_embeddings(self):
         self.write_pretrained_vector_files()
         self.write_true_false_model_files()
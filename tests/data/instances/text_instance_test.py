@@ -1,7 +1,11 @@
-# pylint: disable=no-self-use,invalid-name
+# pylint: disable=no-self-use,invalid-name,protected-access
+import pickle
+
+import pytest
+
 from deep_qa.common.params import Params
 from deep_qa.data.data_indexer import DataIndexer
-from deep_qa.data.instances.instance import TextInstance
+from deep_qa.data.instances.instance import RaggedIndices, TextInstance
 from deep_qa.data.instances.text_classification import IndexedTextClassificationInstance
 from deep_qa.data.instances.text_classification import TextClassificationInstance
 from deep_qa.data.tokenizers import tokenizers
@@ -77,3 +81,51 @@ class TestIndexedInstance(DeepQaTestCase):
         padded = instance.pad_word_sequence(instance.word_indices,
                                             {'num_sentence_words': 5, 'num_word_characters': 4})
         assert padded == [[0, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0], [1, 2, 0, 0], [3, 1, 2, 0]]
+
+    def test_index_fields_are_stored_compactly_and_read_as_lists(self):
+        instance = IndexedTextClassificationInstance([[1, 2], [], [3, 1, 2]], True)
+        assert not hasattr(instance, '__dict__')
+        assert isinstance(instance._word_indices, RaggedIndices)
+        assert instance._word_indices.values.tolist() == [1, 2, 3, 1, 2]
+        assert instance.word_indices == [[1, 2], [], [3, 1, 2]]
+        # The lists are rebuilt on every read, so changing one couldn't change the instance, and
+        # raises an error instead.
+        with pytest.raises(TypeError):
+            instance.word_indices.append([4])
+        with pytest.raises(TypeError):
+            instance.word_indices[0][1] = 4
+        word_indices = list(instance.word_indices)
+        word_indices.append([4])
+        instance.word_indices = word_indices
+        assert instance.word_indices == [[1, 2], [], [3, 1, 2], [4]]
+        instance.word_indices = instance.word_indices[:3]
+        assert instance.get_padding_lengths() == {'num_sentence_words': 3, 'num_word_characters': 3}
+        assert instance.get_fields() == {'label': True, 'index': None,
+                                         'word_indices': [[1, 2], [], [3, 1, 2]]}
+        copied = pickle.loads(pickle.dumps(instance))
+        assert copied.get_fields() == instance.get_fields()
+
+    def test_index_fields_store_other_values_as_they_are(self):
+        instance = IndexedTextClassificationInstance(None, True)
+        assert instance.word_indices is None
+        instance.word_indices = [1.5, 2.5]
+        assert instance._word_indices == [1.5, 2.5]
+
+    def test_ragged_indices_find_the_nesting_depth_past_empty_lists(self):
+        indices = RaggedIndices.from_list([[], [[1], [2, 3]], []])
+        assert len(indices.offsets) == 2
+        assert len(indices) == 3
+        assert indices.to_list() == [[], [[1], [2, 3]], []]
+        assert RaggedIndices.from_list([]).to_list() == []
+
+    def test_ragged_indices_stack_into_one_more_level(self):
+        sequences = [[[1, 2], [3]], [], [[4], [], [5, 6, 7]], [[8]]]
+        stacked = RaggedIndices.stack([RaggedIndices.from_list(sequence) for sequence in sequences], 1)
+        assert len(stacked.offsets) == 2
+        assert stacked.to_list() == sequences
+        stacked = RaggedIndices.stack([RaggedIndices.from_list([1, 2]), RaggedIndices.from_list([])], 0)
+        assert stacked.to_list() == [[1, 2], []]
+        with pytest.raises(ValueError):
+            RaggedIndices.stack([RaggedIndices.from_list([1, 2])], 1)
+        with pytest.raises(ValueError):
+            RaggedIndices.stack([RaggedIndices.from_list([1, 2]), [1.5, 2.5]], 0)
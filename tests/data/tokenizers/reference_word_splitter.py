@@ -0,0 +1,41 @@
+from typing import List
+
+from overrides import overrides
+
+from deep_qa.data.tokenizers.word_splitter import SimpleWordSplitter
+
+
+class ReferenceSimpleWordSplitter(SimpleWordSplitter):
+    """
+    The original implementation of :class:`SimpleWordSplitter`, which strips punctuation and
+    contractions off of each field one slice at a time.  This gives exactly the same output as
+    ``SimpleWordSplitter``, but is a good deal slower.  We keep it with the tests, so that we can
+    test (and ``scripts/benchmark_word_splitter.py`` can benchmark) the faster implementation
+    against it.
+    """
+    @overrides
+    def _split_field(self, field: str) -> List[str]:
+        tokens = []
+        add_at_end = []
+        while self._can_split(field) and field[0] in self.beginning_punctuation:
+            tokens.append(field[0])
+            field = field[1:]
+        while self._can_split(field) and field[-1] in self.ending_punctuation:
+            add_at_end.insert(0, field[-1])
+            field = field[:-1]
+
+        # There could (rarely) be several contractions in a word, but we check contractions
+        # sequentially, in a random order.  If we've removed one, we need to check again to be
+        # sure there aren't others.
+        remove_contractions = True
+        while remove_contractions:
+            remove_contractions = False
+            for contraction in self.contractions:
+                if self._can_split(field) and field.endswith(contraction):
+                    field = field[:-len(contraction)]
+                    add_at_end.insert(0, contraction)
+                    remove_contractions = True
+        if field:
+            tokens.append(field)
+        tokens.extend(add_at_end)
+        return tokens
@@ -1,5 +1,10 @@
 # pylint: disable=no-self-use,invalid-name
+import numpy
 
+from deep_qa.common.util import unflatten_ragged
+from deep_qa.data.data_indexer import DataIndexer
+from deep_qa.data.tokenizers.character_tokenizer import CharacterTokenizer
+from deep_qa.data.tokenizers.word_and_character_tokenizer import WordAndCharacterTokenizer
 from deep_qa.data.tokenizers.word_tokenizer import WordTokenizer
 from deep_qa.common.params import Params
 
@@ -20,3 +25,61 @@ class TestTokenizer:
         # "Lenox Hill Hospital in New York."
         token_span = self.tokenizer.char_span_to_token_span(self.passage, (91, 123))
         assert token_span == (22, 29)
+
+    def test_char_span_to_token_span_is_exact_with_irregular_whitespace(self):
+        # Counting token lengths to estimate where the span starts drifts here, because of the
+        # extra whitespace and the punctuation that isn't followed by a space.
+        passage = "So  (so)   so,so. \t So so so so so. So!"
+        token_span = self.tokenizer.char_span_to_token_span(passage, (23, 25))
+        assert token_span == (7, 8)
+        token_span = self.tokenizer.char_span_to_token_span(passage, (36, 39))
+        assert token_span == (12, 14)
+        # Spans that only partly cover a token give all of the tokens they overlap.
+        token_span = self.tokenizer.char_span_to_token_span(passage, (12, 14))
+        assert token_span == (4, 5)
+
+    def test_index_texts_matches_index_text(self):
+        data_indexer = DataIndexer()
+        for word in ["on", "january", "beyoncé", "blue", "ivy"]:
+            data_indexer.add_word_to_index(word)
+        for character in "aeiouyé":
+            data_indexer.add_word_to_index(character)
+            data_indexer.add_word_to_index(character, namespace="characters")
+        texts = [self.passage, "", "Blue Ivy", "blue ivy and beyoncé"]
+        for tokenizer in [WordTokenizer(Params({})),
+                          CharacterTokenizer(Params({})),
+                          WordAndCharacterTokenizer(Params({}))]:
+            values, offsets = tokenizer.index_texts(texts, data_indexer)
+            assert values.dtype == numpy.int32
+            assert unflatten_ragged(values, offsets) == [tokenizer.index_text(text, data_indexer)
+                                                         for text in texts]
+
+    def test_pretokenize_saves_tokens_until_the_cache_is_cleared(self):
+        tokenizer = WordTokenizer(Params({}))
+        texts = [self.passage, "Blue Ivy", self.passage]
+        expected = [tokenizer.tokenize(text) for text in texts]
+        tokenizer.pretokenize(texts, num_workers=2)
+        tokenized_texts = []
+        tokenizer._tokenize = None  # pylint: disable=protected-access
+        for text in texts:
+            tokens = tokenizer.tokenize(text)
+            tokenized_texts.append(tokens)
+            # Changing the returned tokens must not change what's saved.
+            tokens.append("extra")
+        assert [tokens[:-1] for tokens in tokenized_texts] == expected
+        assert tokenizer.tokenize("Blue Ivy") == ["blue", "ivy"]
+        # Tokens are interned, so repeated words share a string.
+        passage_tokens = tokenized_texts[0]
+        assert tokenized_texts[1][0] is passage_tokens[passage_tokens.index("blue")]
+        tokenizer.clear_token_cache()
+        del tokenizer._tokenize  # pylint: disable=protected-access
+        assert tokenizer.tokenize("Blue Ivy") == ["blue", "ivy"]
+
+    def test_pretokenize_tokenizes_texts_in_batches(self):
+        tokenizer = WordTokenizer(Params({}))
+        tokenizer.pretokenize_batch_size = 2
+        texts = ["Text number %d, (with punctuation)." % i for i in range(5)]
+        expected = [tokenizer.tokenize_with_offsets(text) for text in texts]
+        tokenizer.pretokenize(texts, num_workers=2)
+        tokenizer._tokenize_with_offsets = None  # pylint: disable=protected-access
+        assert [tokenizer.tokenize_with_offsets(text) for text in texts] == expected
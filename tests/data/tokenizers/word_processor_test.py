@@ -18,3 +18,24 @@ class TestWordProcessor:
         expected_tokens = ["sentenc", "ha", "crazi", "punctuat"]
         tokens = word_processor.get_tokens(sentence)
         assert tokens == expected_tokens
+
+    def test_get_tokens_with_offsets_keeps_offsets_aligned_with_filtered_words(self):
+        word_processor = WordProcessor(Params({'word_stemmer': 'porter', 'word_filter': 'stopwords'}))
+        sentence = "this (sentence) has 'crazy' \"punctuation\"."
+        tokens, offsets = word_processor.get_tokens_with_offsets(sentence)
+        assert tokens == word_processor.get_tokens(sentence)
+        assert [sentence[start:end] for start, end in offsets] == ["sentence", "has", "crazy", "punctuation"]
+
+    def test_bulk_methods_match_single_sentence_methods(self):
+        word_processor = WordProcessor(Params({'word_stemmer': 'porter', 'word_filter': 'stopwords'}))
+        sentences = ["this (sentence) has 'crazy' \"punctuation\".", "", "Wouldn't  you?", "this"]
+        assert word_processor.get_tokens_bulk(sentences) == [word_processor.get_tokens(sentence)
+                                                             for sentence in sentences]
+        assert word_processor.get_tokens_with_offsets_bulk(sentences) == \
+                [word_processor.get_tokens_with_offsets(sentence) for sentence in sentences]
+
+    def test_bulk_methods_fall_back_when_the_splitter_has_no_offsets(self):
+        word_processor = WordProcessor(Params({'word_splitter': 'no_op'}))
+        sentences = [["already", "split"], ["this", "one", "too"]]
+        assert word_processor.get_tokens_with_offsets_bulk(sentences) == [(["already", "split"], None),
+                                                                          (["this", "one", "too"], None)]
@@ -1,7 +1,9 @@
 # pylint: disable=no-self-use,invalid-name
+import random
 
 from deep_qa.data.tokenizers.word_splitter import SimpleWordSplitter
 from deep_qa.data.tokenizers.word_splitter import SpacyWordSplitter
+from tests.data.tokenizers.reference_word_splitter import ReferenceSimpleWordSplitter
 
 
 class TestSimpleWordSplitter:
@@ -39,6 +41,28 @@ class TestSimpleWordSplitter:
         tokens = self.word_splitter.split_words(sentence)
         assert tokens == expected_tokens
 
+    def test_split_words_with_offsets(self):
+        sentence = "It  ain't (Joe's)\tproblem."
+        tokens, offsets = self.word_splitter.split_words_with_offsets(sentence)
+        assert tokens == self.word_splitter.split_words(sentence)
+        assert offsets == [(0, 2), (4, 6), (6, 9), (10, 11), (11, 14), (14, 16), (16, 17),
+                           (18, 25), (25, 26)]
+
+    def test_matches_reference_implementation(self):
+        reference_splitter = ReferenceSimpleWordSplitter()
+        pieces = (list("\"'.,;)]}:!?%”’([{#$“‘") +
+                  ["n't", "'s", "'ve", "'re", "'ll", "'d", "'m", "n’t", "’s", "mr.", "e.g.", "etc.",
+                   "al.", "a", "word", "n", "s", " ", " ", "\t", "İ"])
+        random.seed(0)
+        sentences = ["".join(random.choice(pieces) for _ in range(random.randint(0, 15)))
+                     for _ in range(20000)]
+        expected_tokens = [reference_splitter.split_words(sentence) for sentence in sentences]
+        assert [self.word_splitter.split_words(sentence) for sentence in sentences] == expected_tokens
+        assert self.word_splitter.split_many(sentences) == expected_tokens
+        for sentence in sentences[:2000]:
+            assert (self.word_splitter.split_words_with_offsets(sentence) ==
+                    reference_splitter.split_words_with_offsets(sentence))
+
 
 class TestSpacyWordSplitter:
     word_splitter = SpacyWordSplitter()
@@ -76,3 +100,18 @@ class TestSpacyWordSplitter:
                            "e.g.", ",", "the", "store"]
         tokens = self.word_splitter.split_words(sentence)
         assert tokens == expected_tokens
+
+    def test_split_words_with_offsets(self):
+        sentence = "It  ain't (Joe's) problem."
+        tokens, offsets = self.word_splitter.split_words_with_offsets(sentence)
+        assert tokens == self.word_splitter.split_words(sentence)
+        for token, (start, end) in zip(tokens, offsets):
+            assert sentence[start:end].lower() == token
+
+    def test_split_many_matches_split_words(self):
+        sentences = ["It  ain't (Joe's) problem.", "", "Mr. and Mrs. Jones, etc."] * 3
+        word_splitter = SpacyWordSplitter(batch_size=2)
+        assert word_splitter.split_many(sentences) == [word_splitter.split_words(sentence)
+                                                       for sentence in sentences]
+        assert word_splitter.split_many_with_offsets(sentences) == \
+                [word_splitter.split_words_with_offsets(sentence) for sentence in sentences]
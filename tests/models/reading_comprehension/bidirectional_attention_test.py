@@ -49,3 +49,74 @@ class TestBidirectionalAttentionFlow(DeepQaTestCase):
         begin_end_idxs = BidirectionalAttentionFlow.get_best_span(span_begin_probs,
                                                                   span_end_probs)
         assert begin_end_idxs == (1, 2)
+
+    def test_get_best_spans_agrees_with_a_left_to_right_scan(self):
+        random = numpy.random.RandomState(3)
+        # Rounding gives us lots of ties, to check that we break them the same way.
+        span_begin_probs = numpy.round(random.rand(200, 13), 1)
+        span_end_probs = numpy.round(random.rand(200, 13), 1)
+        span_begin_probs[:5] = 0
+        spans, probabilities = BidirectionalAttentionFlow.get_best_spans(span_begin_probs, span_end_probs)
+        assert spans.shape == (200, 1, 2)
+        for i in range(200):
+            expected_span = scan_for_best_span(span_begin_probs[i], span_end_probs[i])
+            assert tuple(spans[i, 0]) == expected_span
+            if i >= 5:
+                numpy.testing.assert_almost_equal(probabilities[i, 0],
+                                                  span_begin_probs[i, expected_span[0]] *
+                                                  span_end_probs[i, expected_span[1]])
+        # Asking for the spans some other way shouldn't change which one is best.
+        top_spans, _ = BidirectionalAttentionFlow.get_best_spans(span_begin_probs, span_end_probs, num_spans=3)
+        assert numpy.array_equal(top_spans[:, 0], spans[:, 0])
+
+    def test_get_best_spans_respects_max_span_length_and_mask(self):
+        random = numpy.random.RandomState(4)
+        span_begin_probs = numpy.round(random.rand(50, 9), 1) + 0.01
+        span_end_probs = numpy.round(random.rand(50, 9), 1) + 0.01
+        mask = numpy.ones((50, 9))
+        mask[::2, 6:] = 0
+        spans, probabilities = BidirectionalAttentionFlow.get_best_spans(span_begin_probs,
+                                                                         span_end_probs,
+                                                                         mask=mask,
+                                                                         max_span_length=3,
+                                                                         num_spans=4)
+        for i in range(50):
+            num_words = 6 if i % 2 == 0 else 9
+            candidates = [(begin, end) for end in range(num_words) for begin in range(end + 1)
+                          if (begin < end and end - begin <= 3) or begin == end == 0]
+            candidates.sort(key=lambda span, i=i: -span_begin_probs[i, span[0]] * span_end_probs[i, span[1]])
+            assert [tuple(span) for span in spans[i]] == candidates[:4]
+            numpy.testing.assert_almost_equal(probabilities[i],
+                                              [span_begin_probs[i, begin] * span_end_probs[i, end]
+                                               for begin, end in candidates[:4]])
+        best_spans, _ = BidirectionalAttentionFlow.get_best_spans(span_begin_probs,
+                                                                  span_end_probs,
+                                                                  mask=mask,
+                                                                  max_span_length=3)
+        assert numpy.array_equal(best_spans, spans[:, :1])
+
+    def test_get_best_spans_pads_when_there_are_too_few_spans(self):
+        spans, probabilities = BidirectionalAttentionFlow.get_best_spans(numpy.array([[0.6, 0.4]]),
+                                                                         numpy.array([[0.2, 0.8]]),
+                                                                         num_spans=3)
+        assert spans.tolist() == [[[0, 1], [0, 0], [-1, -1]]]
+        numpy.testing.assert_almost_equal(probabilities, [[0.48, 0.12, 0.0]])
+
+
+def scan_for_best_span(span_begin_probs, span_end_probs):
+    """
+    The one-instance python loop that ``get_best_span`` used to be, to check the vectorized
+    version against.
+    """
+    max_span_probability = 0
+    best_word_span = (0, 1)
+    begin_span_argmax = 0
+    for j, _ in enumerate(span_begin_probs):
+        val1 = span_begin_probs[begin_span_argmax]
+        val2 = span_end_probs[j]
+        if val1 * val2 > max_span_probability:
+            best_word_span = (begin_span_argmax, j)
+            max_span_probability = val1 * val2
+        if val1 < span_begin_probs[j]:
+            begin_span_argmax = j
+    return best_word_span
@@ -1,6 +1,7 @@
 # pylint: disable=invalid-name,no-self-use
 import json
 import os
+from unittest import mock
 
 import numpy
 from numpy.testing import assert_almost_equal
@@ -33,6 +34,20 @@ class TestRun(DeepQaTestCase):
         run_model_from_file(self.param_path)
         score_dataset(self.param_path, [self.TEST_FILE])
 
+    def test_score_dataset_uses_the_dataset_cache(self):
+        with open(self.param_path) as param_file:
+            model_params = json.load(param_file)
+        cache_directory = os.path.join(self.TEST_DIR, "dataset_cache")
+        model_params['dataset_cache'] = {'directory': cache_directory}
+        with open(self.param_path, "w") as param_file:
+            json.dump(model_params, param_file)
+        run_model_from_file(self.param_path)
+        predictions, _ = score_dataset(self.param_path, [self.TEST_FILE])
+        num_cached = len(os.listdir(cache_directory))
+        cached_predictions, _ = score_dataset(self.param_path, [self.TEST_FILE])
+        assert len(os.listdir(cache_directory)) == num_cached
+        assert_almost_equal(predictions, cached_predictions)
+
     def test_evalaute_model_does_not_crash(self):
         run_model_from_file(self.param_path)
         evaluate_model(self.param_path, [self.TEST_FILE])
@@ -49,3 +64,44 @@ class TestRun(DeepQaTestCase):
         predictions = numpy.asarray([[.5, .5, .6], [.1, .4, .0]])
         labels = numpy.asarray([[1, 0, 0], [0, 1, 0]])
         assert compute_accuracy(predictions, labels) == .5
+
+
+class TestScoringWithRaggedOutputs(DeepQaTestCase):
+    def test_score_dataset_with_ensemble_averages_ragged_outputs_instance_by_instance(self):
+        # Two models that padded the instances to different lengths, as with dynamic padding.
+        first_predictions = numpy.empty(2, dtype=object)
+        first_predictions[0] = numpy.array([0.2, 0.8, 0.0])
+        first_predictions[1] = numpy.array([1.0, 0.0, 0.0])
+        second_predictions = numpy.empty(2, dtype=object)
+        second_predictions[0] = numpy.array([0.6, 0.4])
+        second_predictions[1] = numpy.array([0.5, 0.5, 0.0, 0.0])
+        models = [FakeModel([numpy.array([[1.0], [3.0]]), first_predictions]),
+                  FakeModel([numpy.array([[3.0], [5.0]]), second_predictions])]
+        with mock.patch('deep_qa.run.load_model', side_effect=models):
+            (dense, ragged), _ = score_dataset_with_ensemble(['first', 'second'], ['data'])
+        assert_almost_equal(dense, [[2.0], [4.0]])
+        assert ragged.dtype == object
+        assert_almost_equal(ragged[0], [0.4, 0.6, 0.0])
+        assert_almost_equal(ragged[1], [0.75, 0.25, 0.0, 0.0])
+
+    def test_compute_accuracy_handles_ragged_outputs(self):
+        predictions = numpy.empty(3, dtype=object)
+        predictions[0] = numpy.array([0.1, 0.9])
+        predictions[1] = numpy.array([0.1, 0.2, 0.7, 0.0])
+        predictions[2] = numpy.array([0.6, 0.4, 0.0])
+        labels = numpy.empty(3, dtype=object)
+        labels[0] = numpy.array([0, 1])
+        labels[1] = numpy.array([0, 1, 0, 0])
+        labels[2] = numpy.array([1, 0, 0])
+        assert_almost_equal(compute_accuracy(predictions, labels), 2 / 3)
+
+
+class FakeModel:
+    def __init__(self, predictions):
+        self.predictions = predictions
+
+    def load_indexed_dataset(self, dataset_files):  # pylint: disable=unused-argument
+        return None, None
+
+    def score_dataset(self, dataset):  # pylint: disable=unused-argument
+        return self.predictions, None
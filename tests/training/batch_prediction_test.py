@@ -0,0 +1,101 @@
+# pylint: disable=no-self-use,invalid-name
+import json
+import os
+
+import numpy
+import pytest
+
+from deep_qa.common.checks import ConfigurationError
+from deep_qa.testing.test_case import DeepQaTestCase
+from deep_qa.training.batch_prediction import get_prediction_records, get_shard_offsets, predict_file
+
+
+class TestBatchPrediction(DeepQaTestCase):
+    def setUp(self):
+        super(TestBatchPrediction, self).setUp()
+        self.input_file = os.path.join(self.TEST_DIR, "input.tsv")
+        self.output_file = os.path.join(self.TEST_DIR, "predictions.jsonl")
+        self.lines = ["instance %d" % i + " word" * (i % 4) for i in range(23)]
+        self.lines[7] = ""
+        with open(self.input_file, "w") as input_file:
+            input_file.write("\n".join(self.lines) + "\n")
+
+    def read_predictions(self):
+        with open(self.output_file) as output_file:
+            return [json.loads(line) for line in output_file]
+
+    def expected_predictions(self):
+        return [{'line': i, 'predictions': {'length': [len(line)], 'words': [len(line)] * len(line.split())}}
+                for i, line in enumerate(self.lines) if line]
+
+    def test_get_shard_offsets_finds_the_start_of_each_shard(self):
+        offsets = get_shard_offsets(self.input_file, 5)
+        assert len(offsets) == 5
+        with open(self.input_file, 'rb') as input_file:
+            for shard, offset in enumerate(offsets):
+                input_file.seek(offset)
+                assert input_file.readline().decode('utf-8').strip() == self.lines[shard * 5]
+
+    def test_predict_file_writes_predictions_in_input_order(self):
+        num_predictions = predict_file(FakeTextTrainer(), self.input_file, self.output_file, shard_size=5)
+        assert num_predictions == 22
+        assert self.read_predictions() == self.expected_predictions()
+        assert not os.path.exists(self.output_file + ".shards")
+
+    def test_predict_file_with_several_processes_gives_the_same_output(self):
+        predict_file(FakeTextTrainer(), self.input_file, self.output_file, num_processes=3, shard_size=4)
+        assert self.read_predictions() == self.expected_predictions()
+
+    def test_predict_file_resumes_from_finished_shards(self):
+        with pytest.raises(RuntimeError):
+            predict_file(FakeTextTrainer(fail_on_line=17), self.input_file, self.output_file, shard_size=5)
+        shard_directory = self.output_file + ".shards"
+        assert sorted(os.listdir(shard_directory)) == ['manifest.json', 'shard_000000.jsonl',
+                                                       'shard_000001.jsonl', 'shard_000002.jsonl']
+        model = FakeTextTrainer()
+        predict_file(model, self.input_file, self.output_file, shard_size=5)
+        assert model.lines_seen == self.lines[15:]
+        assert self.read_predictions() == self.expected_predictions()
+
+    def test_predict_file_does_not_resume_with_a_different_shard_size(self):
+        with pytest.raises(RuntimeError):
+            predict_file(FakeTextTrainer(fail_on_line=17), self.input_file, self.output_file, shard_size=5)
+        with pytest.raises(ConfigurationError):
+            predict_file(FakeTextTrainer(), self.input_file, self.output_file, shard_size=4)
+
+    def test_get_prediction_records_handles_ragged_outputs(self):
+        ragged = numpy.empty(2, dtype=object)
+        ragged[0] = numpy.array([0.5, 0.5])
+        ragged[1] = numpy.array([1.0])
+        records = get_prediction_records([3, 5], [numpy.array([[1], [2]]), ragged], ['a', 'b'])
+        assert records == [{'line': 3, 'predictions': {'a': [1], 'b': [0.5, 0.5]}},
+                           {'line': 5, 'predictions': {'a': [2], 'b': [1.0]}}]
+
+
+class FakeKerasModel:
+    output_names = ['length', 'words']
+
+
+class FakeTextTrainer:
+    """
+    Predicts the length of each line, and a ragged output with that length repeated for each of
+    its words.
+    """
+    def __init__(self, fail_on_line: int=None):
+        self.model = FakeKerasModel()
+        self.num_workers = 1
+        self.fail_on_line = fail_on_line
+        self.lines_seen = []
+
+    def load_dataset_from_lines(self, lines):
+        return lines
+
+    def score_dataset(self, dataset):
+        self.lines_seen.extend(dataset)
+        if self.fail_on_line is not None and "instance %d word" % self.fail_on_line in dataset:
+            raise RuntimeError("Failing on purpose")
+        lengths = numpy.array([[len(line)] for line in dataset])
+        words = numpy.empty(len(dataset), dtype=object)
+        for index, line in enumerate(dataset):
+            words[index] = numpy.array([len(line)] * len(line.split()))
+        return [lengths, words], None
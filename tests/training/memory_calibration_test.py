@@ -0,0 +1,74 @@
+# pylint: disable=no-self-use,invalid-name
+import gc
+import mmap
+from unittest import mock
+
+import numpy
+import pytest
+
+from deep_qa.common.checks import ConfigurationError
+from deep_qa.common.params import Params
+from deep_qa.common.util import get_memory_usage_bytes
+from deep_qa.data import DataGenerator, IndexedDataset
+from deep_qa.testing.test_case import DeepQaTestCase
+from deep_qa.training.memory_calibration import calibrate_adaptive_memory_usage_constant, fit_memory_usage
+from ..data.data_generator_test import FakeInstance, FakeTextTrainer
+
+
+class TestMemoryCalibration(DeepQaTestCase):
+    def test_fit_memory_usage_recovers_a_line(self):
+        base_memory, memory_per_unit = fit_memory_usage([10, 20, 40], [1100, 2100, 4100])
+        numpy.testing.assert_almost_equal(base_memory, 100)
+        numpy.testing.assert_almost_equal(memory_per_unit, 100)
+        base_memory, memory_per_unit = fit_memory_usage([10, 10], [1000, 1200])
+        assert base_memory == 0
+        numpy.testing.assert_almost_equal(memory_per_unit, 110)
+
+    def test_calibration_finds_the_memory_used_per_unit_of_padding(self):
+        bytes_per_unit = 8000
+        # The biggest instances have a memory scaling of 10 * 10 * 1 = 100; the small ones
+        # shouldn't be used for probing.
+        instances = ([FakeInstance(i, 10, 10, 1) for i in range(16)] +
+                     [FakeInstance(i, 2, 2, 1) for i in range(16, 32)])
+        data_generator = DataGenerator(FakeTextTrainer(), Params({'dynamic_padding': True,
+                                                                  'maximum_batch_size': 16}))
+        model = FakeModel(bytes_per_unit * 100)
+        gc.collect()
+        memory_budget_bytes = get_memory_usage_bytes() + 200 * 1024 * 1024
+        constant = calibrate_adaptive_memory_usage_constant(model,
+                                                            data_generator,
+                                                            IndexedDataset(instances),
+                                                            memory_budget_bytes=memory_budget_bytes,
+                                                            safety_factor=1.0)
+        assert model.batch_sizes == [1, 1, 2, 4, 8, 16]
+        assert all(batch_index < 16 for batch_index in model.seen)
+        expected = 200 * 1024 * 1024 / bytes_per_unit
+        assert 0.8 * expected < constant < 1.1 * expected
+
+    @mock.patch('deep_qa.training.memory_calibration.reset_peak_memory_usage', return_value=False)
+    def test_calibration_fails_if_the_peak_memory_usage_cannot_be_reset(self, _):
+        data_generator = DataGenerator(FakeTextTrainer(), Params({'dynamic_padding': True}))
+        model = FakeModel(1000)
+        with pytest.raises(ConfigurationError):
+            calibrate_adaptive_memory_usage_constant(model,
+                                                     data_generator,
+                                                     IndexedDataset([FakeInstance(0, 2, 2, 1)]))
+        assert model.batch_sizes == []
+
+
+class FakeModel:
+    """
+    Allocates (and touches) ``bytes_per_instance`` bytes for each instance in a batch.  We use
+    ``mmap`` so that the memory really is given back afterwards, instead of being kept around by
+    ``malloc`` for the next batch.
+    """
+    def __init__(self, bytes_per_instance: int):
+        self.bytes_per_instance = bytes_per_instance
+        self.batch_sizes = []
+        self.seen = set()
+
+    def train_on_batch(self, inputs, labels):  # pylint: disable=unused-argument
+        self.batch_sizes.append(len(inputs))
+        self.seen.update(inputs.flatten().tolist())
+        with mmap.mmap(-1, len(inputs) * self.bytes_per_instance) as memory:
+            numpy.frombuffer(memory, dtype='int8')[:] = 1
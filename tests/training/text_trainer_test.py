@@ -2,7 +2,9 @@
 from unittest import mock
 
 from deep_qa.common.params import Params, pop_choice
-from deep_qa.data.datasets import Dataset, SnliDataset
+from deep_qa.data.datasets import Dataset, IndexedDataset, SnliDataset
+from deep_qa.data.instances.text_classification.text_classification_instance import \
+        IndexedTextClassificationInstance
 from deep_qa.layers.encoders import encoders
 from deep_qa.models.text_classification import ClassificationModel
 from deep_qa.testing.test_case import DeepQaTestCase
@@ -66,6 +68,19 @@ class TestTextTrainer(DeepQaTestCase):
         _output_debug_info.side_effect = new_debug
         model.train()
 
+    def test_debugging_validation_data_works_with_a_dataset_cache(self):
+        self.write_true_false_model_files()
+        cache_params = {'directory': self.TEST_DIR + 'dataset_cache'}
+        # The first model puts the indexed validation data in the cache.
+        self.get_model(ClassificationModel, {'dataset_cache': cache_params}).train()
+        model = self.get_model(ClassificationModel, {
+                'dataset_cache': cache_params,
+                'debug': {'data': 'validation', 'layer_names': ['combined_word_embedding_for_sentence_input']},
+                })
+        model.train()
+        assert model.debug_dataset is not None
+        assert len(model.debug_dataset.instances) == len(model.validation_dataset.instances)
+
     def test_load_model_and_fit(self):
         args = Params({
                 'test_files': [self.TEST_FILE],
@@ -128,6 +143,18 @@ class TestTextTrainer(DeepQaTestCase):
         model = self.get_model(ClassificationModel, args)
         model.train()
 
+    def test_padding_percentile_caps_padding_lengths_from_the_training_data(self):
+        self.write_true_false_model_files()
+        model = self.get_model(ClassificationModel, {'padding_percentile': 0.5})
+        lengths = [3, 1, 5, 2]
+        instances = [IndexedTextClassificationInstance(list(range(1, length + 1)), True) for length in lengths]
+        model.set_model_state_from_indexed_dataset(IndexedDataset(instances))
+        assert model.num_sentence_words == 2
+
+        model = self.get_model(ClassificationModel, {'padding_percentile': 0.5, 'num_sentence_words': 4})
+        model.set_model_state_from_indexed_dataset(IndexedDataset(instances))
+        assert model.num_sentence_words == 4
+
     def test_reading_two_datasets_return_identical_types(self):
 
         self.write_true_false_model_files()